@@ -0,0 +1,87 @@
+"""
+Compare message serialization and parsing cost of wire formats.
+
+Run from repository root:
+
+    python -m benchmarks.codec_benchmark
+"""
+import json
+import timeit
+from collections import OrderedDict
+
+from paxos.core import Message, WIRE_BINARY, WIRE_JSON
+
+
+class LegacyMessage(object):
+    """
+    Message implementation preceding __slots__ message classes, kept as the baseline.
+    """
+
+    def __init__(self, message_type, sender_id=None, prop_num=None, **kwargs):
+        self.__dict__['data'] = OrderedDict()
+        self.message_type = message_type
+        self.sender_id = sender_id
+        self.prop_num = prop_num
+        self.data.update(**kwargs)
+
+    def __getattr__(self, key):
+        try:
+            return self.data[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        self.data[key] = value
+
+    def serialize(self):
+        return bytes(json.dumps(self.data).encode('utf-8'))
+
+    @classmethod
+    def unserialize(cls, raw_data):
+        return cls(**json.loads(raw_data))
+
+
+def sample_messages():
+    batch = [['key-{}'.format(i), 'value-{}'.format(i)] for i in range(100)]
+    return OrderedDict([
+        ('heartbeat', dict(message_type=Message.MSG_HEARTBEAT, sender_id=4, prop_num=[4, 12],
+                           heartbeat=1508371200.25, commits=[[1024, [4, 12]]])),
+        ('read', dict(message_type=Message.MSG_READ, key='user:1234')),
+        ('accept x1', dict(message_type=Message.MSG_ACCEPT_REQUEST, sender_id=4, prop_num=[4, 12],
+                           slot=1025, batch=batch[:1], commit_index=1024)),
+        ('accept x100', dict(message_type=Message.MSG_ACCEPT_REQUEST, sender_id=4, prop_num=[4, 12],
+                             slot=1025, batch=batch, commit_index=1024)),
+        ('write 1MB', dict(message_type=Message.MSG_WRITE, key='blob', value='x' * 1024 * 1024)),
+    ])
+
+
+def measure(fn, number):
+    """
+    :return: best time of a single call in microseconds
+    """
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def round_trip(message_class, fields, *args):
+    def run():
+        message = message_class(**fields)
+        parsed = message_class.unserialize(message.serialize(*args))
+        return parsed.message_type, parsed.sender_id, parsed.prop_num
+    return run
+
+
+def main():
+    print('{:<12} {:>12} {:>12} {:>12} {:>9} {:>12}'.format(
+        'message', 'legacy [us]', 'json [us]', 'binary [us]', 'speedup', 'size b/j'))
+    for name, fields in sample_messages().items():
+        number = 20 if name.endswith('MB') else 5000
+        legacy = measure(round_trip(LegacyMessage, fields), number)
+        as_json = measure(round_trip(Message, fields, WIRE_JSON), number)
+        binary = measure(round_trip(Message, fields, WIRE_BINARY), number)
+        sizes = '{}/{}'.format(len(Message(**fields).serialize(WIRE_BINARY)), len(Message(**fields).serialize()))
+        print('{:<12} {:>12.2f} {:>12.2f} {:>12.2f} {:>8.1f}x {:>12}'.format(
+            name, legacy, as_json, binary, legacy / binary, sizes))
+
+
+if __name__ == '__main__':
+    main()
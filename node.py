@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import json
+import signal
+from threading import Thread
+from multiprocessing import Process
+
 import yaml
 
+from paxos import bench
+from paxos.metrics import exposition
+from paxos.profiling import MODES
+from paxos.tracing import LEVELS, format_record
+from paxos.asyncserver import AsyncServer
 from paxos.client import Client
 from paxos.server import Server
+from paxos.sharding import ShardedClient, host_servers, place_groups
 
 DESCRIPTION = 'Run multi-paxos nodes.'
 
@@ -13,8 +24,19 @@ parser = argparse.ArgumentParser(description=DESCRIPTION)
 
 TYPE_CLIENT = 'client'
 TYPE_SERVER = 'server'
+TYPE_HOST = 'host'
+TYPE_BENCH = 'bench'
+TYPE_STATS = 'stats'
+TYPE_TRACE = 'trace'
+TYPE_PROFILE = 'profile'
 MODE_READ = 'r'
 MODE_WRITE = 'w'
+ENGINE_THREADED = 'threaded'
+ENGINE_ASYNCIO = 'asyncio'
+SERVER_ENGINES = {
+    ENGINE_THREADED: Server,
+    ENGINE_ASYNCIO: AsyncServer,
+}
 
 # general
 subparsers = parser.add_subparsers(help='Participant type', dest='type')
@@ -34,13 +56,160 @@ parser_client.add_argument(
     help="Database value for client's write action",
 )
 
+# options shared by a server and all servers of a host
+server_settings_parser = argparse.ArgumentParser(add_help=False)
+server_settings_parser.add_argument(
+    '-e', '--engine', type=str, choices=sorted(SERVER_ENGINES), default=ENGINE_THREADED, dest='engine',
+    help="Server engine: thread per connection or single asyncio event loop",
+)
+server_settings_parser.add_argument(
+    '--batch-size', type=int, dest='batch_size',
+    help="Max number of writes agreed on in one accept round (overrides config)",
+)
+server_settings_parser.add_argument(
+    '--batch-linger', type=float, dest='batch_linger',
+    help="Seconds the first write of a batch waits for more writes (overrides config)",
+)
+server_settings_parser.add_argument(
+    '--partitions', type=int, dest='partitions',
+    help="Number of partitions of consensus state, the same on all servers (overrides config)",
+)
+server_settings_parser.add_argument(
+    '--metrics-port-offset', type=int, dest='metrics_port_offset',
+    help="Serve metrics over HTTP on the server's port plus this offset (overrides config)",
+)
+server_settings_parser.add_argument(
+    '--trace-level', type=str, choices=sorted(LEVELS), dest='trace_level',
+    help="Level of kept trace records, debug keeps records of every request (overrides config)",
+)
+
 # server
-parser_server = subparsers.add_parser(TYPE_SERVER, help='Server')
+parser_server = subparsers.add_parser(TYPE_SERVER, help='Server', parents=[server_settings_parser])
 parser_server.add_argument(
     'address', type=str,
     help="Server address",
 )
 
+# all servers of a host
+parser_host = subparsers.add_parser(TYPE_HOST, help='Servers of all groups placed on a host, one process each',
+                                    parents=[server_settings_parser])
+parser_host.add_argument(
+    'host', type=str,
+    help="Host of the servers, as in their addresses",
+)
+
+# benchmark
+parser_bench = subparsers.add_parser(TYPE_BENCH, help='Measure throughput and latency of the cluster',
+                                     parents=[server_settings_parser])
+parser_bench.add_argument(
+    '--launch', action='store_true', dest='launch',
+    help="Start the servers of the config file on this host for the benchmark, instead of targeting running ones",
+)
+parser_bench.add_argument(
+    '--memory', action='store_true', dest='memory',
+    help="Launched servers use memory storage without write-ahead log and snapshots",
+)
+parser_bench.add_argument(
+    '-n', '--operations', type=int, default=10000, dest='operations',
+    help="Number of operations of the run phase",
+)
+parser_bench.add_argument(
+    '-d', '--duration', type=float, dest='duration',
+    help="Seconds the run phase lasts, instead of a number of operations",
+)
+parser_bench.add_argument(
+    '-r', '--read-ratio', type=float, default=0.9, dest='read_ratio',
+    help="Share of reads in the run phase, from 0 to 1",
+)
+parser_bench.add_argument(
+    '-k', '--keys', type=int, default=1000, dest='keys',
+    help="Number of distinct keys",
+)
+parser_bench.add_argument(
+    '--distribution', type=str, choices=bench.DISTRIBUTIONS, default=bench.DISTRIBUTION_UNIFORM,
+    dest='distribution',
+    help="Key distribution: uniform or zipf, where few hot keys get most requests",
+)
+parser_bench.add_argument(
+    '-s', '--value-size', type=int, default=100, dest='value_size',
+    help="Size of written values in bytes",
+)
+parser_bench.add_argument(
+    '-c', '--concurrency', type=int, default=32, dest='concurrency',
+    help="Number of requests in flight",
+)
+parser_bench.add_argument(
+    '--no-load', action='store_false', dest='load',
+    help="Skip the load phase writing every key once",
+)
+parser_bench.add_argument(
+    '--seed', type=int, dest='seed',
+    help="Seed of the random choice of keys and operations",
+)
+parser_bench.add_argument(
+    '--json', action='store_true', dest='json',
+    help="Print results as JSON, for comparing releases",
+)
+
+# metrics of running servers
+parser_stats = subparsers.add_parser(TYPE_STATS, help='Print metrics of the servers')
+parser_stats.add_argument(
+    'addresses', type=str, nargs='*',
+    help="Addresses of servers to ask, by default all servers of the config file",
+)
+parser_stats.add_argument(
+    '--text', action='store_true', dest='text',
+    help="Print metrics in text exposition format instead of JSON",
+)
+
+# trace records of running servers
+parser_trace = subparsers.add_parser(TYPE_TRACE, help='Print trace records of the servers, merged by time')
+parser_trace.add_argument(
+    'addresses', type=str, nargs='*',
+    help="Addresses of servers to ask, by default all servers of the config file",
+)
+parser_trace.add_argument(
+    '-l', '--level', type=str, choices=sorted(LEVELS), default='debug', dest='level',
+    help="Print records of this level and above",
+)
+parser_trace.add_argument(
+    '-t', '--trace-id', type=lambda value: int(value, 16), dest='trace_id',
+    help="Print records of one request only, trace id in hex as printed",
+)
+parser_trace.add_argument(
+    '-n', '--limit', type=int, dest='limit',
+    help="Print the latest records only, per server",
+)
+parser_trace.add_argument(
+    '--set-level', type=str, choices=sorted(LEVELS), dest='set_level',
+    help="Change the level of records the servers keep, e.g. debug to start tracing every request",
+)
+parser_trace.add_argument(
+    '--set-sample', type=float, dest='set_sample',
+    help="Change the fraction of requests the servers keep records of",
+)
+
+# profiling of running servers
+parser_profile = subparsers.add_parser(TYPE_PROFILE, help='Capture profiles of the servers for a window')
+parser_profile.add_argument(
+    'addresses', type=str, nargs='*',
+    help="Addresses of servers to profile, by default all servers of the config file",
+)
+parser_profile.add_argument(
+    '-m', '--mode', type=str, choices=MODES, dest='mode',
+    help="cProfile of request handling or sampling of stacks of all threads (default from config)",
+)
+parser_profile.add_argument(
+    '-d', '--duration', type=float, dest='duration',
+    help="Seconds the profile is captured for (default from config)",
+)
+
+SERVER_SETTINGS = {
+    'batch_size': int,
+    'batch_linger': float,
+    'partitions': int,
+}
+
 
 def load_config(config_file):
     with open(config_file) as stream:
@@ -52,15 +221,188 @@ def load_config(config_file):
     return config
 
 
+def participant_options(config):
+    """
+    Optional settings shared by clients and servers.
+    """
+    options = {}
+    if 'max_frame_size' in config:
+        options['max_frame_size'] = int(config['max_frame_size'])
+    if 'wire_format' in config:
+        options['wire_format'] = config['wire_format']
+    return options
+
+
+def server_options(config, args):
+    """
+    Server settings from config file, overridden by command line arguments.
+    """
+    options = participant_options(config)
+    for name, cast in SERVER_SETTINGS.items():
+        value = getattr(args, name, None)
+        if value is None:
+            value = config.get(name)
+        if value is not None:
+            options[name] = cast(value)
+    if 'storage' in config:
+        options['storage'] = dict(config['storage'])
+    if config.get('wal'):
+        options['wal'] = dict(config['wal'])
+    if config.get('snapshot'):
+        options['snapshot'] = dict(config['snapshot'])
+    if config.get('metrics'):
+        options['metrics'] = dict(config['metrics'])
+    if getattr(args, 'metrics_port_offset', None) is not None:
+        options['metrics'] = dict(options.get('metrics') or {}, port_offset=args.metrics_port_offset)
+    if config.get('tracing'):
+        options['tracing'] = dict(config['tracing'])
+    if getattr(args, 'trace_level', None) is not None:
+        options['tracing'] = dict(options.get('tracing') or {}, level=args.trace_level)
+    if config.get('profiling'):
+        options['profiling'] = dict(config['profiling'])
+    if config.get('timing'):
+        options['timing'] = dict(config['timing'])
+    return options
+
+
+def config_groups(config):
+    """
+    Paxos groups of a sharded deployment: either listed or placed over hosts by paxos.sharding.place_groups.
+
+    :return: list of server address lists, one per group, None if the config has a single group of servers
+    """
+    groups = config.get('groups')
+    if not groups:
+        return None
+    if isinstance(groups, dict):
+        return place_groups(groups['hosts'], int(groups['count']), int(groups['base_port']), groups.get('size'))
+    return [list(servers) for servers in groups]
+
+
+def group_options(options, group):
+    """
+    :return: server options with {group} in storage prefix, write-ahead log, snapshot and profile paths
+             replaced by group index
+    """
+    options = dict(options)
+    for section, setting in (('storage', 'prefix'), ('wal', 'path'), ('snapshot', 'path'), ('profiling', 'path')):
+        if setting in (options.get(section) or {}):
+            options[section] = dict(options[section])
+            options[section][setting] = options[section][setting].replace('{group}', str(group))
+    return options
+
+
+def run_server(server_class, servers, address, options):
+    """
+    Run a server in the main thread of the process. SIGUSR1 starts capturing a profile with configured settings.
+    """
+    server = server_class(servers=servers, address=address, **options)
+    if hasattr(signal, 'SIGUSR1'):
+        # the handler interrupts the main thread, which may be handling a request, so start in a new thread
+        signal.signal(signal.SIGUSR1, lambda signum, frame: Thread(target=start_profile, args=(server,)).start())
+    server.run()
+
+
+def start_profile(server):
+    try:
+        server.profiler.start()
+    except Exception as e:
+        server.tracer.warning(None, '[Profile] Not started: {}', e)
+
+
 if __name__ == "__main__":
     args = parser.parse_args()
     config = load_config(args.file)
     if not config:
         exit("Terminating: Missing config file.")
+    groups = config_groups(config)
     if args.type == TYPE_CLIENT:
+        options = participant_options(config)
+        if groups:
+            client = ShardedClient(groups, **options)
+        else:
+            client = Client(servers=config['servers'], **options)
         if args.value:
-            Client(servers=config['servers']).run(key=args.key, value=args.value)
+            client.run(key=args.key, value=args.value)
         else:
-            Client(servers=config['servers']).run(key=args.key)
+            client.run(key=args.key)
     elif args.type == TYPE_SERVER:
-        Server(servers=config['servers'], address=args.address).run()
+        server_class = SERVER_ENGINES[args.engine]
+        options = server_options(config, args)
+        servers = config.get('servers')
+        if groups:
+            group = next((index for index, group in enumerate(groups) if args.address in group), None)
+            if group is None:
+                exit("Terminating: {} is not a server of any group.".format(args.address))
+            servers, options = groups[group], group_options(options, group)
+        run_server(server_class, servers, args.address, options)
+    elif args.type == TYPE_HOST:
+        if not groups:
+            exit("Terminating: No groups in config file.")
+        server_class = SERVER_ENGINES[args.engine]
+        options = server_options(config, args)
+        processes = [Process(target=run_server, name=address,
+                             args=(server_class, servers, address, group_options(options, groups.index(servers))))
+                     for servers, address in host_servers(groups, args.host)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.type == TYPE_BENCH:
+        servers = config.get('servers')
+        processes = []
+        if args.launch:
+            options = server_options(config, args)
+            if args.memory:
+                options = dict(options, storage={'engine': 'memory'}, wal=None, snapshot=None)
+            for group, group_servers in enumerate(groups or [servers]):
+                processes += bench.launch_cluster(SERVER_ENGINES[args.engine], group_servers,
+                                                  group_options(options, group) if groups else options)
+            for group_servers in groups or [servers]:
+                if not bench.wait_for_leader(group_servers, **participant_options(config)):
+                    exit("Terminating: No leader elected by {}.".format(', '.join(group_servers)))
+        try:
+            phases = bench.Benchmark(
+                servers, operations=args.operations, duration=args.duration, read_ratio=args.read_ratio,
+                keys=args.keys, distribution=args.distribution, value_size=args.value_size,
+                concurrency=args.concurrency, load=args.load, seed=args.seed, groups=groups,
+                **participant_options(config)).run()
+        finally:
+            for process in processes:
+                process.terminate()
+        if args.json:
+            print(bench.to_json(phases))
+        else:
+            bench.report(phases)
+    elif args.type in (TYPE_STATS, TYPE_TRACE, TYPE_PROFILE):
+        servers = args.addresses or config.get('servers') or [address for group in groups or [] for address in group]
+        client = Client(servers=servers, **participant_options(config))
+        try:
+            if args.type == TYPE_STATS:
+                results = client.stats()
+            elif args.type == TYPE_PROFILE:
+                results = client.profile(mode=args.mode, duration=args.duration)
+            else:
+                settings = {name: value for name, value in (('level', args.set_level), ('sample', args.set_sample))
+                            if value is not None}
+                results = client.trace(level=args.level, trace_id=args.trace_id, limit=args.limit,
+                                       settings=settings or None)
+        finally:
+            client.close()
+        if args.type == TYPE_PROFILE:
+            for address, path in results.items():
+                print('{} {}'.format(address, path))
+        elif args.type == TYPE_TRACE:
+            for address, records in results.items():
+                if records is None:
+                    print('{} unreachable'.format(address))
+            records = sorted(((record, address) for address, records in results.items() for record in records or []),
+                             key=lambda item: item[0][0])
+            for record, address in records:
+                print(format_record(record, address))
+        elif args.text:
+            for address, stats in results.items():
+                print('# {}'.format(address))
+                print(exposition(stats) if stats is not None else '# unreachable\n', end='')
+        else:
+            print(json.dumps(results, indent=2, sort_keys=True))
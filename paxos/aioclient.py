@@ -0,0 +1,304 @@
+import asyncio
+import itertools
+
+from paxos.codec import CodecError
+from paxos.core import Message, IMMEDIATE_TIMOUT, AWAITING_TIMEOUT, WIRE_BINARY
+from paxos.framing import CHUNK_SIZE, FrameBuffer, FrameError, MAX_FRAME_SIZE, encode_frame
+from paxos.helpers import string_to_address
+from paxos.tracing import new_trace_id
+
+
+WRITE_BUFFER_LIMIT = 1024 * 1024     # in bytes, requests wait for the socket to drain above this buffered amount
+
+
+class RequestError(Exception):
+    """
+    Raised when a request can't be completed.
+    """
+
+
+class AsyncConnection(object):
+    """
+    Connection to a single server with any number of requests in flight.
+    Every request gets a request id, responses are matched to requests by it, in any order.
+    Requests issued in one event loop iteration are written to the socket together.
+    """
+
+    def __init__(self, address, max_frame_size=MAX_FRAME_SIZE, wire_format=WIRE_BINARY):
+        self.address = address
+        self.max_frame_size = max_frame_size
+        self.wire_format = wire_format
+        self.reader = None
+        self.writer = None
+        self._request_ids = itertools.count(1)
+        self._pending = {}
+        self._outgoing = []
+        self._connecting = None
+        self._read_task = None
+
+    async def connect(self):
+        """
+        Open the connection unless it is open, requests issued meanwhile wait for the same attempt.
+        """
+        if self.writer is not None:
+            return
+        connecting = self._connecting
+        if connecting is None:
+            connecting = self._connecting = asyncio.ensure_future(self._open())
+            connecting.add_done_callback(self._connected)
+        await asyncio.shield(connecting)
+
+    def _connected(self, future):
+        self._connecting = None
+
+    async def _open(self):
+        host, port = string_to_address(self.address)
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self._read_task = asyncio.ensure_future(self._read_responses(self.reader))
+
+    async def request(self, message, timeout):
+        """
+        :param timeout: in seconds, how long to wait for the response
+        :return: response Message
+        """
+        await self.connect()
+        writer = self.writer
+        if writer is None:      # lost before the request got its turn
+            raise RequestError('Connection to {} closed'.format(self.address))
+        request_id = next(self._request_ids)
+        message.request_id = request_id
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending[request_id] = future
+        timer = loop.call_later(timeout, self._time_out, future, timeout)
+        try:
+            if not self._outgoing:
+                loop.call_soon(self._flush)
+            self._outgoing.append(encode_frame(message.serialize(self.wire_format), self.max_frame_size))
+            if writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                await writer.drain()
+            return await future
+        finally:
+            timer.cancel()
+            self._pending.pop(request_id, None)
+
+    def _time_out(self, future, timeout):
+        if not future.done():
+            future.set_exception(RequestError('No response from {} in {}s'.format(self.address, timeout)))
+
+    def _flush(self):
+        outgoing, self._outgoing = self._outgoing, []
+        if self.writer is not None and outgoing:
+            self.writer.write(b''.join(outgoing))
+
+    async def _read_responses(self, reader):
+        error = None
+        frames = FrameBuffer(self.max_frame_size)
+        try:
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                frames.feed(data)
+                frame = frames.next_frame()
+                while frame is not None:
+                    response = Message.unserialize(frame)
+                    future = self._pending.get(response.request_id)
+                    if future is not None and not future.done():
+                        future.set_result(response)
+                    frame = frames.next_frame()
+        except (OSError, FrameError, CodecError) as e:
+            error = e
+        finally:
+            if self.reader is reader:
+                self._disconnect(RequestError('Connection to {} lost: {!r}'.format(self.address, error)))
+
+    def _disconnect(self, error):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+        self._outgoing = []
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        self._disconnect(RequestError('Connection to {} closed'.format(self.address)))
+
+
+class AsyncClient(object):
+    """
+    Asyncio client keeping many requests in flight on one connection per server.
+
+    Like paxos.client.Client it sends writes and linearizable reads to the leader, found once and cached,
+    follows leader hints of refusing servers and retries with backoff.
+    """
+    ATTEMPTS = 3
+    BACKOFF = 0.05          # in seconds, delay before the second attempt, doubled for every next one
+    BACKOFF_MAX = 1.0       # in seconds
+
+    def __init__(self, servers, max_frame_size=MAX_FRAME_SIZE, wire_format=WIRE_BINARY):
+        self.servers = servers
+        self.quorum_size = len(servers) // 2 + 1
+        self.connections = {node_id: AsyncConnection(address, max_frame_size=max_frame_size, wire_format=wire_format)
+                            for node_id, address in enumerate(servers)}
+        self.leader_id = None
+        self._finding_leader = None
+
+    async def get(self, key, timeout=IMMEDIATE_TIMOUT):
+        """
+        :return: value of the key, empty string if it isn't set
+        :raises RequestError: if all attempts failed
+        """
+        return await self._read(Message(message_type=Message.MSG_READ, key=key, trace_id=new_trace_id()), 'value',
+                                timeout)
+
+    async def mget(self, keys, timeout=IMMEDIATE_TIMOUT):
+        """
+        Read several keys in one request.
+
+        :return: list of values in order of keys
+        :raises RequestError: if all attempts failed
+        """
+        message = Message(message_type=Message.MSG_MULTI_READ, keys=list(keys), trace_id=new_trace_id())
+        values = await self._read(message, 'values', timeout)
+        return list(values)
+
+    async def _read(self, message, field, timeout):
+        """
+        Read from the leader's lease, falling back to a quorum read.
+
+        :param field: field of the response holding the value
+        """
+        redirected = False
+        for attempt in range(AsyncClient.ATTEMPTS):
+            if attempt and not redirected:
+                await self.backoff(attempt)
+            leader_id = self.leader_id
+            if leader_id is not None:
+                message.linearizable = True
+                response = await self._send(leader_id, message, timeout)
+                if response.message_type in (Message.MSG_ACCEPTED, Message.MSG_VALUES):
+                    return getattr(response, field)
+                self.follow_hint(leader_id, response)
+                redirected = self.leader_id not in (None, leader_id)
+                if redirected:
+                    continue
+            message.linearizable = False
+            value = await self.quorum_choice(message, field, timeout)
+            if value is not None:
+                return value
+        raise RequestError('Read failed: {}'.format(message))
+
+    async def set(self, key, value, timeout=AWAITING_TIMEOUT):
+        """
+        :raises RequestError: if all attempts failed
+        """
+        await self._write(Message(message_type=Message.MSG_WRITE, key=key, value=value, trace_id=new_trace_id()),
+                          timeout)
+
+    async def mset(self, items, timeout=AWAITING_TIMEOUT):
+        """
+        Write several keys atomically, in one consensus instance.
+
+        :param items: dictionary or list of (key, value) pairs
+        :raises RequestError: if all attempts failed
+        """
+        items = items.items() if isinstance(items, dict) else items
+        await self._write(Message(message_type=Message.MSG_MULTI_WRITE, items=[[key, value] for key, value in items],
+                                  trace_id=new_trace_id()), timeout)
+
+    async def _write(self, message, timeout):
+        redirected = False
+        for attempt in range(AsyncClient.ATTEMPTS):
+            if attempt and not redirected:
+                await self.backoff(attempt)
+            leader_id = self.leader_id
+            if leader_id is None:
+                leader_id = await self.find_leader(timeout=min(timeout, IMMEDIATE_TIMOUT))
+            if leader_id is not None:
+                response = await self._send(leader_id, message, timeout)
+                if response.message_type == Message.MSG_ACCEPTED:
+                    return
+                self.follow_hint(leader_id, response)
+            redirected = self.leader_id not in (None, leader_id)
+        raise RequestError('Write failed: {}'.format(message))
+
+    async def quorum_read(self, key, timeout=IMMEDIATE_TIMOUT):
+        """
+        :return: value responded by quorum of servers or None
+        """
+        return await self.quorum_choice(Message(message_type=Message.MSG_READ, key=key, trace_id=new_trace_id()),
+                                        'value', timeout)
+
+    async def find_leader(self, timeout=IMMEDIATE_TIMOUT):
+        """
+        Look up the leader, requests issued meanwhile wait for the same lookup.
+        """
+        finding = self._finding_leader
+        if finding is None:
+            finding = self._finding_leader = asyncio.ensure_future(self.quorum_choice(
+                Message(message_type=Message.MSG_READ, key='dummy'), 'leader_id', timeout))
+            finding.add_done_callback(self._leader_found)
+        return await asyncio.shield(finding)
+
+    def _leader_found(self, future):
+        self._finding_leader = None
+        if not future.cancelled() and future.exception() is None:
+            self.leader_id = future.result()
+
+    async def quorum_choice(self, message, field, timeout):
+        """
+        Send message to all servers and return value responded by quorum, as soon as it is known.
+        """
+        pending = [asyncio.ensure_future(self._send(node_id, message, timeout)) for node_id in self.connections]
+        stats = {}
+        remaining = len(pending)
+        try:
+            for next_response in asyncio.as_completed(pending):
+                response = await next_response
+                remaining -= 1
+                if response.message_type != Message.MSG_ERROR:
+                    value = getattr(response, field)
+                    if isinstance(value, list):
+                        value = tuple(value)
+                    stats[value] = stats.get(value, 0) + 1
+                    if stats[value] >= self.quorum_size:
+                        return value
+                if max(stats.values(), default=0) + remaining < self.quorum_size:
+                    return None
+        finally:
+            for future in pending:
+                future.cancel()
+        return None
+
+    def follow_hint(self, node_id, response):
+        """
+        Update cached leader from the response of a server which refused the request.
+        """
+        leader_id = getattr(response, 'leader_id', None)
+        if response.message_type not in (Message.MSG_WRITE_NACK, Message.MSG_READ_NACK) or \
+                leader_id not in self.connections:
+            self.leader_id = None
+        elif leader_id != node_id:
+            self.leader_id = leader_id
+
+    async def backoff(self, attempt):
+        await asyncio.sleep(min(AsyncClient.BACKOFF * 2 ** (attempt - 1), AsyncClient.BACKOFF_MAX))
+
+    async def _send(self, node_id, message, timeout):
+        """
+        :return: response Message, MSG_ERROR response if the request failed
+        """
+        try:
+            return await self.connections[node_id].request(message, timeout)
+        except (OSError, RequestError) as e:
+            return Message(message_type=Message.MSG_ERROR, sender_id=node_id, reason=str(e))
+
+    def close(self):
+        for connection in self.connections.values():
+            connection.close()
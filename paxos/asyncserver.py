@@ -0,0 +1,134 @@
+import asyncio
+import threading
+
+from paxos.codec import CodecError
+from paxos.core import Message
+from paxos.framing import CHUNK_SIZE, FrameBuffer, FrameError, encode_frame
+from paxos.helpers import all_tasks
+from paxos.protocol import PaxosHandler
+from paxos.server import Server
+
+
+class AsyncServer(Server):
+    """
+    Server serving all connections on a single asyncio event loop.
+
+    Messages answered from local state are handled directly on the loop. Messages which make
+    the server contact other nodes (see BLOCKING_MESSAGES) are handed to worker threads, so a running
+    consensus round never stops the loop from serving reads, heartbeats and other proposers' requests.
+    With write-ahead log enabled, acceptor messages waiting for fsync (see DURABLE_MESSAGES) go to worker threads too,
+    and so do messages reading or writing the store (see STORAGE_MESSAGES) unless the storage engine is in memory.
+    Catch-up requests may load a snapshot file and always go to worker threads.
+    Requests with request id are not waited for, so a client pipelining requests gets their responses
+    as soon as they are ready, possibly out of order.
+    """
+    DURABLE_MESSAGES = {Message.MSG_PREPARE, Message.MSG_ACCEPT_REQUEST}
+    # heartbeats and accept requests apply committed entries to the store
+    STORAGE_MESSAGES = {Message.MSG_READ, Message.MSG_MULTI_READ, Message.MSG_HEARTBEAT, Message.MSG_ACCEPT_REQUEST}
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncServer, self).__init__(*args, **kwargs)
+        self.loop = None
+        self.loop_thread_id = None
+        self.aio_server = None
+
+    def run(self):
+        self.tracer.info(None, 'Starting server {} (asyncio)', self.id)
+        self.start_metrics_endpoint()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop_thread_id = threading.get_ident()
+        self.aio_server = self.loop.run_until_complete(asyncio.start_server(
+            self.handle_connection, self.host, self.port, reuse_address=True))
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            self.tracer.info(None, 'Terminating server {}', self.id)
+            self.shutdown()
+        finally:
+            self.aio_server.close()
+            connections = all_tasks(self.loop)
+            for task in connections:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*connections, return_exceptions=True))
+            self.loop.close()
+
+    def shutdown(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        super(AsyncServer, self).shutdown()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve requests one after another until the peer closes the connection.
+        """
+        responder = StreamResponder(self, writer)
+        frames = FrameBuffer(self.max_frame_size)
+        try:
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+                if not data:
+                    if frames.buffered:
+                        self.tracer.warning(None, 'Connection from {} closed inside a frame',
+                                            writer.get_extra_info('peername'))
+                    break
+                frames.feed(data)
+                frame = frames.next_frame()
+                while frame is not None:
+                    if self.profiler.active:
+                        message = self.profiler.profiled(Message.unserialize, frame)
+                    else:
+                        message = Message.unserialize(frame)
+                    await self.dispatch(message, responder)
+                    frame = frames.next_frame()
+        except (OSError, FrameError, CodecError) as e:
+            self.tracer.warning(None, 'Connection from {} closed: {}', writer.get_extra_info('peername'), e)
+        finally:
+            writer.close()
+
+    def blocks_loop(self, message_type):
+        """
+        :return: True if handling the message type may wait on I/O and has to run in a worker thread
+        """
+        return message_type in AsyncServer.BLOCKING_MESSAGES or message_type == Message.MSG_CATCHUP or \
+            (self.wal is not None and message_type in AsyncServer.DURABLE_MESSAGES) or \
+            (self.storage.blocking and message_type in AsyncServer.STORAGE_MESSAGES)
+
+    async def dispatch(self, message, responder):
+        handler = PaxosHandler(message, self, responder)
+        if self.blocks_loop(message.message_type):
+            future = self.loop.run_in_executor(self.handler_executor, handler.process)
+            if message.request_id is None:
+                await future
+        else:
+            handler.process()
+
+
+class StreamResponder(object):
+    """
+    Plays the role of a socket for PaxosHandler.respond, writing frames to an asyncio stream
+    from the event loop as well as from worker threads. Responses ready in one event loop iteration
+    are written to the socket together.
+    """
+
+    def __init__(self, server, writer):
+        self.server = server
+        self.writer = writer
+        self._outgoing = []
+
+    def sendall(self, data):
+        frame = encode_frame(data, self.server.max_frame_size)
+        if threading.get_ident() == self.server.loop_thread_id:
+            self._queue(frame)
+        elif not self.server.loop.is_closed():
+            self.server.loop.call_soon_threadsafe(self._queue, frame)
+
+    def _queue(self, frame):
+        if not self._outgoing:
+            self.server.loop.call_soon(self._flush)
+        self._outgoing.append(frame)
+
+    def _flush(self):
+        outgoing, self._outgoing = self._outgoing, []
+        if not self.writer.transport.is_closing():
+            self.writer.write(b''.join(outgoing))
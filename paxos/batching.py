@@ -0,0 +1,91 @@
+from threading import Event, Lock
+
+
+BATCH_SIZE = 100            # max number of writes sharing one accept round
+BATCH_LINGER = 0.0          # in seconds, how long the first write of a batch waits for others to join
+
+
+class WriteBatch(object):
+    """
+    Client writes agreed on in a single accept round.
+    """
+
+    def __init__(self):
+        self.writes = []
+        self.responses = None
+        self.full = Event()
+        self._lock = Lock()
+        self._callbacks = []
+
+    def resolve(self, responses):
+        """
+        :param responses: response message for every write, in order of writes
+        """
+        with self._lock:
+            self.responses = responses
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(responses)
+
+    def add_done_callback(self, callback):
+        """
+        Call callback with the responses once the batch is agreed on, right away if it already is.
+        Writes joining a batch wait this way instead of holding a thread until the round ends.
+        """
+        with self._lock:
+            if self.responses is None:
+                self._callbacks.append(callback)
+                return
+        callback(self.responses)
+
+
+class WriteBatcher(object):
+    """
+    Groups concurrent writes into batches.
+
+    The first write of a batch leads it: its handler lingers for more writes, waits until
+    the previous batch is agreed on and only then closes the batch and runs the accept round.
+    Writes arriving meanwhile join the batch, so under load batches grow even without lingering.
+    Only leaders occupy a handler thread, handlers of joining writes return and their responses
+    are sent by the leader, so the number of batched writes isn't limited by handler threads.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, linger=BATCH_LINGER):
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.round_lock = Lock()
+        self._lock = Lock()
+        self._open = None
+
+    def submit(self, message):
+        """
+        Add write to the open batch.
+
+        :return: tuple (batch, index of the write in the batch, True if the write leads the batch)
+        """
+        with self._lock:
+            batch = self._open
+            leads = batch is None
+            if leads:
+                batch = self._open = WriteBatch()
+            index = len(batch.writes)
+            batch.writes.append(message)
+            if len(batch.writes) >= self.batch_size:
+                self._open = None
+                batch.full.set()
+        return batch, index, leads
+
+    def close(self, batch):
+        """
+        Stop adding writes to the batch. Must be called by batch leader holding round_lock.
+
+        :return: list of batched write messages
+        """
+        with self._lock:
+            if self._open is batch:
+                self._open = None
+        return batch.writes
+
+    def linger_for(self, batch):
+        if self.linger > 0:
+            batch.full.wait(self.linger)
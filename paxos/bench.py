@@ -0,0 +1,243 @@
+"""
+Load generator measuring throughput and latency of a cluster.
+
+Clients are asyncio coroutines of one AsyncClient, each issuing one request at a time, so concurrency is the number
+of requests in flight. The load phase writes every key once, the run phase issues a mix of reads and writes.
+A sharded deployment gets one AsyncClient per group, keys are sent to their group as by paxos.sharding.ShardedClient.
+"""
+import asyncio
+import bisect
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import Process
+
+from paxos.aioclient import AsyncClient, RequestError
+from paxos.helpers import run_coroutine
+from paxos.sharding import HashRing
+
+DISTRIBUTION_UNIFORM = 'uniform'
+DISTRIBUTION_ZIPF = 'zipf'
+DISTRIBUTIONS = (DISTRIBUTION_UNIFORM, DISTRIBUTION_ZIPF)
+PERCENTILES = (50, 99, 99.9)
+READY_TIMEOUT = 30.0        # in seconds, how long to wait for a launched cluster to elect a leader
+
+
+def percentile(latencies, percent):
+    """
+    :param latencies: sorted list
+    :return: value below which percent of latencies fall, nearest rank
+    """
+    if not latencies:
+        return None
+    rank = max(0, int(len(latencies) * percent / 100.0 + 0.5) - 1)
+    return latencies[min(rank, len(latencies) - 1)]
+
+
+class KeyChooser(object):
+    """
+    Chooses keys of a workload: uniformly or by Zipf's law, where the key of rank k is chosen
+    with probability proportional to 1 / k ** skew, so a few hot keys get most of the requests.
+    """
+
+    def __init__(self, keys, distribution=DISTRIBUTION_UNIFORM, skew=0.99, seed=None):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError('Unknown key distribution: {}'.format(distribution))
+        self.keys = ['key-{}'.format(i) for i in range(keys)]
+        self.random = random.Random(seed)
+        self._cumulative = None
+        if distribution == DISTRIBUTION_ZIPF:
+            self._cumulative = list(itertools.accumulate(1.0 / rank ** skew for rank in range(1, keys + 1)))
+
+    def choose(self):
+        if self._cumulative is None:
+            return self.keys[self.random.randrange(len(self.keys))]
+        point = self.random.random() * self._cumulative[-1]
+        return self.keys[min(bisect.bisect(self._cumulative, point), len(self.keys) - 1)]
+
+
+class PhaseStats(object):
+    """
+    Latencies and errors of the operations of one benchmark phase, by operation name.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = {}
+        self.errors = {}
+        self.duration = 0.0
+
+    def record(self, operation, latency, failed=False):
+        if failed:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+        else:
+            self.latencies.setdefault(operation, []).append(latency)
+
+    def summary(self):
+        """
+        :return: dictionary of operation name and its count, errors, throughput in operations per second
+                 and latency percentiles in milliseconds; operation 'all' sums up all of them
+        """
+        operations = sorted(set(self.latencies) | set(self.errors))
+        result = {}
+        for operation in operations + ['all']:
+            if operation == 'all':
+                latencies = sorted(itertools.chain(*self.latencies.values()))
+                errors = sum(self.errors.values())
+            else:
+                latencies = sorted(self.latencies.get(operation, []))
+                errors = self.errors.get(operation, 0)
+            result[operation] = dict(
+                count=len(latencies),
+                errors=errors,
+                throughput=len(latencies) / self.duration if self.duration else 0.0,
+                **{'p{:g}'.format(percent): percentile(latencies, percent) * 1000 if latencies else None
+                   for percent in PERCENTILES})
+        return result
+
+
+class Benchmark(object):
+    """
+    Drives a read/write mix against a cluster and collects latencies per phase.
+    """
+
+    def __init__(self, servers, operations=10000, duration=None, read_ratio=0.9, keys=1000,
+                 distribution=DISTRIBUTION_UNIFORM, value_size=100, concurrency=32, load=True, seed=None,
+                 groups=None, **client_options):
+        """
+        :param operations: number of operations of the run phase
+        :param duration: in seconds, length of the run phase instead of a number of operations
+        :param read_ratio: share of reads in the run phase, from 0 to 1
+        :param load: write all keys before the run phase, so reads find values
+        :param groups: server address lists of a sharded deployment, one per group, used instead of servers
+        """
+        self.groups = groups or [servers]
+        self.ring = HashRing(len(groups)) if groups else None
+        self.operations = operations
+        self.duration = duration
+        self.read_ratio = read_ratio
+        self.chooser = KeyChooser(keys, distribution, seed=seed)
+        self.value = 'x' * value_size
+        self.concurrency = max(1, concurrency)
+        self.load = load
+        self.client_options = client_options
+        self.clients = []
+
+    def run(self):
+        """
+        :return: list of PhaseStats
+        """
+        return run_coroutine(self.run_phases())
+
+    async def run_phases(self):
+        self.clients = [AsyncClient(servers, **self.client_options) for servers in self.groups]
+        try:
+            phases = []
+            if self.load:
+                keys = iter(self.chooser.keys)
+                phases.append(await self.run_phase('load', lambda: next(keys, None), lambda: 'write'))
+            deadline = time.monotonic() + self.duration if self.duration else None
+            remaining = itertools.count(self.operations, -1)
+
+            def next_key():
+                if (deadline is not None and time.monotonic() >= deadline) or \
+                        (deadline is None and next(remaining) <= 0):
+                    return None
+                return self.chooser.choose()
+
+            def next_operation():
+                return 'read' if self.chooser.random.random() < self.read_ratio else 'write'
+
+            phases.append(await self.run_phase('run', next_key, next_operation))
+            return phases
+        finally:
+            for client in self.clients:
+                client.close()
+
+    def client_of(self, key):
+        return self.clients[self.ring.group_of(key) if self.ring is not None else 0]
+
+    async def run_phase(self, name, next_key, next_operation):
+        """
+        :param next_key: returns key of the next operation, None ends the phase
+        :param next_operation: returns 'read' or 'write'
+        """
+        stats = PhaseStats(name)
+        start = time.monotonic()
+        await asyncio.gather(*(self.worker(stats, next_key, next_operation) for _ in range(self.concurrency)))
+        stats.duration = time.monotonic() - start
+        return stats
+
+    async def worker(self, stats, next_key, next_operation):
+        key = next_key()
+        while key is not None:
+            operation = next_operation()
+            start = time.monotonic()
+            failed = False
+            try:
+                if operation == 'read':
+                    await self.client_of(key).get(key)
+                else:
+                    await self.client_of(key).set(key, self.value)
+            except RequestError:
+                failed = True
+            stats.record(operation, time.monotonic() - start, failed)
+            key = next_key()
+
+
+def report(phases, stream=None):
+    stream = stream or sys.stdout
+    stream.write('{:<6} {:<6} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}\n'.format(
+        'phase', 'op', 'count', 'errors', 'ops/s', 'p50 [ms]', 'p99 [ms]', 'p999 [ms]'))
+    for phase in phases:
+        for operation, result in phase.summary().items():
+            stream.write('{:<6} {:<6} {:>8} {:>7} {:>10.1f} {:>9} {:>9} {:>9}\n'.format(
+                phase.name, operation, result['count'], result['errors'], result['throughput'],
+                *('{:.2f}'.format(result[name]) if result[name] is not None else '-'
+                  for name in ('p50', 'p99', 'p99.9'))))
+
+
+def to_json(phases):
+    return json.dumps({phase.name: phase.summary() for phase in phases}, indent=2, sort_keys=True)
+
+
+def _run_server(server_class, servers, address, options, quiet):
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    server_class(servers=servers, address=address, **options).run()
+
+
+def launch_cluster(server_class, servers, options, quiet=True):
+    """
+    Start a server process for every address of servers.
+
+    :param quiet: discard standard output of the servers, e.g. trace records echoed by their tracers
+    :return: list of started processes
+    """
+    processes = [Process(target=_run_server, name=address, args=(server_class, servers, address, options, quiet),
+                         daemon=True)
+                 for address in servers]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def wait_for_leader(servers, timeout=READY_TIMEOUT, **client_options):
+    """
+    :return: True once servers agree on a leader, False if they didn't within timeout
+    """
+    async def find():
+        client = AsyncClient(servers, **client_options)
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                if await client.find_leader() is not None:
+                    return True
+                await asyncio.sleep(0.2)
+            return False
+        finally:
+            client.close()
+    return run_coroutine(find())
@@ -1,14 +1,20 @@
 import datetime
-from time import time
+from time import time, sleep
 
 from paxos.core import Participant, Message
+from paxos.tracing import new_trace_id
 
 
 class Client(Participant):
     """
     Client participating in read, write operations.
+
+    Client is a session meant for any number of operations: the leader is found once and cached,
+    connections to nodes are kept open, and servers refusing a request tell the client the leader they know.
     """
     ATTEMPTS = 3
+    BACKOFF = 0.05          # in seconds, delay before the second attempt, doubled for every next one
+    BACKOFF_MAX = 1.0       # in seconds
 
     def run(self, key, value=None):
         """
@@ -16,56 +22,198 @@ class Client(Participant):
         """
         start_time = datetime.datetime.now()
         print("Starting client at {}".format(start_time))
-        result = False
-        for attempt_counter in range(0, Client.ATTEMPTS):
-            print("ATTEMPT {}".format(attempt_counter + 1))
-            self.find_leader()
-            if value:
-                if self.leader is None:
-                    print("No leader has been elected. Can't write any values")
-                else:
-                    result = self.write(key, value)
-            else:
-                result = self.read(key)
-            if result:
-                break
+        if value:
+            result = self.set(key, value)
+        else:
+            result = self.get(key) is not None
         if not result:
             print("ERROR. {} attempts failed".format(Client.ATTEMPTS))
+        self.close()
         end_time = time()
         lasted = end_time - start_time.timestamp()
         print("DONE. Took %0.3f seconds" % lasted)
 
+    def get(self, key):
+        """
+        Read value of a key, retrying with backoff.
+
+        :return: value or None if all attempts failed
+        """
+        for attempt in range(Client.ATTEMPTS):
+            if attempt:
+                self.backoff(attempt)
+            value = self.read(key)
+            if value is not None:
+                return value
+        return None
+
+    def mget(self, keys):
+        """
+        Read values of several keys in one request, retrying with backoff.
+
+        :return: list of values in order of keys or None if all attempts failed
+        """
+        for attempt in range(Client.ATTEMPTS):
+            if attempt:
+                self.backoff(attempt)
+            values = self.read_many(keys)
+            if values is not None:
+                return values
+        return None
+
+    def set(self, key, value):
+        """
+        Write value of a key through the leader, following redirects and retrying with backoff.
+
+        :return: True if the write was accepted
+        """
+        return self.submit(Message(message_type=Message.MSG_WRITE, key=key, value=value, trace_id=new_trace_id()))
+
+    def mset(self, items):
+        """
+        Write several keys atomically: all of them are agreed on in one consensus instance.
+
+        :param items: dictionary or list of (key, value) pairs
+        :return: True if the write was accepted
+        """
+        items = items.items() if isinstance(items, dict) else items
+        return self.submit(Message(message_type=Message.MSG_MULTI_WRITE, items=[[key, value] for key, value in items],
+                                   trace_id=new_trace_id()))
+
+    def submit(self, message):
+        """
+        Send write or multi-write message to the leader, following redirects and retrying with backoff.
+        Leader is looked up only if it isn't known.
+
+        :return: True if the write was accepted
+        """
+        redirected = False
+        for attempt in range(Client.ATTEMPTS):
+            if attempt and not redirected:
+                self.backoff(attempt)
+            leader = self.leader if self.leader is not None else self.find_leader()
+            if leader is None:
+                print("No leader has been elected. Can't write any values")
+            elif self.write(message):
+                return True
+            # redirected to another leader is retried there right away
+            redirected = self.leader is not None and self.leader is not leader
+        return False
+
+    def backoff(self, attempt):
+        sleep(min(Client.BACKOFF * 2 ** (attempt - 1), Client.BACKOFF_MAX))
+
+    def follow_hint(self, node, leader_id):
+        """
+        Update cached leader from a server's refusal.
+
+        :param node: node which refused the request
+        :param leader_id: leader known to the node
+        """
+        if leader_id is None or leader_id not in self.nodes:
+            self.leader = None
+        elif self.nodes[leader_id] is not node:
+            print("REDIRECT to leader {}".format(leader_id))
+            self.leader = self.nodes[leader_id]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for node in self.nodes.values():
+            node.close()
+
     def read(self, key):
         """
         Reads value of a key.
-        Read request is sent to all nodes.
-        If quorum agrees on a value, the value is treated as correct and returned.
         """
         print("READ REQUEST: key={}".format(key))
-        message = Message(message_type=Message.MSG_READ, key=key)
-        value = self.quorum_choice(message, 'value')
+        value = self.read_field(Message(message_type=Message.MSG_READ, key=key, trace_id=new_trace_id()), 'value')
         if value:
             print("READ COMPLETE: key={}, value={}".format(key, value))
         else:
             print("READ ERROR: Request has failed".format(key, value))
         return value
 
+    def read_many(self, keys):
+        """
+        Reads values of several keys.
+
+        :return: list of values in order of keys or None if the read failed
+        """
+        print("MULTI READ REQUEST: keys={}".format(keys))
+        values = self.read_field(Message(message_type=Message.MSG_MULTI_READ, keys=list(keys), trace_id=new_trace_id()),
+                                 'values')
+        if values is None:
+            print("MULTI READ ERROR: Request has failed")
+            return None
+        return list(values)
+
+    def read_field(self, message, field):
+        """
+        Read request is sent to the leader, which answers from its lease.
+        If the leader is unknown or has no lease, read request is sent to all nodes.
+        If quorum agrees on a value, the value is treated as correct and returned.
+
+        :param field: field of the response holding the value
+        """
+        value = None
+        leader = self.leader
+        if leader is not None:
+            value = self.lease_read(message, field)
+            if value is None and self.leader is not None and self.leader is not leader:
+                value = self.lease_read(message, field)     # redirected to another leader
+        if value is None:
+            message.linearizable = False
+            value = self.quorum_choice(message, field)
+        return value
+
+    def lease_read(self, message, field):
+        """
+        :return: value read from the leader or None if the leader refused to answer
+        """
+        leader = self.leader
+        message.linearizable = True
+        response = Message.unserialize(leader.send_immediate(message))
+        if response.message_type in (Message.MSG_ACCEPTED, Message.MSG_VALUES):
+            return getattr(response, field)
+        print("LEASE READ REFUSED: {}".format(response))
+        if response.message_type == Message.MSG_READ_NACK:
+            self.follow_hint(leader, response.leader_id)
+        else:
+            self.leader = None
+        return None
+
     def quorum_choice(self, message, field):
         """
-        Send message to all nodes and return value responded by majority of nodes, otherwise None.
+        Send message to all nodes in parallel and return value responded by majority of nodes, otherwise None.
+        Stops waiting as soon as a value reaches quorum or no value can reach it anymore.
+        """
+        nodes = list(self.nodes.values())
+
+        def done(responses):
+            top_count = max(self.count_values(responses, field).values(), default=0)
+            return top_count >= self.quorum_size or top_count + len(nodes) - len(responses) < self.quorum_size
+
+        stats = self.count_values(self.broadcast(message, nodes, done=done), field)
+        print(stats)
+        value = self.choose_value(stats)
+        return value
+
+    @staticmethod
+    def count_values(responses, field):
+        """
+        :return: dictionary of field values of successful responses and their appearances count
         """
         stats = {}
-        for node in self.nodes.values():
-            res = Message.unserialize(node.send_immediate(message))
+        for res in responses:
             if res.message_type != Message.MSG_ERROR:
                 field_value = getattr(res, field)
+                if isinstance(field_value, list):
+                    field_value = tuple(field_value)
                 if field_value not in stats:
                     stats[field_value] = 1
                 else:
                     stats[field_value] += 1
-        print(stats)
-        value = self.choose_value(stats)
-        return value
+        return stats
 
     def choose_value(self, stats):
         """
@@ -82,17 +230,64 @@ class Client(Participant):
                 return top_value[0]
         return None
 
-    def write(self, key, value):
-        print("WRITE REQUEST: key={}, value={}".format(key, value))
-        message = Message(message_type=Message.MSG_WRITE, key=key, value=value)
-        response = Message.unserialize(self.leader.send_awaiting(message))
+    def write(self, message):
+        print("WRITE REQUEST: {}".format(message))
+        leader = self.leader
+        response = Message.unserialize(leader.send_awaiting(message))
         if response.message_type == Message.MSG_ACCEPTED:
-            print('WRITE COMPLETE: key={}, value={}'.format(key, value))
+            print('WRITE COMPLETE: {}'.format(message))
             return True
         print('WRITE ERROR: Request has failed')
         print(response)
+        if response.message_type == Message.MSG_WRITE_NACK:
+            self.follow_hint(leader, response.leader_id)
+        else:
+            self.leader = None
         return False
 
+    def stats(self):
+        """
+        Collect metrics of all servers with MSG_STATS.
+
+        :return: dictionary of server address and its metrics, None for servers which didn't answer
+        """
+        message = Message(message_type=Message.MSG_STATS)
+        results = {}
+        for node in self.nodes.values():
+            response = Message.unserialize(node.send_immediate(message))
+            results[node.address] = response.stats if response.message_type == Message.MSG_STATS else None
+        return results
+
+    def trace(self, level=None, trace_id=None, limit=None, settings=None):
+        """
+        Collect trace records of all servers with MSG_TRACE, see paxos.tracing.Tracer.dump.
+
+        :param settings: tracer settings applied by servers first, e.g. {'level': 'debug'}
+        :return: dictionary of server address and its records, None for servers which didn't answer
+        """
+        message = Message(message_type=Message.MSG_TRACE, level=level, trace=trace_id, limit=limit, settings=settings)
+        results = {}
+        for node in self.nodes.values():
+            response = Message.unserialize(node.send_immediate(message))
+            results[node.address] = response.records if response.message_type == Message.MSG_TRACE else None
+        return results
+
+    def profile(self, mode=None, duration=None):
+        """
+        Start profiling of all servers with MSG_PROFILE, see paxos.profiling.Profiler.
+
+        :return: dictionary of server address and path its profile will be written to, or error message
+        """
+        message = Message(message_type=Message.MSG_PROFILE, mode=mode, duration=duration)
+        results = {}
+        for node in self.nodes.values():
+            response = Message.unserialize(node.send_immediate(message))
+            if response.message_type == Message.MSG_PROFILE:
+                results[node.address] = response.path
+            else:
+                results[node.address] = 'ERROR: {}'.format(getattr(response, 'reason', response.message_type))
+        return results
+
     def find_leader(self):
         """
         Initiate communication with nodes and find leader/proposer for direct connection with him.
@@ -100,6 +295,6 @@ class Client(Participant):
         message = Message(message_type=Message.MSG_READ, key='dummy')
         value = self.quorum_choice(message, 'leader_id')
         print("LEADER FOUND. Node_id: %s" % value)
-        if value:
+        if value is not None:
             self.leader = self.nodes[value]
         return self.leader
@@ -0,0 +1,206 @@
+"""
+Binary message format.
+
+Every message starts with a fixed header: format marker, message type code, flags, sender id and proposal number,
+followed by request id and trace id if flagged, values of the message class FIELDS and, if flagged,
+a dictionary of extra fields.
+Scalars are tagged binary values, strings are length-prefixed, so large values are copied rather than escaped.
+Lists and dictionaries are compact JSON, which is parsed in C and beats pure Python encoding of nested structures.
+"""
+import json
+import struct
+from json import encoder as json_encoder
+
+
+BINARY_MARKER = 0xB7        # first byte of binary messages, JSON messages start with '{'
+
+HEADER = struct.Struct('!BBBiqq')   # marker, type code, flags, sender id, proposal server id, proposal round
+FLAG_SENDER = 1
+FLAG_PROP_NUM = 2
+FLAG_EXTRA = 4
+FLAG_REQUEST_ID = 8
+FLAG_TRACE_ID = 16
+
+TAG_NONE = ord('N')
+TAG_TRUE = ord('T')
+TAG_FALSE = ord('F')
+TAG_INT = ord('I')
+TAG_FLOAT = ord('D')
+TAG_STR = ord('S')
+TAG_BYTES = ord('B')
+TAG_JSON = ord('J')
+
+_LENGTH = struct.Struct('!I')
+_INT = struct.Struct('!q')
+_FLOAT = struct.Struct('!d')
+_INT_MIN = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+_json_scan = json.JSONDecoder().scan_once
+
+
+def _json_unsupported(value):
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+if json_encoder.c_make_encoder is not None:
+    # one-shot C encoder, skipping per call setup of JSONEncoder.encode
+    _c_json_encode = json_encoder.c_make_encoder(
+        None, _json_unsupported, json_encoder.encode_basestring_ascii, None, ':', ',', False, False, True)
+
+    def _json_encode(value):
+        return ''.join(_c_json_encode(value, 0))
+else:
+    _json_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+_classes_by_code = {}
+_codes_by_type = {}
+
+
+class CodecError(Exception):
+    """
+    Raised when message can't be encoded or decoded.
+    """
+
+
+def register(code, message_class):
+    """
+    Assign wire code to a message class. Class must define MESSAGE_TYPE and FIELDS.
+    """
+    _classes_by_code[code] = message_class
+    _codes_by_type[message_class.MESSAGE_TYPE] = code
+
+
+def is_binary(data):
+    return len(data) > 0 and data[0] == BINARY_MARKER
+
+
+def encode(message):
+    code = _codes_by_type.get(message.message_type)
+    if code is None:
+        raise CodecError('No binary code for message type {}'.format(message.message_type))
+    flags = 0
+    sender_id = message.sender_id
+    if sender_id is not None:
+        flags |= FLAG_SENDER
+    else:
+        sender_id = 0
+    prop_num = message.prop_num
+    if prop_num is not None:
+        flags |= FLAG_PROP_NUM
+        server_id, round_no = prop_num
+    else:
+        server_id = round_no = 0
+    if message.extra:
+        flags |= FLAG_EXTRA
+    request_id = message.request_id
+    if request_id is not None:
+        flags |= FLAG_REQUEST_ID
+    trace_id = message.trace_id
+    if trace_id is not None:
+        flags |= FLAG_TRACE_ID
+    try:
+        out = [HEADER.pack(BINARY_MARKER, code, flags, sender_id, server_id, round_no)]
+        if request_id is not None:
+            out.append(_INT.pack(request_id))
+        if trace_id is not None:
+            out.append(_INT.pack(trace_id))
+    except struct.error as e:
+        raise CodecError('Invalid message header: {}'.format(e))
+    for field in message.FIELDS:
+        _encode_value(getattr(message, field), out)
+    if flags & FLAG_EXTRA:
+        _encode_value(message.extra, out)
+    return b''.join(out)
+
+
+def decode(data):
+    """
+    :return: message instance of the class registered for the message type
+    """
+    try:
+        marker, code, flags, sender_id, server_id, round_no = HEADER.unpack_from(data)
+        if marker != BINARY_MARKER:
+            raise ValueError('Not a binary message')
+        message_class = _classes_by_code[code]
+        message = message_class.__new__(message_class)
+        message.message_type = message_class.MESSAGE_TYPE
+        message.sender_id = sender_id if flags & FLAG_SENDER else None
+        message.prop_num = [server_id, round_no] if flags & FLAG_PROP_NUM else None
+        pos = HEADER.size
+        if flags & FLAG_REQUEST_ID:
+            message.request_id = _INT.unpack_from(data, pos)[0]
+            pos += _INT.size
+        else:
+            message.request_id = None
+        if flags & FLAG_TRACE_ID:
+            message.trace_id = _INT.unpack_from(data, pos)[0]
+            pos += _INT.size
+        else:
+            message.trace_id = None
+        for field in message_class.FIELDS:
+            value, pos = _decode_value(data, pos)
+            setattr(message, field, value)
+        if flags & FLAG_EXTRA:
+            message.extra, pos = _decode_value(data, pos)
+        else:
+            message.extra = {}
+        if pos != len(data):
+            raise ValueError('Message length mismatch')
+    except (struct.error, KeyError, IndexError, UnicodeDecodeError, ValueError, StopIteration) as e:
+        raise CodecError('Malformed binary message: {!r}'.format(e))
+    return message
+
+
+def _encode_value(value, out):
+    value_type = type(value)
+    if value_type is str:
+        data = value.encode('utf-8')
+        out.append(b'S' + _LENGTH.pack(len(data)))
+        out.append(data)
+    elif value is None:
+        out.append(b'N')
+    elif value_type is int and _INT_MIN <= value <= _INT_MAX:
+        out.append(b'I' + _INT.pack(value))
+    elif value_type is float:
+        out.append(b'D' + _FLOAT.pack(value))
+    elif value_type is bool:
+        out.append(b'T' if value else b'F')
+    elif value_type is bytes:
+        out.append(b'B' + _LENGTH.pack(len(value)))
+        out.append(value)
+    else:
+        try:
+            data = _json_encode(value).encode('utf-8')
+        except TypeError as e:
+            raise CodecError(str(e))
+        out.append(b'J' + _LENGTH.pack(len(data)))
+        out.append(data)
+
+
+def _decode_value(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == TAG_STR:
+        length, = _LENGTH.unpack_from(data, pos)
+        pos += 4
+        return str(data[pos:pos + length], 'utf-8'), pos + length
+    if tag == TAG_NONE:
+        return None, pos
+    if tag == TAG_INT:
+        return _INT.unpack_from(data, pos)[0], pos + 8
+    if tag == TAG_FLOAT:
+        return _FLOAT.unpack_from(data, pos)[0], pos + 8
+    if tag == TAG_TRUE:
+        return True, pos
+    if tag == TAG_FALSE:
+        return False, pos
+    if tag == TAG_BYTES:
+        length, = _LENGTH.unpack_from(data, pos)
+        pos += 4
+        return bytes(data[pos:pos + length]), pos + length
+    if tag == TAG_JSON:
+        length, = _LENGTH.unpack_from(data, pos)
+        pos += 4
+        return _json_scan(str(data[pos:pos + length], 'utf-8'), 0)[0], pos + length
+    raise ValueError('Unknown value tag {}'.format(tag))
@@ -1,13 +1,24 @@
 import json
+import select
 import socket
 import sys
-from collections import OrderedDict
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
 
+from paxos import codec
+from paxos.framing import FrameError, FrameReader, send_frame, MAX_FRAME_SIZE
 from paxos.helpers import string_to_address
 
 
 IMMEDIATE_TIMOUT = 1        # in seconds
 AWAITING_TIMEOUT = 10       # in seconds
+POOL_MAX_IDLE = 8           # idle connections kept open per node
+POOL_IDLE_TIMEOUT = 30      # in seconds, idle connections older than this are closed instead of reused
+FAN_OUT_WORKERS = 8         # threads sending broadcast messages, per configured server
+WIRE_JSON = 'json'
+WIRE_BINARY = 'binary'
 
 
 class Participant(object):
@@ -15,22 +26,57 @@ class Participant(object):
     Base class for all participating processes: servers and clients.
     """
 
-    def __init__(self, servers):
+    def __init__(self, servers, max_frame_size=MAX_FRAME_SIZE, wire_format=WIRE_BINARY, transport=None):
+        """
+        :param transport: paxos.transport.Transport carrying messages to other participants, by default TCP
+        """
         self.servers = servers
         self.leader = None
+        self.max_frame_size = max_frame_size
+        self.wire_format = wire_format
+        self.transport = transport
         self._init_configuration()
+        self.executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS * len(self.servers),
+                                           thread_name_prefix='fan-out')
 
     def _init_configuration(self):
         self.initial_participants = len(self.servers)
         self.nodes = {}
         for idx, address in enumerate(self.servers):
-            self.nodes[idx] = Node(address=address, node_id=idx)
+            self.nodes[idx] = self.new_node(address, idx)
 
         self.quorum_size = self.initial_participants // 2 + 1
 
+    def new_node(self, address, node_id):
+        """
+        :return: Node sending messages of this participant to the server at address
+        """
+        if self.transport is None:
+            return Node(address=address, node_id=node_id, max_frame_size=self.max_frame_size,
+                        wire_format=self.wire_format)
+        return self.transport.node(self, address, node_id)
+
     def answer_to(self, message, node_id):
         self.nodes[node_id].send_message(message)
 
+    def broadcast(self, message, nodes, done=None, timeout=IMMEDIATE_TIMOUT):
+        """
+        Send message to all nodes in parallel and collect responses in order of arrival.
+
+        :param done: called with responses received so far, returning True stops waiting for the rest.
+                     Requests still in flight are finished in the background and their responses dropped.
+        :param timeout: socket timeout in seconds
+        :return: list of Message responses
+        """
+        data = message.serialize(self.wire_format)
+        futures = [self.executor.submit(node.send_raw, data, timeout) for node in nodes]
+        responses = []
+        for future in as_completed(futures):
+            responses.append(Message.unserialize(future.result()))
+            if done is not None and done(responses):
+                break
+        return responses
+
     def run(self, *args, **kwargs):
         """
         Run participant process. The process terminates when this method returns.
@@ -38,30 +84,146 @@ class Participant(object):
         raise NotImplementedError()
 
 
+class Connection(object):
+    """
+    Long-lived TCP connection to a single node. Socket is opened lazily, on first exchange.
+    """
+
+    def __init__(self, address, max_frame_size=MAX_FRAME_SIZE):
+        self.address = address
+        self.max_frame_size = max_frame_size
+        self.sock = None
+        self.reader = None
+        self.last_used = time.monotonic()
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def connect(self, timeout):
+        self.sock = socket.create_connection(string_to_address(self.address), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = FrameReader(self.sock, max_frame_size=self.max_frame_size)
+
+    def is_healthy(self):
+        """
+        Idle connection should never be readable. If it is, the peer has either closed it
+        or sent data nobody asked for - in both cases the connection can't be reused.
+        """
+        if self.sock is None:
+            return True
+        if self.reader.buffered:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+            self.reader = None
+
+    def exchange(self, data, timeout):
+        """
+        Send one frame and read one frame in response.
+        """
+        self.sock.settimeout(timeout)
+        send_frame(self.sock, data, self.max_frame_size)
+        received = self.reader.read_frame()
+        if received is None:
+            raise ConnectionResetError('Connection closed by peer')
+        return received
+
+
+class ConnectionPool(object):
+    """
+    Keeps idle connections to a node, so consecutive messages don't pay for TCP handshake and teardown.
+    Each connection carries one request at a time, concurrent senders get separate connections.
+    """
+
+    def __init__(self, address, max_idle=POOL_MAX_IDLE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 max_frame_size=MAX_FRAME_SIZE):
+        self.address = address
+        self.max_frame_size = max_frame_size
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = deque()
+        self._lock = Lock()
+
+    def acquire(self):
+        """
+        Return most recently used healthy connection or a new, not yet connected one.
+        """
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            if now - conn.last_used < self.idle_timeout and conn.is_healthy():
+                return conn
+            conn.close()
+        return Connection(self.address, max_frame_size=self.max_frame_size)
+
+    def release(self, conn):
+        if not conn.connected:
+            return
+        conn.last_used = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn in idle:
+            conn.close()
+
+
 class Node(object):
     """
     Stores information about other nodes.
     """
 
-    def __init__(self, address, node_id):
+    def __init__(self, address, node_id, max_frame_size=MAX_FRAME_SIZE, wire_format=WIRE_BINARY):
         """
         :param address: node address as string, e.g. '127.0.0.1:9999'
         :param node_id: id as in Message.issuer_id
+        :param max_frame_size: limit for size of sent and received messages, in bytes
+        :param wire_format: format of sent messages, WIRE_BINARY or WIRE_JSON
         """
         self.address = address
         self.node_id = node_id
+        self.wire_format = wire_format
+        self.pool = ConnectionPool(address, max_frame_size=max_frame_size)
+
+    def _exchange(self, conn, data, timeout):
+        if not conn.connected:
+            conn.connect(timeout)
+        return conn.exchange(data, timeout)
 
-    def _send_on_socket(self, sock, data):
+    def _send_on_socket(self, conn, data, timeout):
         received = Message(message_type=Message.MSG_ERROR,
                            reason='')
         ex = None
         try:
-            # Connect to server and send data
-            sock.connect(string_to_address(self.address))
-            sock.sendall(data)
-
-            # Receive data from the server and shut down
-            received = sock.recv(1024)
+            reused = conn.connected
+            try:
+                received = self._exchange(conn, data, timeout)
+            except (ConnectionResetError, BrokenPipeError):
+                # pooled connection could have been closed by the peer while idle, retry once on a new one
+                conn.close()
+                if not reused:
+                    raise
+                received = self._exchange(conn, data, timeout)
         except ConnectionRefusedError as e:
             received.reason = 'ConnectionRefusedError'
             ex = e
@@ -70,9 +232,13 @@ class Node(object):
             received.reason = 'Socket has timed out'
             ex = e
             print('Socket connected to [ID {}: {}] has timed out'.format(self.node_id, self.address))
-        finally:
-            sock.close()
+        except (OSError, FrameError, codec.CodecError) as e:
+            received.reason = e.__class__.__name__
+            ex = e
+            print('%s –> %s' % (self.address, received))
         if ex is not None:
+            # late or partial response would be read by the next request, never reuse such connection
+            conn.close()
             received = received.serialize()
         return received
 
@@ -83,12 +249,17 @@ class Node(object):
         :param message: Message instance
         :type message: Message
         """
+        return self.send_raw(message.serialize(self.wire_format), timeout)
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setblocking(1)
-        if timeout is not None:
-            sock.settimeout(timeout)
-        received = self._send_on_socket(sock, data=message.serialize())
+    def send_raw(self, data, timeout):
+        """
+        Send already serialized message, which lets broadcasts serialize only once for all nodes.
+        """
+        conn = self.pool.acquire()
+        try:
+            received = self._send_on_socket(conn, data=data, timeout=timeout)
+        finally:
+            self.pool.release(conn)
         return received
 
     def send_immediate(self, message):
@@ -107,43 +278,102 @@ class Node(object):
         """
         return self.send_message(message, timeout=AWAITING_TIMEOUT)
 
+    def close(self):
+        self.pool.close()
+
 
 class MessageBase(object):
     """
     Internal message representation.
     Provides serialization mechanism.
-    All attributes are stored as dictionary elements.
+    Common attributes and attributes listed in FIELDS of the message class are stored in slots,
+    any other attributes passed to constructor are stored in extra dictionary.
+    Request id is set by clients pipelining requests on one connection, responses carry the id of their request.
+    Trace id is set by clients for every request and passed on with messages sent to handle it (see paxos.tracing).
     """
+    __slots__ = ('message_type', 'sender_id', 'prop_num', 'request_id', 'trace_id', 'extra', 'wire_format',
+                 '_proposal')
+    FIELDS = ()
 
-    def __init__(self):
-        self.data = OrderedDict()
+    def __init__(self, message_type, sender_id=None, prop_num=None, request_id=None, trace_id=None, **kwargs):
+        self.message_type = message_type
+        self.sender_id = sender_id
+        self.prop_num = prop_num
+        self.request_id = request_id
+        self.trace_id = trace_id
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.pop(field, None))
+        self.extra = kwargs
+        self.wire_format = None
+        self._proposal = None
 
     def __getattr__(self, key):
-        return self.data[key]
+        if key == 'extra':
+            raise AttributeError(key)
+        try:
+            return self.extra[key]
+        except KeyError:
+            raise AttributeError(key)
 
-    def __setattr__(self, key, value):
-        if key != 'data':
-            self.data[key] = value
-        else:
-            super(MessageBase, self).__setattr__(key, value)
+    @property
+    def proposal(self):
+        """
+        prop_num as ProposalNumber, built once per message.
+        """
+        if self._proposal is None and self.prop_num is not None:
+            self._proposal = ProposalNumber.from_list(self.prop_num)
+        return self._proposal
+
+    @property
+    def data(self):
+        data = OrderedDict([('message_type', self.message_type),
+                            ('sender_id', self.sender_id),
+                            ('prop_num', self.prop_num)])
+        if self.request_id is not None:
+            data['request_id'] = self.request_id
+        if self.trace_id is not None:
+            data['trace_id'] = self.trace_id
+        data.update(self.extra)
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        return data
 
     def __str__(self):
         return str([(key, value) for key, value in self.data.items() if value is not None])
 
-    def serialize(self):
+    def serialize(self, wire_format=WIRE_JSON):
+        """
+        :param wire_format: WIRE_JSON, readable and meant for debugging, or WIRE_BINARY (see paxos.codec)
+        """
+        if wire_format == WIRE_BINARY:
+            return codec.encode(self)
         return bytes(json.dumps(self.data).encode('utf-8'))
 
     @classmethod
     def unserialize(cls, raw_data):
-        data = json.loads(raw_data, encoding='utf-8')
-        obj = cls(**data)
+        """
+        Build message from data in any wire format. The format is remembered, so the message can be
+        answered in the format the sender understands.
+        """
+        if codec.is_binary(raw_data):
+            obj = codec.decode(raw_data)
+            obj.wire_format = WIRE_BINARY
+        else:
+            data = json.loads(raw_data)
+            obj = cls(**data)
+            obj.wire_format = WIRE_JSON
+        obj._proposal = None
         return obj
 
 
 class Message(MessageBase):
     """
     Structures data packets sent between participating nodes.
+    Creating a Message creates an instance of the class registered for its message_type.
     """
+    __slots__ = ()
 
     MSG_READ = 'read'                       # immediate
     MSG_WRITE = 'write'                     # awaiting
@@ -155,14 +385,138 @@ class Message(MessageBase):
     MSG_ACCEPT_NACK = 'accept-nack'         # immediate
     MSG_ACCEPTED = 'accepted'               # immediate TODO: handle gently terminating the socket or let it timeout
     MSG_HEARTBEAT = 'heartbeat'             # immediate
+    MSG_HEARTBEAT_ACK = 'heartbeat-ack'     # immediate, response to heartbeat keeping the connection in sync
+    MSG_CATCHUP = 'catchup'                 # immediate, request for committed log entries missed by a follower
+    MSG_ENTRIES = 'entries'                 # immediate, committed log entries sent in response to catchup
     MSG_ERROR = 'error'                     # immediate, response returned by Node._send_on_socket when failed
+    MSG_READ_NACK = 'read-nack'             # immediate, linearizable read refused by a server without leader lease
+    MSG_MULTI_READ = 'multi-read'           # immediate, read of several keys answered with values
+    MSG_MULTI_WRITE = 'multi-write'         # awaiting, write of several keys applied atomically
+    MSG_VALUES = 'values'                   # immediate, values of keys of a multi-read
+    MSG_STATS = 'stats'                     # immediate, request for metrics answered with a stats message
+    MSG_TRACE = 'trace'                     # immediate, request for trace records answered with a trace message
+    MSG_PROFILE = 'profile'                 # immediate, starts profiling, answered with path of the profile
 
-    def __init__(self, message_type, sender_id=None, prop_num=None, **kwargs):
-        super(Message, self).__init__()
-        self.message_type = message_type
-        self.sender_id = sender_id
-        self.prop_num = prop_num
-        self.data.update(**kwargs)
+    def __new__(cls, message_type=None, *args, **kwargs):
+        if cls is Message:
+            cls = MESSAGE_CLASSES.get(message_type, Message)
+        return super(Message, cls).__new__(cls)
+
+
+class ReadMessage(Message):
+    MESSAGE_TYPE = Message.MSG_READ
+    __slots__ = FIELDS = ('key', 'linearizable')
+
+
+class WriteMessage(Message):
+    MESSAGE_TYPE = Message.MSG_WRITE
+    __slots__ = FIELDS = ('key', 'value')
+
+
+class WriteNackMessage(Message):
+    MESSAGE_TYPE = Message.MSG_WRITE_NACK
+    __slots__ = FIELDS = ('key', 'value', 'leader_id')
+
+
+class PrepareMessage(Message):
+    MESSAGE_TYPE = Message.MSG_PREPARE
+    __slots__ = FIELDS = ('key', 'value', 'from_slot', 'partition')
+
+
+class PrepareNackMessage(Message):
+    MESSAGE_TYPE = Message.MSG_PREPARE_NACK
+    __slots__ = FIELDS = ('leader_id', 'last_heartbeat', 'leader_alive')
+
+
+class PromiseMessage(Message):
+    MESSAGE_TYPE = Message.MSG_PROMISE
+    __slots__ = FIELDS = ('accepted', 'snapshot_index')
+
+
+class AcceptRequestMessage(Message):
+    MESSAGE_TYPE = Message.MSG_ACCEPT_REQUEST
+    __slots__ = FIELDS = ('slot', 'batch', 'commit_index', 'heartbeat', 'partition')
+
+
+class AcceptNackMessage(Message):
+    MESSAGE_TYPE = Message.MSG_ACCEPT_NACK
+    __slots__ = FIELDS = ('slot', 'leader_id', 'leader_prop_num')
+
+
+class AcceptedMessage(Message):
+    MESSAGE_TYPE = Message.MSG_ACCEPTED
+    __slots__ = FIELDS = ('slot', 'key', 'value', 'leader_id', 'lease')
+
+
+class HeartbeatMessage(Message):
+    MESSAGE_TYPE = Message.MSG_HEARTBEAT
+    __slots__ = FIELDS = ('heartbeat', 'commits')
+
+
+class HeartbeatAckMessage(Message):
+    MESSAGE_TYPE = Message.MSG_HEARTBEAT_ACK
+    __slots__ = FIELDS = ('lease',)
+
+
+class CatchupMessage(Message):
+    MESSAGE_TYPE = Message.MSG_CATCHUP
+    __slots__ = FIELDS = ('from_slot', 'partition')
+
+
+class EntriesMessage(Message):
+    MESSAGE_TYPE = Message.MSG_ENTRIES
+    __slots__ = FIELDS = ('entries', 'snapshot')
+
+
+class ErrorMessage(Message):
+    MESSAGE_TYPE = Message.MSG_ERROR
+    __slots__ = FIELDS = ('reason',)
+
+
+class ReadNackMessage(Message):
+    MESSAGE_TYPE = Message.MSG_READ_NACK
+    __slots__ = FIELDS = ('key', 'leader_id')
+
+
+class MultiReadMessage(Message):
+    MESSAGE_TYPE = Message.MSG_MULTI_READ
+    __slots__ = FIELDS = ('keys', 'linearizable')
+
+
+class MultiWriteMessage(Message):
+    MESSAGE_TYPE = Message.MSG_MULTI_WRITE
+    __slots__ = FIELDS = ('items',)
+
+
+class ValuesMessage(Message):
+    MESSAGE_TYPE = Message.MSG_VALUES
+    __slots__ = FIELDS = ('values', 'leader_id')
+
+
+class StatsMessage(Message):
+    MESSAGE_TYPE = Message.MSG_STATS
+    __slots__ = FIELDS = ('stats',)
+
+
+class TraceMessage(Message):
+    MESSAGE_TYPE = Message.MSG_TRACE
+    __slots__ = FIELDS = ('records', 'level', 'trace', 'limit', 'settings')
+
+
+class ProfileMessage(Message):
+    MESSAGE_TYPE = Message.MSG_PROFILE
+    __slots__ = FIELDS = ('mode', 'duration', 'path')
+
+
+# Binary codes are part of the wire format: append new message classes, never reorder them.
+MESSAGE_CLASSES = OrderedDict()
+for code, message_class in enumerate([
+        ReadMessage, WriteMessage, WriteNackMessage, PrepareMessage, PrepareNackMessage, PromiseMessage,
+        AcceptRequestMessage, AcceptNackMessage, AcceptedMessage, HeartbeatMessage, HeartbeatAckMessage,
+        CatchupMessage, EntriesMessage, ErrorMessage, ReadNackMessage, MultiReadMessage, MultiWriteMessage,
+        ValuesMessage, StatsMessage, TraceMessage, ProfileMessage], start=1):
+    MESSAGE_CLASSES[message_class.MESSAGE_TYPE] = message_class
+    codec.register(code, message_class)
 
 
 class ProposalNumber(object):
@@ -172,6 +526,7 @@ class ProposalNumber(object):
     the server_id of object B but lesser round_no
     then A < B
     """
+    __slots__ = ('server_id', 'round_no')
 
     def __init__(self, server_id, round_no):
         self.server_id = server_id
@@ -0,0 +1,111 @@
+import struct
+
+
+HEADER = struct.Struct('!I')        # payload length, unsigned 32-bit big-endian
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 64 * 1024 * 1024   # in bytes, frames announcing bigger payload are rejected
+CHUNK_SIZE = 64 * 1024              # in bytes, size of the buffer socket is read into
+
+
+class FrameError(Exception):
+    """
+    Raised when the stream doesn't contain a valid frame.
+    """
+
+
+def encode_frame(payload, max_frame_size=MAX_FRAME_SIZE):
+    """
+    Prefix payload with its length.
+
+    >>> encode_frame(b'abc')
+    b'\\x00\\x00\\x00\\x03abc'
+    """
+    if len(payload) > max_frame_size:
+        raise FrameError('Frame of {} bytes exceeds limit of {} bytes'.format(len(payload), max_frame_size))
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_frame(sock, payload, max_frame_size=MAX_FRAME_SIZE):
+    sock.sendall(encode_frame(payload, max_frame_size))
+
+
+class FrameBuffer(object):
+    """
+    Splits bytes received in pieces of any size into frames.
+    Data is appended to one buffer, consumed frames are cut off once they take a whole chunk.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._start = 0
+
+    @property
+    def buffered(self):
+        return len(self._buffer) - self._start
+
+    def feed(self, data):
+        self._buffer += data
+
+    def next_frame(self):
+        """
+        Return payload of next complete frame or None if more data is needed.
+        """
+        if self.buffered < HEADER_SIZE:
+            return None
+        length, = HEADER.unpack_from(self._buffer, self._start)
+        if length > self.max_frame_size:
+            raise FrameError('Frame of {} bytes exceeds limit of {} bytes'.format(length, self.max_frame_size))
+        end = self._start + HEADER_SIZE + length
+        if len(self._buffer) < end:
+            return None
+        frame = bytes(self._buffer[self._start + HEADER_SIZE:end])
+        if end == len(self._buffer):
+            del self._buffer[:]
+            self._start = 0
+        elif end >= CHUNK_SIZE:
+            del self._buffer[:end]
+            self._start = 0
+        else:
+            self._start = end
+        return frame
+
+
+class FrameReader(object):
+    """
+    Splits a stream of length-prefixed frames read from a socket.
+    Socket is read in chunks into one reusable buffer, so several frames sent one after another
+    can arrive in a single read and a single frame can span any number of reads.
+    """
+
+    def __init__(self, sock, max_frame_size=MAX_FRAME_SIZE, chunk_size=CHUNK_SIZE):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self._chunk = memoryview(bytearray(chunk_size))
+        self._frames = FrameBuffer(max_frame_size)
+
+    def __iter__(self):
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return
+            yield frame
+
+    @property
+    def buffered(self):
+        return self._frames.buffered
+
+    def read_frame(self):
+        """
+        Return payload of next frame or None if the stream was closed between frames.
+        """
+        while True:
+            frame = self._frames.next_frame()
+            if frame is not None:
+                return frame
+            received = self.sock.recv_into(self._chunk)
+            if not received:
+                if self.buffered:
+                    raise FrameError('Stream closed inside a frame')
+                return None
+            self._frames.feed(self._chunk[:received])
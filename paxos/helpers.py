@@ -1,3 +1,4 @@
+import asyncio
 
 
 def string_to_address(address):
@@ -15,3 +16,32 @@ def string_to_address(address):
 
 def address_to_node_id(servers, address):
     return servers.index(address)
+
+
+def all_tasks(loop):
+    """
+    :return: tasks of the event loop, asyncio.all_tasks is missing on Python 3.6 and Task.all_tasks since 3.9
+    """
+    if hasattr(asyncio, 'all_tasks'):
+        return asyncio.all_tasks(loop)
+    return {task for task in asyncio.Task.all_tasks(loop) if not task.done()}
+
+
+def run_coroutine(coroutine):
+    """
+    Run coroutine on a new event loop and close the loop, like asyncio.run, which is missing on Python 3.6.
+
+    :return: result of the coroutine
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        pending = all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
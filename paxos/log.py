@@ -0,0 +1,170 @@
+from threading import Lock
+
+
+class LogEntry(object):
+    """
+    Value accepted for a slot of the replicated log - a batch of [key, value] writes.
+    Empty batch fills a slot no value was proposed for.
+    """
+
+    def __init__(self, slot, prop_num, batch, committed=False):
+        """
+        :param prop_num: proposal number as list, see ProposalNumber.as_list
+        """
+        self.slot = slot
+        self.prop_num = prop_num
+        self.batch = batch
+        self.committed = committed
+
+    def as_list(self):
+        return [self.slot, self.prop_num, self.batch]
+
+    @staticmethod
+    def from_list(t, committed=False):
+        return LogEntry(t[0], t[1], t[2], committed=committed)
+
+
+class ReplicatedLog(object):
+    """
+    Multi-Paxos log: every slot is a separate consensus instance.
+
+    Slots up to commit_index are all committed, slots up to applied_index are all applied to the store.
+    Entries are applied strictly in slot order. Entries up to snapshot_index are compacted,
+    their effect is only kept in the store and the snapshot.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.commit_index = -1
+        self.applied_index = -1
+        self.snapshot_index = -1
+        self._next_slot = 0
+        self._lock = Lock()
+
+    def allocate_slot(self):
+        with self._lock:
+            slot = self._next_slot
+            self._next_slot += 1
+            return slot
+
+    def reset_next_slot(self, slot):
+        """
+        Continue allocating slots after slot, set by a new leader after recovering previous leader's slots.
+        """
+        with self._lock:
+            self._next_slot = max(slot + 1, self.commit_index + 1)
+
+    def accept(self, slot, prop_num, batch):
+        with self._lock:
+            entry = self.entries.get(slot)
+            if slot <= self.snapshot_index or entry is not None and entry.committed:
+                return
+            self.entries[slot] = LogEntry(slot, prop_num, batch)
+            self._next_slot = max(self._next_slot, slot + 1)
+
+    def accepted_from(self, slot):
+        """
+        :return: entries of all slots starting from slot, as lists
+        """
+        with self._lock:
+            return [entry.as_list() for entry in sorted(self.entries.values(), key=lambda e: e.slot)
+                    if entry.slot >= slot]
+
+    def committed_from(self, slot, limit):
+        with self._lock:
+            slot = max(slot, self.snapshot_index + 1)
+            last = min(self.commit_index, slot + limit - 1)
+            return [self.entries[s].as_list() for s in range(slot, last + 1) if s in self.entries]
+
+    def commit(self, slot):
+        """
+        Mark slot committed, by the proposer which collected quorum of accepts for it.
+        """
+        with self._lock:
+            self.entries[slot].committed = True
+            self._advance_commit_index()
+
+    def learn_commit(self, commit_index, prop_num):
+        """
+        Mark slots up to commit_index committed by a leader proposing with prop_num.
+        Local entry is known to hold the committed value only if it was accepted from the same proposal,
+        as a proposer never proposes two values for one slot under one proposal number.
+
+        :return: first slot which has to be fetched from the leader or None if nothing is missing
+        """
+        with self._lock:
+            for slot in range(self.commit_index + 1, commit_index + 1):
+                entry = self.entries.get(slot)
+                if entry is None or entry.prop_num != prop_num:
+                    return slot
+                entry.committed = True
+                self.commit_index = slot
+        return None
+
+    def restore_commit(self, commit_index):
+        """
+        Mark slots up to commit_index committed, when replaying the write-ahead log.
+        """
+        with self._lock:
+            for slot in range(self.commit_index + 1, commit_index + 1):
+                entry = self.entries.get(slot)
+                if entry is None:
+                    break
+                entry.committed = True
+                self.commit_index = slot
+
+    def install(self, entries):
+        """
+        Store entries already known to be committed, e.g. fetched from the leader.
+        """
+        with self._lock:
+            for t in entries:
+                entry = LogEntry.from_list(t, committed=True)
+                if entry.slot <= self.snapshot_index:
+                    continue
+                self.entries[entry.slot] = entry
+                self._next_slot = max(self._next_slot, entry.slot + 1)
+            self._advance_commit_index()
+
+    def compact(self, slot):
+        """
+        Drop applied entries up to slot, once they are covered by a snapshot.
+        """
+        with self._lock:
+            slot = min(slot, self.applied_index)
+            for s in range(self.snapshot_index + 1, slot + 1):
+                self.entries.pop(s, None)
+            self.snapshot_index = max(self.snapshot_index, slot)
+
+    def restore_snapshot(self, slot):
+        """
+        Continue after a snapshot, which has all slots up to slot applied.
+        """
+        with self._lock:
+            for s in [s for s in self.entries if s <= slot]:
+                del self.entries[s]
+            self.snapshot_index = max(self.snapshot_index, slot)
+            self.commit_index = max(self.commit_index, slot)
+            self.applied_index = max(self.applied_index, slot)
+            self._next_slot = max(self._next_slot, slot + 1)
+            self._advance_commit_index()
+
+    def next_to_apply(self):
+        """
+        :return: next committed but not yet applied entry or None
+        """
+        with self._lock:
+            if self.applied_index < self.commit_index:
+                return self.entries[self.applied_index + 1]
+        return None
+
+    def mark_applied(self, slot):
+        with self._lock:
+            self.applied_index = slot
+
+    def _advance_commit_index(self):
+        while True:
+            entry = self.entries.get(self.commit_index + 1)
+            if entry is None or not entry.committed:
+                break
+            self.commit_index += 1
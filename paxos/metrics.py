@@ -0,0 +1,223 @@
+"""
+Counters, gauges and latency histograms of a server, cheap enough to be always on.
+
+A recorded latency costs a lock acquisition and a bisect over fixed bucket bounds, nothing is allocated.
+Metrics are read with MSG_STATS (`python node.py stats`) or, if enabled, scraped as text from an HTTP endpoint.
+"""
+import bisect
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+
+
+# upper bounds of latency buckets in seconds: 4 buckets per doubling from 10 us to about 40 s
+BUCKET_BOUNDS = tuple(0.00001 * 2 ** (step / 4.0) for step in range(88))
+PERCENTILES = (50, 99, 99.9)
+
+
+class Histogram(object):
+    """
+    Distribution of latencies in logarithmic buckets. Percentiles are estimated by upper bounds of buckets,
+    which are at most 19% above the exact value.
+    """
+    __slots__ = ('counts', 'count', 'total', 'maximum', '_lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self._lock = Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(BUCKET_BOUNDS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.maximum:
+                self.maximum = seconds
+
+    def percentile(self, percent, counts=None, count=None):
+        """
+        :return: upper bound of the bucket holding the percentile in seconds, None if nothing was observed
+        """
+        counts = self.counts if counts is None else counts
+        count = self.count if count is None else count
+        if not count:
+            return None
+        rank = count * percent / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.maximum
+        return self.maximum
+
+    def summary(self):
+        """
+        :return: dictionary of count, sum, max and percentiles, in seconds
+        """
+        with self._lock:
+            counts, count, total, maximum = list(self.counts), self.count, self.total, self.maximum
+        result = {'count': count, 'sum': total, 'max': maximum}
+        for percent in PERCENTILES:
+            result['p{:g}'.format(percent)] = self.percentile(percent, counts, count)
+        return result
+
+
+class Timer(object):
+    """
+    Context manager recording the duration of its block in a histogram.
+    """
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metrics(object):
+    """
+    Registry of named metrics of one server. A name can carry a label, e.g. the peer of a round trip time,
+    written as name{label=value}.
+    """
+
+    def __init__(self, tracer=None):
+        """
+        :param tracer: paxos.tracing.Tracer warned about failing gauges
+        """
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.tracer = tracer
+        self._lock = Lock()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def timer(self, name):
+        """
+        :return: context manager recording duration of its block as latency of name
+        """
+        return Timer(self.histogram(name))
+
+    def gauge(self, name, function):
+        """
+        Register a value read when metrics are collected, e.g. a queue depth.
+
+        :param function: called without arguments, returns a number
+        """
+        self.gauges[name] = function
+
+    def collect(self):
+        """
+        :return: dictionary of counters, gauges and histogram summaries by name
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        gauges = {}
+        for name, function in list(self.gauges.items()):
+            try:
+                gauges[name] = function()
+            except Exception as e:
+                if self.tracer is not None:
+                    self.tracer.warning(None, '[Metrics] Gauge {} failed: {!r}', name, e)
+        return {
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': {name: histogram.summary() for name, histogram in histograms.items()},
+        }
+
+
+def exposition(stats, prefix='paxos_'):
+    """
+    Format collected metrics in Prometheus text exposition format. Histograms are exposed as summaries
+    with quantiles in seconds.
+
+    :param stats: dictionary returned by Metrics.collect
+    """
+    lines = []
+
+    def metric(name):
+        name, _, label = name.partition('{')
+        name = prefix + name.replace('.', '_').replace('-', '_')
+        if label:
+            key, _, value = label.rstrip('}').partition('=')
+            label = '{{{}="{}"}}'.format(key, value)
+        return name, label
+
+    for name, value in sorted(stats['counters'].items()):
+        name, label = metric(name)
+        lines.append('{}_total{} {}'.format(name, label, value))
+    for name, value in sorted(stats['gauges'].items()):
+        name, label = metric(name)
+        lines.append('{}{} {}'.format(name, label, value))
+    for name, summary in sorted(stats['histograms'].items()):
+        name, label = metric(name)
+        name += '_seconds'
+        for percent in PERCENTILES:
+            value = summary['p{:g}'.format(percent)]
+            if value is not None:
+                quantile = 'quantile="{:g}"'.format(percent / 100.0)
+                labels = '{{{},{}'.format(quantile, label[1:]) if label else '{{{}}}'.format(quantile)
+                lines.append('{}{} {}'.format(name, labels, value))
+        lines.append('{}_sum{} {}'.format(name, label, summary['sum']))
+        lines.append('{}_count{} {}'.format(name, label, summary['count']))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsEndpoint(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server answering any GET with the text exposition of a server's metrics.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, collect):
+        """
+        :param collect: returns dictionary of metrics as Metrics.collect
+        """
+        self.collect = collect
+        HTTPServer.__init__(self, address, MetricsRequestHandler)
+
+    def start(self):
+        Thread(target=self.serve_forever, name='metrics', daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = exposition(self.server.collect()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
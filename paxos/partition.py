@@ -0,0 +1,102 @@
+import zlib
+from threading import Lock
+
+from paxos.batching import WriteBatcher, BATCH_SIZE, BATCH_LINGER
+from paxos.core import Message, ProposalNumber
+from paxos.log import ReplicatedLog
+
+
+PARTITIONS = 1              # number of partitions of consensus state, the same on all servers of a cluster
+
+
+def key_tag(key):
+    """
+    Part of a key which decides where the key is placed: the first non-empty {tag} of the key or the whole key.
+
+    >>> key_tag('user:{42}:name')
+    '42'
+    """
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def key_partition(key, partitions):
+    """
+    Index of the partition of a key. If the key contains a {tag}, only the tag is hashed,
+    so keys sharing a tag are in one partition and can be written together by a multi-write.
+    """
+    if partitions == 1:
+        return 0
+    return zlib.crc32(key_tag(key).encode('utf-8')) % partitions
+
+
+class Partition(object):
+    """
+    Consensus state of the keys hashing to one partition: its own replicated log, promised proposal,
+    proposal number and write batcher, each guarded by locks of the partition.
+    Writes to keys of different partitions are agreed on and applied independently, in parallel,
+    and proposals competing in one partition don't reject proposals of another.
+    """
+
+    def __init__(self, index, server_id, batch_size=BATCH_SIZE, batch_linger=BATCH_LINGER):
+        self.index = index
+        self.server_id = server_id
+        self.log = ReplicatedLog()
+        self.batcher = WriteBatcher(batch_size=batch_size, linger=batch_linger)
+        self.catching_up = False
+
+        self._highest_prepare_msg_lock = Lock()
+        self._prepare_phase_complete_lock = Lock()
+        self._own_prop_num_lock = Lock()
+        self.acceptor_lock = Lock()
+        self.apply_lock = Lock()
+        self.catch_up_lock = Lock()
+
+        self._own_prop_num = ProposalNumber(server_id, 0)
+        self._highest_prepare_msg = Message(message_type=Message.MSG_PREPARE,
+                                            sender_id=server_id,
+                                            prop_num=self._own_prop_num.as_list(),
+                                            key='', value='')
+        self._prepare_phase_complete = False
+
+    def get_next_prop_num(self):
+        with self._own_prop_num_lock:
+            self._own_prop_num = self._own_prop_num.increased()
+            return self._own_prop_num
+
+    @property
+    def own_prop_num(self):
+        with self._own_prop_num_lock:
+            return self._own_prop_num
+
+    @own_prop_num.setter
+    def own_prop_num(self, prop_num):
+        with self._own_prop_num_lock:
+            self._own_prop_num = prop_num
+
+    @property
+    def highest_prepare_msg(self):
+        with self._highest_prepare_msg_lock:
+            return self._highest_prepare_msg
+
+    @highest_prepare_msg.setter
+    def highest_prepare_msg(self, msg):
+        with self._highest_prepare_msg_lock:
+            with self._own_prop_num_lock:
+                self._highest_prepare_msg = msg
+                prop_num = ProposalNumber.from_list(msg.prop_num)
+                self._own_prop_num = ProposalNumber(self.server_id, prop_num.round_no)
+
+    @property
+    def prepare_phase_complete(self):
+        with self._prepare_phase_complete_lock:
+            return self._prepare_phase_complete
+
+    @prepare_phase_complete.setter
+    def prepare_phase_complete(self, prepare_status):
+        with self._prepare_phase_complete_lock:
+            self._prepare_phase_complete = prepare_status
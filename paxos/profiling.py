@@ -0,0 +1,204 @@
+"""
+On-demand profiling of a running server for a bounded window.
+
+Profiling is started by MSG_PROFILE (`python node.py profile`) or by SIGUSR1 sent to a server process started
+by node.py, and stops by itself after the window. While it is off, handling a request costs one attribute check.
+
+Two modes are available:
+
+* cprofile - every thread handling requests gets its own cProfile.Profile, enabled only while it decodes
+  and handles a message, so the profile covers PaxosHandler dispatch, codec and store calls and nothing else.
+  Profiles of all threads are merged into one pstats file, read by `python -m pstats` or snakeviz.
+* sampling - a thread samples stacks of all threads of the process every interval, including timers
+  and background jobs, and writes them as collapsed stacks, one per line with its count, read by flamegraph.pl
+  or speedscope. Handling requests isn't slowed down at all.
+"""
+import os
+import pstats
+import sys
+import time
+from collections import Counter
+from cProfile import Profile
+from threading import Event, Lock, Thread, enumerate as enumerate_threads, get_ident
+
+MODE_CPROFILE = 'cprofile'
+MODE_SAMPLING = 'sampling'
+MODES = (MODE_CPROFILE, MODE_SAMPLING)
+EXTENSIONS = {MODE_CPROFILE: 'prof', MODE_SAMPLING: 'folded'}
+
+PATH = 'profiles/node{id}-{time}.{ext}'
+DURATION = 10.0             # in seconds, default length of the window
+MAX_DURATION = 600.0        # in seconds, longest window which can be requested
+INTERVAL = 0.005            # in seconds, period of stack sampling
+FINISH_TIMEOUT = 5.0        # in seconds, how long the end of a window waits for profiled calls to return
+
+
+class ProfilerBusy(Exception):
+    """
+    Raised when a profile is requested while another one is being captured.
+    """
+
+
+class Profiler(object):
+    """
+    Captures one profile at a time for a server.
+    """
+
+    def __init__(self, node_id, path=PATH, duration=DURATION, mode=MODE_CPROFILE, interval=INTERVAL, tracer=None):
+        """
+        :param path: path of written profiles, can contain {id} of the server, {time} and {ext} of the mode
+        :param duration: in seconds, length of the window unless requested otherwise
+        :param tracer: paxos.tracing.Tracer reporting profiles
+        """
+        if mode not in MODES:
+            raise ValueError('Unknown profiling mode: {}'.format(mode))
+        self.node_id = node_id
+        self.path = path
+        self.duration = float(duration)
+        self.mode = mode
+        self.interval = float(interval)
+        self.tracer = tracer
+        self.active = False         # cprofile window is open, checked by every handled request
+        self.last_path = None       # path of the latest written profile
+        self._lock = Lock()
+        self._window = None         # thread of the current window
+        self._stop = Event()
+        self._profiles = {}         # thread id -> cProfile.Profile of the current window
+        self._busy = set()          # ids of threads running a profiled call
+
+    @property
+    def running(self):
+        return self._window is not None
+
+    def start(self, mode=None, duration=None):
+        """
+        Open a profiling window, the profile is written once it closes.
+
+        :return: path the profile will be written to
+        :raises ProfilerBusy: if a profile is being captured
+        """
+        mode = mode or self.mode
+        if mode not in MODES:
+            raise ValueError('Unknown profiling mode: {}'.format(mode))
+        duration = min(max(float(duration or self.duration), 0.0), MAX_DURATION)
+        path = self.path.format(id=self.node_id, time=time.strftime('%Y%m%d-%H%M%S'), ext=EXTENSIONS[mode])
+        with self._lock:
+            if self._window is not None:
+                raise ProfilerBusy('Profile is being captured')
+            self._stop.clear()
+            self._profiles = {}
+            self._window = Thread(target=self._run_window, args=(mode, duration, path), name='profiler', daemon=True)
+            if mode == MODE_CPROFILE:
+                self.active = True
+            self._window.start()
+        self._trace('Profiling ({}) for {:g}s into {}', mode, duration, path)
+        return path
+
+    def stop(self):
+        """
+        Close the current window early, its profile is still written.
+        """
+        self._stop.set()
+
+    def profiled(self, function, *args):
+        """
+        Call function under the profile of the calling thread, if the cprofile window is open.
+        """
+        thread_id = get_ident()
+        with self._lock:
+            if not self.active or thread_id in self._busy:
+                profile = None
+            else:
+                profile = self._profiles.get(thread_id)
+                if profile is None:
+                    profile = self._profiles[thread_id] = Profile()
+                self._busy.add(thread_id)
+        if profile is None:
+            return function(*args)
+        profile.enable()
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+            with self._lock:
+                self._busy.discard(thread_id)
+
+    def _run_window(self, mode, duration, path):
+        try:
+            if mode == MODE_SAMPLING:
+                self._write_samples(self._sample(time.monotonic() + duration), path)
+            else:
+                self._stop.wait(duration)
+                self._write_profiles(self._close_profiles(), path)
+            self.last_path = path
+            self._trace('Profile written to {}', path)
+        except Exception as e:
+            self._trace('Profile {} failed: {!r}', path, e)
+        finally:
+            with self._lock:
+                self.active = False
+                self._window = None
+
+    def _close_profiles(self):
+        """
+        Stop profiling and wait for profiled calls to return, a profile can't be read while it is enabled.
+
+        :return: profiles of threads which returned
+        """
+        deadline = time.monotonic() + FINISH_TIMEOUT
+        with self._lock:
+            self.active = False
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._busy:
+                    break
+            time.sleep(0.01)
+        with self._lock:
+            return [profile for thread_id, profile in self._profiles.items() if thread_id not in self._busy]
+
+    @staticmethod
+    def _write_profiles(profiles, path):
+        _make_directory(path)
+        if not profiles:
+            profiles = [Profile()]      # nothing was handled, still leave an empty profile
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path)
+
+    def _sample(self, deadline):
+        """
+        :return: Counter of collapsed stacks, rooted at the name of their thread
+        """
+        stacks = Counter()
+        own = get_ident()
+        while time.monotonic() < deadline and not self._stop.is_set():
+            names = {thread.ident: thread.name for thread in enumerate_threads()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(os.path.basename(code.co_filename),
+                                                getattr(code, 'co_qualname', code.co_name)))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[';'.join(reversed(stack))] += 1
+            self._stop.wait(self.interval)
+        return stacks
+
+    @staticmethod
+    def _write_samples(stacks, path):
+        _make_directory(path)
+        with open(path, 'w') as stream:
+            for stack, count in stacks.most_common():
+                stream.write('{} {}\n'.format(stack, count))
+
+    def _trace(self, text, *args):
+        if self.tracer is not None:
+            self.tracer.info(None, '[Profile] ' + text, *args)
+
+
+def _make_directory(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
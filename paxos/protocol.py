@@ -1,5 +1,10 @@
-from paxos.core import Message, ProposalNumber, Node
+import time
 from collections import Counter
+from functools import partial
+
+from paxos.core import Message, ProposalNumber, Node
+from paxos.profiling import ProfilerBusy
+from paxos.tracing import DEBUG
 
 
 class PaxosHandler(object):
@@ -12,30 +17,82 @@ class PaxosHandler(object):
         Message.MSG_PREPARE: 'on_prepare',
         Message.MSG_ACCEPT_REQUEST: 'on_accept_request',
         Message.MSG_ACCEPTED: 'on_accepted',
-        Message.MSG_HEARTBEAT: 'on_heartbeat'
+        Message.MSG_HEARTBEAT: 'on_heartbeat',
+        Message.MSG_CATCHUP: 'on_catchup',
+        Message.MSG_MULTI_READ: 'on_multi_read',
+        Message.MSG_MULTI_WRITE: 'on_multi_write',
+        Message.MSG_STATS: 'on_stats',
+        Message.MSG_TRACE: 'on_trace',
+        Message.MSG_PROFILE: 'on_profile',
     }
 
-    def __init__(self, message, server, request):
+    def __init__(self, message, server, request, partition=None):
+        """
+        :param partition: paxos.partition.Partition of the message, found by its keys or partition index if None
+        """
         self.message = message
         self.server = server
         self.request = request
+        self.tracer = server.tracer
+        self.trace_id = message.trace_id
+        self.partition = partition if partition is not None else server.message_partition(message)
         self.quorum_nodes = {node_id: node for node_id, node in self.server.nodes.items() if node_id != self.server.id}
 
     def process(self):
-        function_name = PaxosHandler.HANDLER_FUNCTIONS.get(self.message.message_type, 'on_null')
+        """
+        Handle the message, timing it as handle{type=<message type>}, under the profiler if it is capturing.
+        """
+        if self.server.profiler.active:
+            return self.server.profiler.profiled(self.handle)
+        self.handle()
+
+    def handle(self):
+        message_type = self.message.message_type
+        if self.partition is None and message_type not in (Message.MSG_WRITE, Message.MSG_MULTI_WRITE):
+            self.on_unknown_partition()
+            return
+        function_name = PaxosHandler.HANDLER_FUNCTIONS.get(message_type, 'on_null')
         handler_function = getattr(self, function_name, self.on_null)
-        handler_function()
+        with self.server.metrics.timer('handle{type=%s}' % message_type):
+            handler_function()
 
     def respond(self, message):
-        self.request.sendall(message.serialize())
+        """
+        Respond in the wire format of the handled message, with its request id and trace id.
+        """
+        message.request_id = self.message.request_id
+        message.trace_id = self.trace_id
+        self.request.sendall(message.serialize(self.message.wire_format or self.server.wire_format))
 
     def on_null(self):
-        print('Incorrect message type for message: %s' % self.message.serialize())
+        self.tracer.warning(self.trace_id, 'Incorrect message type for message: {}', self.message)
+        self.respond(Message(message_type=Message.MSG_ERROR, sender_id=self.server.id,
+                             reason='Incorrect message type'))
+
+    def on_unknown_partition(self):
+        self.server.metrics.increment('partition_mismatches')
+        self.tracer.warning(self.trace_id, 'Partition {} of {} from {} not among {} partitions of this server',
+                            self.message.partition, self.message.message_type, self.message.sender_id,
+                            len(self.server.partitions))
+        self.respond(Message(message_type=Message.MSG_ERROR, sender_id=self.server.id,
+                             reason='Unknown partition {}, servers have different numbers of partitions'.format(
+                                 self.message.partition)))
 
     def on_heartbeat(self):
-        self.server.handle_heartbeat(self.message)
+        lease = self.server.handle_heartbeat(self.message)
+        self.respond(Message(message_type=Message.MSG_HEARTBEAT_ACK, sender_id=self.server.id, lease=lease))
 
     def on_read(self):
+        """
+        Answers from the local store. Linearizable reads are answered only by the leader holding a lease.
+        """
+        if self.message.linearizable and not self.server.has_lease():
+            self.server.metrics.increment('read_nacks')
+            self.respond(Message(message_type=Message.MSG_READ_NACK,
+                                 sender_id=self.server.id,
+                                 leader_id=self.server.leader_id,
+                                 key=self.message.key))
+            return
         val = self.server.get(self.message.key)
         val = str(val, 'utf-8') if val is not None else ''
         message = Message(message_type=Message.MSG_ACCEPTED,
@@ -45,86 +102,269 @@ class PaxosHandler(object):
                           value=val)
         self.respond(message)
 
+    def on_multi_read(self):
+        """
+        Answers values of several keys, read from the store in one call. Linearizable like on_read.
+        """
+        if self.message.linearizable and not self.server.has_lease():
+            self.server.metrics.increment('read_nacks')
+            self.respond(Message(message_type=Message.MSG_READ_NACK,
+                                 sender_id=self.server.id,
+                                 leader_id=self.server.leader_id))
+            return
+        values = [str(val, 'utf-8') if val is not None else '' for val in self.server.get_many(self.message.keys)]
+        self.respond(Message(message_type=Message.MSG_VALUES,
+                             sender_id=self.server.id,
+                             leader_id=self.server.leader_id,
+                             values=values))
+
     def on_write(self):
         """
         Handles write request. Acting as a proposer.
         """
-        print('WRITE REQUEST: key={}, value={}'.format(self.message.key, self.message.value))
-        while not self.server.prepare_phase_complete:
-            self.make_prepare_phase()
-        write_response = self.make_accept_phase()
-        self.respond(write_response)
+        self.tracer.debug(self.trace_id, 'WRITE REQUEST: key={}, value={}', self.message.key, self.message.value)
+        self.submit_write()
+
+    def on_multi_write(self):
+        """
+        Handles write of several keys. All of them go to one batch entry, so they are agreed on
+        in one consensus instance and applied to the store atomically.
+        """
+        if self.tracer.enabled(DEBUG, self.trace_id):
+            self.tracer.debug(self.trace_id, 'MULTI WRITE REQUEST: keys={}', [key for key, _ in self.message.items])
+        self.submit_write()
+
+    def submit_write(self):
+        """
+        Concurrent writes are batched and agreed on in one accept round led by the first write of the batch.
+        Server following another leader refuses the write, telling the client the leader.
+        """
+        leader_id = self.server.leader_id
+        if leader_id is not None and leader_id != self.server.id:
+            self.server.metrics.increment('write_nacks')
+            self.respond(self.write_nack(self.message))
+            return
+        if self.partition is None:
+            self.respond(Message(message_type=Message.MSG_ERROR, sender_id=self.server.id,
+                                 reason='Keys of a multi-write must be in one partition, use a common {tag}'))
+            return
+        batcher = self.partition.batcher
+        batch, index, leads = batcher.submit(self.message)
+        if leads:
+            batcher.linger_for(batch)
+            with batcher.round_lock:
+                writes = batcher.close(batch)
+                responses = None
+                try:
+                    for _ in range(self.server.PREPARE_ATTEMPTS):
+                        if self.partition.prepare_phase_complete:
+                            break
+                        with self.server.metrics.timer('prepare'):
+                            self.make_prepare_phase()
+                    if self.partition.prepare_phase_complete:
+                        with self.server.metrics.timer('accept'):
+                            responses = self.make_accept_phase(writes)
+                finally:
+                    if responses is None:
+                        responses = [self.write_nack(write) for write in writes]
+                    batch.resolve(responses)
+        batch.add_done_callback(partial(self.respond_batched, index))
+
+    def respond_batched(self, index, responses):
+        """
+        Respond to a write with its response in the agreed batch, possibly from the thread of the batch leader.
+        """
+        try:
+            self.respond(responses[index])
+        except OSError as e:
+            self.tracer.warning(self.trace_id, 'Write response not sent: {}', e)
+
+    def write_nack(self, write):
+        return Message(message_type=Message.MSG_WRITE_NACK, sender_id=self.server.id,
+                       leader_id=self.server.leader_id, key=getattr(write, 'key', None),
+                       value=getattr(write, 'value', None))
+
+    def write_accepted(self, write):
+        return Message(message_type=Message.MSG_ACCEPTED, sender_id=self.server.id,
+                       leader_id=self.server.leader_id, key=getattr(write, 'key', None),
+                       value=getattr(write, 'value', None))
+
+    @staticmethod
+    def write_items(write):
+        """
+        :return: list of [key, value] pairs set by a write or multi-write message
+        """
+        if write.message_type == Message.MSG_MULTI_WRITE:
+            return write.items
+        return [[write.key, write.value]]
+
+    def until_quorum(self, message_type):
+        """
+        Build condition for Participant.broadcast, which stops waiting for responses as soon as
+        quorum of message_type responses is collected or can no longer be collected.
+        Own vote of the proposer is counted implicitly.
+        """
+        needed = self.server.quorum_size - 1
+        total = len(self.quorum_nodes)
+
+        def done(responses):
+            positive = sum(1 for response in responses if response.message_type == message_type)
+            return positive >= needed or positive + total - len(responses) < needed
+        return done
 
     def make_prepare_phase(self):
-        print("PREPARE {}".format(self.message.key))
+        """
+        Phase 1 of Multi-Paxos, run once per partition by a new leader. A successful prepare covers all slots
+        of the partition after the leader's commit index, so until it is rejected, writes skip straight
+        to accept rounds.
+        """
+        key = getattr(self.message, 'key', None)
+        partition = self.partition
+        self.tracer.debug(self.trace_id, 'PREPARE {} partition {}', key, partition.index)
 
         # build prepare message
+        from_slot = partition.log.commit_index + 1
         message = Message(
             message_type=Message.MSG_PREPARE, sender_id=self.server.id,
-            key=self.message.key, prop_num=self.server.get_next_prop_num().as_list())
+            key=key, prop_num=partition.get_next_prop_num().as_list(),
+            from_slot=from_slot, partition=partition.index, trace_id=self.trace_id)
+        own_accepted = self.server.promise(message)
+        if own_accepted is None:
+            self.tracer.info(self.trace_id, 'PREPARE {} ERROR: Higher proposal already promised', key)
+            partition.prepare_phase_complete = False
+            return
 
         # send messages to other nodes
         responses = []
-        for node_id, node in self.quorum_nodes.items():
-            response = Message.unserialize(node.send_immediate(message))
+        accepted = [own_accepted]
+        compacted_by = None
+        for response in self.server.broadcast(message, self.quorum_nodes.values(),
+                                              done=self.until_quorum(Message.MSG_PROMISE)):
             if response.message_type == Message.MSG_PREPARE_NACK:
-                print("PREPARE_NACK {}: {}".format(self.message.key, response))
+                self.tracer.debug(self.trace_id, 'PREPARE_NACK {}: {}', key, response)
+                self.server.metrics.increment('prepare_nacks')
+            elif response.message_type == Message.MSG_PROMISE:
+                accepted.append(response.accepted)
+                if response.snapshot_index is not None and response.snapshot_index >= from_slot:
+                    compacted_by = response.sender_id
             responses.append(response.message_type)
 
+        # slots compacted by an acceptor are committed, but their values are no longer reported
+        if compacted_by is not None:
+            self.tracer.info(self.trace_id, 'PREPARE {}: fetching slots compacted by {}', key, compacted_by)
+            self.server.fetch_committed(partition, compacted_by, from_slot)
+            partition.prepare_phase_complete = False
+            return
+
         # verify prepare phase statistics
-        print("PREPARE {} results: {}".format(self.message.key, responses))
+        self.tracer.debug(self.trace_id, 'PREPARE {} results: {}', key, responses)
         counter = Counter(responses)
         quorum_achieved = (counter[Message.MSG_PROMISE] >= self.server.quorum_size - 1)
-        self.server.prepare_phase_complete = quorum_achieved
+        if quorum_achieved:
+            quorum_achieved = self.recover_slots(from_slot, accepted)
+        partition.prepare_phase_complete = quorum_achieved
+
+        if not partition.prepare_phase_complete:
+            self.tracer.info(self.trace_id, 'PREPARE {} ERROR: Quorum not achieved', key)
+
+    def recover_slots(self, from_slot, accepted):
+        """
+        Finish slots started by previous leaders: for every slot reported by the quorum
+        propose the value accepted with the highest proposal number, fill slots nobody accepted
+        a value for with empty batches.
 
-        if not self.server.prepare_phase_complete:
-            print("PREPARE {} ERROR: Quorum not achieved".format(self.message.key, message))
+        :param accepted: lists of accepted log entries reported by promises
+        """
+        chosen = {}
+        for entries in accepted:
+            for slot, prop_num, batch in entries:
+                if slot not in chosen or \
+                        ProposalNumber.from_list(prop_num) > ProposalNumber.from_list(chosen[slot][0]):
+                    chosen[slot] = (prop_num, batch)
+        last_slot = max(chosen) if chosen else from_slot - 1
+        for slot in range(from_slot, last_slot + 1):
+            batch = chosen[slot][1] if slot in chosen else []
+            self.tracer.info(self.trace_id, 'RECOVER slot {}: {} writes', slot, len(batch))
+            if not self.propose(slot, batch):
+                return False
+        self.partition.log.reset_next_slot(last_slot)
+        return True
+
+    def make_accept_phase(self, writes):
+        """
+        Run accept round for a batch of writes, which are applied atomically.
+
+        :param writes: list of write and multi-write messages
+        :return: list of responses to the writes
+        """
+        batch = [item for write in writes for item in self.write_items(write)]
+        if self.tracer.enabled(DEBUG, self.trace_id):
+            self.tracer.debug(self.trace_id, 'ACCEPT {} writes: {}, traces {}', len(batch), [key for key, _ in batch],
+                              ['{:016x}'.format(write.trace_id) for write in writes if write.trace_id is not None])
 
-    def make_accept_phase(self):
-        print("ACCEPT {}".format(self.message.key))
+        if self.propose(self.partition.log.allocate_slot(), batch):
+            return [self.write_accepted(write) for write in writes]
+        return [self.write_nack(write) for write in writes]
 
+    def propose(self, slot, batch):
+        """
+        Phase 2 of Multi-Paxos for a single slot of the partition. Once quorum accepts, the slot is committed
+        and applied to the store together with all committed slots of the partition preceding it.
+        Accept requests of the leader carry heartbeat data, so they replace heartbeats in a busy cluster.
+        """
+        partition = self.partition
+        leads = self.server.leader_id == self.server.id
         accept_msg = Message(message_type=Message.MSG_ACCEPT_REQUEST, sender_id=self.server.id,
-                             prop_num=self.server.own_prop_num.as_list(),
-                             key=self.message.key, value=self.message.value)
+                             prop_num=partition.own_prop_num.as_list(),
+                             slot=slot, batch=batch, commit_index=partition.log.commit_index,
+                             heartbeat=self.server.sent_heartbeat if leads else None,
+                             partition=partition.index, trace_id=self.trace_id)
+        if not self.server.accept(accept_msg):
+            self.tracer.info(self.trace_id, 'ACCEPT ERROR slot {}: Higher proposal already promised', slot)
+            partition.prepare_phase_complete = False
+            return False
 
         # send accept requests to nodes
-        responses = []
-        for node_id, node in self.quorum_nodes.items():
-            response = Message.unserialize(node.send_immediate(accept_msg)).message_type
-            responses.append(response)
+        sent_at = time.monotonic()
+        responses = self.server.broadcast(accept_msg, self.quorum_nodes.values(),
+                                          done=self.until_quorum(Message.MSG_ACCEPTED))
+        self.server.accepts_acknowledged(sent_at, responses)
+        responses = [response.message_type for response in responses]
 
         # verify accept phase statistics
         counter = Counter(responses)
         if counter[Message.MSG_ACCEPTED] >= self.server.quorum_size - 1:
-            print('ACCEPT COMPLETE {}: {}'.format(self.message.key, self.message.value))
-            self.server.set(self.message.key, self.message.value)
-            write_response = Message(message_type=Message.MSG_ACCEPTED, sender_id=self.server.id,
-                                     leader_id=self.server.leader_id,
-                                     key=self.message.key, value=self.message.value)
-        else:
-            print('ACCEPT ERROR {}: Too few Accepted responses'.format(self.message.key))
-            write_response = Message(message_type=Message.MSG_WRITE_NACK, sender_id=self.server.id,
-                                     key=self.message.key, value=self.message.value)
-        return write_response
+            self.tracer.debug(self.trace_id, 'ACCEPT COMPLETE slot {}: {} writes', slot, len(batch))
+            partition.log.commit(slot)
+            self.server.apply_committed(partition)
+            return True
+        self.tracer.warning(self.trace_id, 'ACCEPT ERROR slot {}: Too few Accepted responses', slot)
+        if counter[Message.MSG_ACCEPT_NACK]:
+            self.server.metrics.increment('accept_nacks', counter[Message.MSG_ACCEPT_NACK])
+        # the slot stays undecided and would stop the commit index, so the next prepare has to finish it
+        partition.prepare_phase_complete = False
+        return False
 
     def on_prepare(self):
         """
         Handles prepare message. Acting as an acceptor.
         """
-        print('PREPARE REQUEST: key={}'.format(self.message.key))
-
-        prop_num = ProposalNumber.from_list(self.message.prop_num)
-        last_prop_num = ProposalNumber.from_list(self.server.highest_prepare_msg.prop_num)
+        self.tracer.debug(self.trace_id, 'PREPARE REQUEST: key={}', self.message.key)
+        if self.message.proposal == ProposalNumber.get_lowest_possible():
+            self.respond(self.server.answer_probe(self.message))
+            return
 
-        if prop_num >= last_prop_num:
+        accepted = self.server.promise(self.message)
+        if accepted is not None:
             response = Message(message_type=Message.MSG_PROMISE,
                                sender_id=self.server.id,
-                               prop_num=self.message.prop_num)
-            self.server.highest_prepare_msg = self.message
+                               prop_num=self.message.prop_num,
+                               accepted=accepted,
+                               snapshot_index=self.partition.log.snapshot_index)
         else:
             response = Message(message_type=Message.MSG_PREPARE_NACK,
                                sender_id=self.server.id,
-                               prop_num=self.server.highest_prepare_msg.prop_num,
+                               prop_num=self.partition.highest_prepare_msg.prop_num,
                                leader_id=self.server.leader_id,
                                last_heartbeat=self.server.last_heartbeat)
         self.respond(response)
@@ -133,26 +373,79 @@ class PaxosHandler(object):
         """
         Handles accept request sent by proposer, which previously successfully ended prepare-promise phase.
         Send accepted or accepted not acknowledged to proposer by the same socket the accept request was received.
+        Accept request also tells which slots the proposer has committed, those are applied after responding.
+        Accept request of the leader carrying heartbeat data is handled as a heartbeat too.
         """
-        print('ACCEPT REQUEST: key={}'.format(self.message.key))
+        self.tracer.debug(self.trace_id, 'ACCEPT REQUEST: slot {}, {} writes',
+                          self.message.slot, len(self.message.batch))
 
-        prop_num = ProposalNumber.from_list(self.message.prop_num)
-        prepare_msg = self.server.highest_prepare_msg
-        condition = (prop_num == ProposalNumber.from_list(prepare_msg.prop_num))
-        if condition:
-            self.server.set(self.message.key, self.message.value)
+        if self.server.accept(self.message):
+            lease = None
+            if self.message.heartbeat is not None:
+                lease = self.server.handle_heartbeat(self.message, learn=False)
             response = Message(message_type=Message.MSG_ACCEPTED,
                                sender_id=self.server.id,
                                prop_num=self.message.prop_num,
                                leader_id=self.server.leader_id,
-                               key=self.message.key,
-                               value=self.message.value)
-            print('ACCEPT COMPLETE {}: {}'.format(self.message.key, self.message.value))
+                               slot=self.message.slot,
+                               lease=lease)
+            self.tracer.debug(self.trace_id, 'ACCEPT COMPLETE slot {}', self.message.slot)
         else:
             response = Message(message_type=Message.MSG_ACCEPT_NACK,
                                sender_id=self.server.id,
                                prop_num=self.message.prop_num,
                                leader_id=self.server.leader_id,
-                               leader_prop_num=self.server.highest_prepare_msg.prop_num)
-            print('ACCEPT NACK {}: {}'.format(self.message.key, self.message.value))
+                               leader_prop_num=self.partition.highest_prepare_msg.prop_num,
+                               slot=self.message.slot)
+            self.tracer.debug(self.trace_id, 'ACCEPT NACK slot {}', self.message.slot)
         self.respond(response)
+        if response.message_type == Message.MSG_ACCEPTED:
+            self.server.learn_commit(self.partition, self.message.commit_index, self.message.prop_num,
+                                     self.message.sender_id)
+
+    def on_catchup(self):
+        """
+        Sends committed log entries of a partition to a follower which missed them.
+        Followers behind the compacted part of the log get the partition's part of the latest snapshot first.
+        """
+        partition = self.partition
+        from_slot = self.message.from_slot
+        snapshot = None
+        if from_slot <= partition.log.snapshot_index:
+            snapshot = self.server.partition_snapshot(partition)
+            from_slot = snapshot['slot'] + 1
+        entries = partition.log.committed_from(from_slot, self.server.CATCHUP_LIMIT)
+        self.respond(Message(message_type=Message.MSG_ENTRIES,
+                             sender_id=self.server.id,
+                             entries=entries,
+                             snapshot=snapshot))
+
+    def on_stats(self):
+        """
+        Answers metrics of the server, see paxos.metrics.Metrics.collect, with statistics of snapshots.
+        """
+        stats = self.server.collect_metrics()
+        self.respond(Message(message_type=Message.MSG_STATS, sender_id=self.server.id, stats=stats))
+
+    def on_trace(self):
+        """
+        Answers records of the server's ring buffer, see paxos.tracing.Tracer.dump. Settings of the request
+        reconfigure the tracer first, e.g. to start keeping debug records.
+        """
+        message = self.message
+        if message.settings:
+            self.tracer.configure(**message.settings)
+        records = self.tracer.dump(level=message.level or 'debug', trace_id=message.trace, limit=message.limit)
+        self.respond(Message(message_type=Message.MSG_TRACE, sender_id=self.server.id, records=records))
+
+    def on_profile(self):
+        """
+        Starts capturing a profile of the server for a window, see paxos.profiling.Profiler.
+        Answers the path the profile will be written to once the window closes.
+        """
+        try:
+            path = self.server.profiler.start(mode=self.message.mode, duration=self.message.duration)
+        except (ProfilerBusy, ValueError) as e:
+            self.respond(Message(message_type=Message.MSG_ERROR, sender_id=self.server.id, reason=str(e)))
+            return
+        self.respond(Message(message_type=Message.MSG_PROFILE, sender_id=self.server.id, path=path))
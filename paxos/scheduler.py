@@ -0,0 +1,135 @@
+import heapq
+import itertools
+import time
+import traceback
+from threading import Condition, Lock, Thread
+
+
+class Deadline(object):
+    """
+    Callback scheduled by Scheduler.call_later, to be run once unless cancelled.
+    """
+    __slots__ = ('scheduler', 'when', 'callback', 'args', 'cancelled', 'fired')
+
+    def __init__(self, scheduler, when, callback, args):
+        self.scheduler = scheduler
+        self.when = when            # by time.monotonic
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.fired = False
+
+    @property
+    def active(self):
+        return not (self.cancelled or self.fired)
+
+    def reset(self, delay):
+        """
+        Move the deadline to delay seconds from now.
+
+        :return: False if the callback already ran or was cancelled, a new deadline has to be scheduled then
+        """
+        return self.scheduler.reset(self, time.monotonic() + delay)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """
+    Runs timed callbacks on a single thread, ordered by a heap of deadlines.
+
+    Moving a deadline later, as done by every received heartbeat, is O(1): its heap entry stays in place
+    and is pushed again with the new time when it comes up. Cancelled deadlines are dropped the same way.
+    Callbacks run on the scheduler thread and must not block, blocking work is handed to an executor.
+    """
+
+    def __init__(self, name='scheduler'):
+        self._heap = []             # (time, sequence number, deadline)
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, callback, *args):
+        """
+        :param delay: in seconds
+        :return: Deadline, which can be reset or cancelled
+        """
+        deadline = Deadline(self, time.monotonic() + delay, callback, args)
+        with self._condition:
+            self._push(deadline)
+        return deadline
+
+    def reset(self, deadline, when):
+        with self._condition:
+            if not deadline.active:
+                return False
+            earlier = when < deadline.when
+            deadline.when = when
+            if earlier:
+                self._push(deadline)    # entry at the old time is skipped once the deadline fires
+        return True
+
+    def _push(self, deadline):
+        heapq.heappush(self._heap, (deadline.when, next(self._sequence), deadline))
+        if self._heap[0][2] is deadline:
+            self._condition.notify()
+
+    def _next_due(self):
+        """
+        Wait for the next deadline and mark it fired.
+
+        :return: Deadline or None if the scheduler was stopped
+        """
+        with self._condition:
+            while not self._stopped:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    _, _, deadline = heapq.heappop(self._heap)
+                    if not deadline.active:
+                        continue
+                    if deadline.when > now:
+                        self._push(deadline)    # reset to a later time meanwhile
+                        continue
+                    deadline.fired = True
+                    return deadline
+                self._condition.wait(self._heap[0][0] - now if self._heap else None)
+        return None
+
+    def _run(self):
+        deadline = self._next_due()
+        while deadline is not None:
+            try:
+                deadline.callback(*deadline.args)
+            except Exception:
+                traceback.print_exc()
+            deadline = self._next_due()
+
+    def __len__(self):
+        """
+        :return: number of pending deadlines
+        """
+        with self._condition:
+            return len({id(deadline) for _, _, deadline in self._heap if deadline.active})
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+
+_default_scheduler = None
+_default_lock = Lock()
+
+
+def default_scheduler():
+    """
+    :return: scheduler shared by all servers of the process, started on first use
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = Scheduler()
+        return _default_scheduler
@@ -1,89 +1,205 @@
 import random
 import time
 import socketserver
-from threading import Timer, Lock
-
-from paxos.core import Participant, Message, Node
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock, Thread
+
+from paxos.batching import BATCH_SIZE, BATCH_LINGER
+from paxos.codec import CodecError
+from paxos.core import Participant, Message, IMMEDIATE_TIMOUT
+from paxos.framing import FrameError, FrameReader, send_frame
 from paxos.helpers import string_to_address, address_to_node_id
-from paxos.store import StoreMixin
+from paxos.metrics import Metrics, MetricsEndpoint
+from paxos.partition import Partition, PARTITIONS, key_partition
+from paxos.profiling import Profiler
+from paxos.store import StoreMixin, ENGINE_REDIS
+from paxos.wal import WriteAheadLog
 from paxos.protocol import PaxosHandler, ProposalNumber
+from paxos.scheduler import default_scheduler
+from paxos.snapshot import Snapshotter
+from paxos.tracing import Tracer
 
+HANDLER_WORKERS = 32        # threads running handlers which contact other nodes
 
-class Server(StoreMixin, Participant):
-    HEARTBEAT_PERIOD = 0.5
-    HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_PERIOD
 
-    def __init__(self, address, redis_host='localhost', redis_port=6379, *args, **kwargs):
+class Server(StoreMixin, Participant):
+    # defaults of timing settings, see _init_timing
+    HEARTBEAT_PERIOD = 0.1
+    HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_PERIOD    # in seconds, plus up to as much ranked by id, see election
+    STARTUP_TIMEOUT = 1.5       # in seconds, first election timeout after start, so servers of a cluster can start
+    LEADER_ALIVE = 2 * HEARTBEAT_PERIOD         # follower which heard from its leader this recently denies pre-votes
+    LEASE_DURATION = HEARTBEAT_TIMEOUT  # in seconds, counted by followers from receiving the leader's heartbeat
+    LEASE_CLOCK_DRIFT = 0.1             # fraction of the lease the leader gives up to tolerate clock rate differences
+    CATCHUP_LIMIT = 1000        # max number of log entries sent in response to a single catchup request
+    PREPARE_ATTEMPTS = 3        # prepare phases a write tries before it is refused
+    BLOCKING_MESSAGES = {Message.MSG_WRITE, Message.MSG_MULTI_WRITE}    # handling contacts other nodes
+
+    # write-ahead log record types, partition index is last, records without it are of partition 0
+    WAL_PROMISE = 'p'           # [type, sender id, proposal number, partition]
+    WAL_ACCEPT = 'a'            # [type, sender id, proposal number, slot, batch, partition]
+    WAL_INSTALL = 'i'           # [type, committed entries, partition]
+    WAL_COMMIT = 'c'            # [type, slot, partition] - all slots up to slot are committed
+
+    def __init__(self, address, redis_host='localhost', redis_port=6379, storage=None,
+                 batch_size=BATCH_SIZE, batch_linger=BATCH_LINGER, wal=None, snapshot=None, scheduler=None,
+                 partitions=PARTITIONS, metrics=None, tracing=None, profiling=None, timing=None, *args, **kwargs):
+        """
+        :param storage: storage engine settings, see paxos.store.create_engine.
+                        Defaults to Redis at redis_host and redis_port.
+        :param wal: write-ahead log settings: path, which can contain {id}, and optionally flush_interval and fsync,
+                    see paxos.wal.WriteAheadLog. Without them acceptor state is lost on restart.
+        :param snapshot: snapshot settings: path, which can contain {id}, and optionally every,
+                         see paxos.snapshot.Snapshotter. Without them the log is never compacted.
+        :param partitions: number of partitions of consensus state, see paxos.partition.Partition
+        :param scheduler: paxos.scheduler.Scheduler running heartbeat and election timeouts,
+                          by default the one shared by all servers of the process
+        :param metrics: metrics endpoint settings: port_offset, added to the server's port, and optionally host.
+                        Without them metrics are available only through MSG_STATS.
+        :param tracing: tracer settings: level, sample, capacity and echo, see paxos.tracing.Tracer
+        :param profiling: profiler settings: path, which can contain {id}, and optionally duration, mode
+                          and interval, see paxos.profiling.Profiler
+        :param timing: heartbeat, election and lease timing settings, see _init_timing
+        """
         super(Server, self).__init__(*args, **kwargs)
         self.address = address
         self.host, self.port = string_to_address(address)
         self.id = address_to_node_id(self.servers, self.address)
         self.current_node_no = self.initial_participants
+        self.tracer = Tracer('server {}'.format(self.id), **(tracing or {}))
+        self.metrics = Metrics(tracer=self.tracer)
+        self.metrics_endpoint = None
+        self.metrics_settings = metrics
+        self.profiler = Profiler(self.id, tracer=self.tracer, **(profiling or {}))
+        self._init_timing(**(timing or {}))
 
-        self.redis_host = redis_host
-        self.redis_port = redis_port
+        if storage is None:
+            storage = {'engine': ENGINE_REDIS, 'host': redis_host, 'port': redis_port}
+        self.init_storage(storage)
 
         self.tcp_daemon = None
+        self.handler_executor = ThreadPoolExecutor(max_workers=HANDLER_WORKERS, thread_name_prefix='handler')
+        self.partitions = [Partition(index, self.id, batch_size=batch_size, batch_linger=batch_linger)
+                           for index in range(max(1, partitions))]
 
         self._init_locks()
 
-        self._own_prop_num = ProposalNumber(self.id, 0)
-        self._highest_prepare_msg = Message(message_type=Message.MSG_PREPARE,
-                                            sender_id=self.id,
-                                            prop_num=self._own_prop_num.as_list(),
-                                            key='', value='')
         self._last_heartbeat = 0
         self._leader_id = None
-        self._prepare_phase_complete = False
-
+        self._lease_expiry = 0.0            # leader: lease held until, by time.monotonic
+        self._quorum_heard_at = 0.0         # leader: when quorum last granted its lease, by time.monotonic
+        self._lease_holder = None           # follower: node the lease was granted to
+        self._lease_granted_until = 0.0     # follower: lease granted until, by time.monotonic
+        self._heartbeat_received_at = float('-inf')  # follower: last heartbeat of its leader, by time.monotonic
+        self.sent_heartbeat = 0             # leader: heartbeat value of the latest round, also sent with accepts
+        self._heartbeats_in_flight = set()  # leader: followers whose heartbeat is unanswered
+        self._accepted_at = {}              # leader: follower id -> when it acknowledged an accept, by time.monotonic
+
+        self.scheduler = scheduler if scheduler is not None else default_scheduler()
         self.send_heartbeat_timer = None
         self.heartbeat_timeout_timer = None
-        self.prepare_timeout_timer = None
+        self.stopped = False
+
+        start = time.time()
+        self.snapshotter = None
+        if snapshot is not None:
+            self.snapshotter = Snapshotter(**dict(snapshot, path=snapshot['path'].format(id=self.id)))
+            self.load_snapshot()
+        self.wal = None
+        if wal is not None:
+            self.wal = WriteAheadLog(tracer=self.tracer, **dict(wal, path=wal['path'].format(id=self.id)))
+            self.replay_wal()
+        if self.snapshotter is not None:
+            self.snapshotter.stats['restore_duration'] = time.time() - start
 
         self.nodes = {}
         for idx, address in enumerate(self.servers):
             if idx != self.id:
-                self.nodes[idx] = Node(address=address, node_id=idx)
+                self.nodes[idx] = self.new_node(address, idx)
+        if self.transport is not None:
+            self.transport.register(self)
+        self._init_gauges()
 
         self.reset_heartbeat_timeout_timer(
-            Server.get_randomized_timeout(),
+            self.get_randomized_timeout(self.startup_timeout),
             self.handle_heartbeat_timeout)
 
+    def _init_timing(self, heartbeat_period=None, heartbeat_timeout=None, startup_timeout=None, leader_alive=None,
+                     lease_duration=None, clock_drift=None):
+        """
+        Settings left out default to the class constants, heartbeat_timeout and leader_alive scaled
+        to heartbeat_period. Longer timeouts let a leader survive pauses, e.g. of garbage collection
+        or a slow fsync of the write-ahead log, without losing its lease, stepping down or being replaced.
+
+        :param heartbeat_period: seconds between heartbeat rounds of the leader
+        :param heartbeat_timeout: seconds without a heartbeat after which a follower starts an election,
+                                  and without quorum after which a leader steps down
+        :param startup_timeout: seconds before the first election after start
+        :param leader_alive: seconds a follower which heard from its leader denies pre-votes
+        :param lease_duration: seconds a follower grants the leader a lease for, counted from receiving its heartbeat
+        :param clock_drift: max fraction by which clock rates of servers differ; the leader holds its lease for
+                            lease_duration * (1 - clock_drift) counted from sending the heartbeat, so it expires
+                            before the follower's grant as long as clocks drift apart by less than that
+        """
+        self.heartbeat_period = Server.HEARTBEAT_PERIOD if heartbeat_period is None else heartbeat_period
+        scale = self.heartbeat_period / Server.HEARTBEAT_PERIOD
+        self.heartbeat_timeout = Server.HEARTBEAT_TIMEOUT * scale if heartbeat_timeout is None else heartbeat_timeout
+        self.startup_timeout = Server.STARTUP_TIMEOUT if startup_timeout is None else startup_timeout
+        self.leader_alive_timeout = Server.LEADER_ALIVE * scale if leader_alive is None else leader_alive
+        self.lease_duration = self.heartbeat_timeout if lease_duration is None else lease_duration
+        self.clock_drift = Server.LEASE_CLOCK_DRIFT if clock_drift is None else clock_drift
+        if not 0 <= self.clock_drift < 1:
+            raise ValueError('Clock drift must be a fraction below 1: {}'.format(self.clock_drift))
+
     def _init_locks(self):
-        self._highest_prepare_msg_lock = Lock()
         self._leader_id_lock = Lock()
         self._last_heartbeat_lock = Lock()
         self._heartbeat_timeout_lock = Lock()
-        self._prepare_phase_complete_lock = Lock()
-        self._own_prop_num_lock = Lock()
-
-    def get_next_prop_num(self):
-        with self._own_prop_num_lock:
-            self._own_prop_num = self._own_prop_num.increased()
-            return self._own_prop_num
+        self._lease_lock = Lock()
+        self._heartbeat_lock = Lock()
+
+    # partitions
+
+    def _init_gauges(self):
+        metrics = self.metrics
+        metrics.gauge('handler_queue', lambda: self.handler_executor._work_queue.qsize())
+        metrics.gauge('executor_queue', lambda: self.executor._work_queue.qsize())
+        metrics.gauge('heartbeats_in_flight', lambda: len(self._heartbeats_in_flight))
+        metrics.gauge('is_leader', lambda: int(self.leader_id == self.id))
+        for partition in self.partitions:
+            log = partition.log
+            metrics.gauge('commit_index{partition=%d}' % partition.index, lambda log=log: log.commit_index)
+            metrics.gauge('applied_index{partition=%d}' % partition.index, lambda log=log: log.applied_index)
+
+    def collect_metrics(self):
+        """
+        :return: metrics of the server, see paxos.metrics.Metrics.collect, and statistics of snapshots
+        """
+        return dict(self.metrics.collect(), snapshot=self.snapshot_stats)
 
-    @property
-    def own_prop_num(self):
-        with self._own_prop_num_lock:
-            return self._own_prop_num
+    def partition_of(self, key):
+        return self.partitions[key_partition(key, len(self.partitions))]
 
-    @own_prop_num.setter
-    def own_prop_num(self, prop_num):
-        with self._own_prop_num_lock:
-            self._own_prop_num = prop_num
+    def message_partition(self, message):
+        """
+        :return: Partition a message belongs to, by its keys or by its partition index,
+                 None for a multi-write of keys of several partitions or a partition index this server doesn't have,
+                 which means servers are configured with different numbers of partitions
+        """
+        if message.message_type == Message.MSG_WRITE:
+            return self.partition_of(message.key)
+        if message.message_type == Message.MSG_MULTI_WRITE:
+            indexes = {key_partition(key, len(self.partitions)) for key, _ in message.items}
+            return self.partitions[indexes.pop()] if len(indexes) == 1 else None
+        index = getattr(message, 'partition', None) or 0
+        return self.partitions[index] if 0 <= index < len(self.partitions) else None
 
     @property
-    def highest_prepare_msg(self):
-        with self._highest_prepare_msg_lock:
-            return self._highest_prepare_msg
-
-    @highest_prepare_msg.setter
-    def highest_prepare_msg(self, msg):
-        with self._highest_prepare_msg_lock:
-            with self._own_prop_num_lock:
-                self._highest_prepare_msg = msg
-                prop_num = ProposalNumber.from_list(msg.prop_num)
-                self._own_prop_num = ProposalNumber(self.id, prop_num.round_no)
+    def applied_slots(self):
+        """
+        :return: number of log slots applied to the store, in all partitions
+        """
+        return sum(partition.log.applied_index + 1 for partition in self.partitions)
 
     @property
     def leader_id(self):
@@ -93,6 +209,8 @@ class Server(StoreMixin, Participant):
     @leader_id.setter
     def leader_id(self, leader_id):
         with self._leader_id_lock:
+            if leader_id == self.id and self._leader_id != self.id:
+                self._quorum_heard_at = time.monotonic()    # new leader gets a full timeout to reach quorum
             self._leader_id = leader_id
 
     @property
@@ -105,30 +223,357 @@ class Server(StoreMixin, Participant):
         with self._last_heartbeat_lock:
             self._last_heartbeat = heartbeat
 
-    @property
-    def prepare_phase_complete(self):
-        with self._prepare_phase_complete_lock:
-            return self._prepare_phase_complete
+    # write-ahead log
 
-    @prepare_phase_complete.setter
-    def prepare_phase_complete(self, prepare_status):
-        with self._prepare_phase_complete_lock:
-            self._prepare_phase_complete = prepare_status
+    def wal_append(self, record, sync=False):
+        """
+        :return: sequence number of the record for wal_sync, None if the log is disabled
+        """
+        if self.wal is None:
+            return None
+        return self.wal.append(record, sync=sync)
+
+    def wal_sync(self, seq):
+        """
+        Wait until the record is on disk. Called outside of acceptor lock, so concurrent
+        prepares and accepts share one fsync.
+        """
+        if seq is not None:
+            self.wal.sync(seq)
+
+    _WAL_FIELDS = {WAL_PROMISE: 3, WAL_ACCEPT: 5, WAL_INSTALL: 2, WAL_COMMIT: 2}
+
+    def replay_wal(self):
+        """
+        Restore promised proposals, own proposal numbers and log entries recorded before restart.
+        """
+        start = time.time()
+        records = self.wal.replay()
+        for record in records:
+            record_type = record[0]
+            fields = Server._WAL_FIELDS.get(record_type)
+            if fields is None:
+                continue
+            partition = self.partitions[record[fields] if len(record) > fields else 0]
+            if record_type == Server.WAL_PROMISE:
+                self._restore_promise(partition, record[1], record[2])
+            elif record_type == Server.WAL_ACCEPT:
+                sender_id, prop_num, slot, batch = record[1:5]
+                self._restore_promise(partition, sender_id, prop_num)
+                partition.log.accept(slot, prop_num, batch)
+            elif record_type == Server.WAL_INSTALL:
+                partition.log.install(record[1])
+            elif record_type == Server.WAL_COMMIT:
+                partition.log.restore_commit(record[1])
+        for partition in self.partitions:
+            self.apply_committed(partition)
+        if records:
+            # leases granted before restart are unknown, so none can be granted until they have surely expired
+            self._lease_granted_until = time.monotonic() + self.lease_duration
+        self.tracer.info(None, '[WAL] Replayed {} records in {:.3f}s, commit indexes {}', len(records),
+                         time.time() - start, [partition.log.commit_index for partition in self.partitions])
 
     @staticmethod
-    def get_randomized_timeout():
+    def _restore_promise(partition, sender_id, prop_num):
+        if ProposalNumber.from_list(prop_num) > partition.highest_prepare_msg.proposal:
+            partition.highest_prepare_msg = Message(message_type=Message.MSG_PREPARE, sender_id=sender_id,
+                                                    prop_num=prop_num, key='', value='')
+
+    # snapshots
+
+    def load_snapshot(self):
+        """
+        Restore state from the latest snapshot, the write-ahead log is replayed on top of it.
+        """
+        state = self.snapshotter.load()
+        if state is None:
+            return
+        count = len(self.partitions)
+        for index, partition_state in enumerate(state.get('partitions') or [state]):
+            partition = self.partitions[index]
+            self._restore_promise(partition, *partition_state['promise'])
+            data = [[key, value] for key, value in state['data'] if key_partition(key, count) == index]
+            self.restore_data(partition, partition_state['slot'], data)
+            for slot, prop_num, batch in partition_state['entries']:
+                partition.log.accept(slot, prop_num, batch)
+            partition.log.restore_commit(partition_state['commit_index'])
+        self.tracer.info(None, '[Snapshot] Loaded snapshot of {} applied slots: {} keys',
+                         state['slot'] + 1, len(state['data']))
+
+    def restore_data(self, partition, slot, data):
+        """
+        Replace state of the partition's log up to slot with the store data of a snapshot.
+
+        :param data: [key, value] pairs of keys of the partition
+        """
+        with partition.apply_lock:
+            if slot <= partition.log.applied_index:
+                return
+            if data:
+                self.set_many(data)
+            partition.log.restore_snapshot(slot)
+
+    def partition_snapshot(self, partition):
+        """
+        Store data of the partition covering its compacted log, for a follower behind it. Taken from the latest
+        snapshot if it covers the compacted log, otherwise from the store: a snapshot installed from another node
+        compacts the log of a server without snapshots too.
+
+        :return: dictionary with slot applied by the data and [key, value] pairs of keys of the partition
+        """
+        count = len(self.partitions)
+        state = self.snapshotter.load() if self.snapshotter is not None else None
+        if state is not None:
+            slot = (state.get('partitions') or [state])[partition.index]['slot']
+            if slot >= partition.log.snapshot_index:
+                data = [[key, value] for key, value in state['data'] if key_partition(key, count) == partition.index]
+                return {'slot': slot, 'data': data}
+        with partition.apply_lock:
+            slot = partition.log.applied_index
+            data = [[key, str(value, 'utf-8')] for key, value in self.dump()
+                    if key_partition(key, count) == partition.index]
+        return {'slot': slot, 'data': data}
+
+    def maybe_snapshot(self):
+        if self.snapshotter is not None and self.snapshotter.begin(self.applied_slots - 1):
+            Thread(target=self.take_snapshot, name='snapshot', daemon=True).start()
+
+    def take_snapshot(self):
+        """
+        Write snapshot, then remove log entries and write-ahead log segments it covers.
+        Must be called after Snapshotter.begin. Runs in the background, concurrently with applying writes:
+        the store may contain writes of slots after the snapshot slot, which is harmless, as the log entries
+        after the slot are kept and applied again in order on restore.
+        """
+        start = time.time()
+        slot = None
+        size = 0
+        try:
+            segment = self.wal.rotate() if self.wal is not None else None
+            partitions = []
+            for partition in self.partitions:
+                applied = partition.log.applied_index
+                promise = partition.highest_prepare_msg
+                partitions.append({
+                    'slot': applied,
+                    'promise': [promise.sender_id, promise.prop_num],
+                    'commit_index': partition.log.commit_index,
+                    'entries': partition.log.accepted_from(applied + 1),
+                })
+            slot = sum(partition_state['slot'] + 1 for partition_state in partitions) - 1
+            state = {
+                'slot': slot,
+                'partitions': partitions,
+                'data': [[key, str(value, 'utf-8')] for key, value in self.dump()],
+            }
+            size = self.snapshotter.write(state)
+            if segment is not None:
+                self.wal.remove_segments(segment)
+            for partition, partition_state in zip(self.partitions, partitions):
+                partition.log.compact(partition_state['slot'])
+            self.tracer.info(None, '[Snapshot] {} applied slots: {} keys, {} bytes in {:.3f}s',
+                             slot + 1, len(state['data']), size, time.time() - start)
+        except Exception as e:
+            self.tracer.error(None, '[Snapshot] Failed: {!r}', e)
+            slot = None
+        finally:
+            self.snapshotter.finish(slot, time.time() - start, size)
+
+    @property
+    def snapshot_stats(self):
+        return dict(self.snapshotter.stats) if self.snapshotter is not None else {}
+
+    # acceptor and learner methods
+
+    def promise(self, message):
+        """
+        Promise not to accept proposals lower than the prepare message's proposal, in the message's partition.
+
+        :return: accepted log entries starting from message.from_slot or None if a higher proposal was promised
+        """
+        partition = self.message_partition(message)
+        with partition.acceptor_lock:
+            if message.proposal < partition.highest_prepare_msg.proposal or self.lease_blocks(message.sender_id):
+                return None
+            if message.sender_id != self.id:
+                partition.prepare_phase_complete = False
+            partition.highest_prepare_msg = message
+            seq = self.wal_append([Server.WAL_PROMISE, message.sender_id, message.prop_num, partition.index])
+            accepted = partition.log.accepted_from(message.from_slot)
+        self.wal_sync(seq)
+        return accepted
+
+    def accept(self, message):
+        """
+        Accept value proposed for a log slot of the message's partition, unless a higher proposal was promised.
+        """
+        partition = self.message_partition(message)
+        with partition.acceptor_lock:
+            prop_num, promised = message.proposal, partition.highest_prepare_msg.proposal
+            if prop_num < promised:
+                return False
+            if prop_num > promised:
+                if message.sender_id != self.id:
+                    partition.prepare_phase_complete = False
+                partition.highest_prepare_msg = message
+            partition.log.accept(message.slot, message.prop_num, message.batch)
+            seq = self.wal_append([Server.WAL_ACCEPT, message.sender_id, message.prop_num,
+                                   message.slot, message.batch, partition.index])
+        self.wal_sync(seq)
+        return True
+
+    def learn_commit(self, partition, commit_index, prop_num, leader_id):
+        """
+        Apply slots of the partition committed by the leader, fetching the ones missing locally.
+        """
+        missing = partition.log.learn_commit(commit_index, prop_num)
+        self.apply_committed(partition)
+        if missing is not None and leader_id in self.nodes:
+            self.catch_up(partition, leader_id, missing)
+
+    def apply_committed(self, partition):
+        """
+        Apply committed entries of the partition to the store in slot order.
+        """
+        with partition.apply_lock:
+            applied = None
+            entry = partition.log.next_to_apply()
+            while entry is not None:
+                if entry.batch:
+                    self.set_many(entry.batch)
+                partition.log.mark_applied(entry.slot)
+                applied = entry.slot
+                entry = partition.log.next_to_apply()
+            if applied is not None:
+                self.wal_append([Server.WAL_COMMIT, applied, partition.index])
+        self.maybe_snapshot()
+
+    def catch_up(self, partition, node_id, from_slot):
+        """
+        Fetch committed entries of the partition from another node in the background,
+        one request per partition at a time.
+        """
+        with partition.catch_up_lock:
+            if partition.catching_up:
+                return
+            partition.catching_up = True
+        self.executor.submit(self._catch_up, partition, node_id, from_slot)
+
+    def _catch_up(self, partition, node_id, from_slot):
+        try:
+            self.fetch_committed(partition, node_id, from_slot)
+        finally:
+            with partition.catch_up_lock:
+                partition.catching_up = False
+
+    def fetch_committed(self, partition, node_id, from_slot):
+        """
+        Fetch and apply committed entries of the partition from another node, starting with its snapshot
+        if the node has already compacted from_slot.
+        """
+        request = Message(message_type=Message.MSG_CATCHUP, sender_id=self.id, from_slot=from_slot,
+                          partition=partition.index)
+        response = Message.unserialize(self.nodes[node_id].send_immediate(request))
+        if response.message_type != Message.MSG_ENTRIES:
+            return
+        if response.snapshot:
+            self.tracer.info(None, '[Catch-up] Snapshot of partition {} slot {} from {}',
+                             partition.index, response.snapshot['slot'], node_id)
+            self.restore_data(partition, response.snapshot['slot'], response.snapshot['data'])
+            if self.snapshotter is not None and self.snapshotter.begin(self.applied_slots - 1):
+                self.take_snapshot()
+        self.tracer.info(None, '[Catch-up] {} entries of partition {} from {}',
+                         len(response.entries), partition.index, node_id)
+        partition.log.install(response.entries)
+        self.wal_append([Server.WAL_INSTALL, response.entries, partition.index])
+        self.apply_committed(partition)
+
+    # leader lease
+
+    def grant_lease(self, leader_id):
+        """
+        Grant lease to a leader whose heartbeat was received, unless a lease granted to another node is still valid.
+        Until the lease expires, no other proposer gets a promise, so no other proposer can commit writes.
+        """
+        with self._lease_lock:
+            now = time.monotonic()
+            if self._lease_holder != leader_id and now < self._lease_granted_until:
+                return False
+            self._lease_holder = leader_id
+            self._lease_granted_until = now + self.lease_duration
+            return True
+
+    def lease_blocks(self, proposer_id):
+        """
+        :return: True if a lease granted to another node forbids promising to the proposer
+        """
+        with self._lease_lock:
+            return self._lease_holder != proposer_id and time.monotonic() < self._lease_granted_until
+
+    def renew_lease(self, sent_at, responses):
+        """
+        Extend leader lease if quorum granted it in response to heartbeats or accept requests sent at sent_at.
+        Lease is counted from sending, so it expires before any follower's grant does.
+        """
+        granted = sum(1 for response in responses
+                      if response.message_type in (Message.MSG_HEARTBEAT_ACK, Message.MSG_ACCEPTED) and response.lease)
+        if self.grant_lease(self.id):
+            granted += 1
+        if granted >= self.quorum_size:
+            with self._lease_lock:
+                self._lease_expiry = sent_at + self.lease_duration * (1 - self.clock_drift)
+                self._quorum_heard_at = max(self._quorum_heard_at, sent_at)
+
+    def has_lease(self, partitions=None):
         """
-        Wait for an additional random period in order to
-        minimize the risk of selecting multiple leaders
+        :param partitions: partitions to be read, by default all
+        :return: True if the server is the leader holding a valid lease, with all values chosen before it
+                 recovered and all committed entries applied in the partitions, so it can answer reads
+                 linearizably from its store
         """
-        return Server.HEARTBEAT_TIMEOUT + int(random.random() * Server.HEARTBEAT_TIMEOUT)
+        with self._lease_lock:
+            valid = time.monotonic() < self._lease_expiry
+        if not valid or self.leader_id != self.id:
+            return False
+        return all(partition.prepare_phase_complete and partition.log.applied_index == partition.log.commit_index
+                   for partition in (self.partitions if partitions is None else partitions))
+
+    def prepare_as_leader(self):
+        """
+        Run prepare phase of every partition right after becoming leader instead of on the first write,
+        so that reads can be served from the lease.
+        """
+        for partition in self.partitions:
+            with partition.batcher.round_lock:
+                if self.leader_id == self.id and not partition.prepare_phase_complete:
+                    PaxosHandler(Message(message_type=Message.MSG_WRITE, key='', value=''), self, None,
+                                 partition=partition).make_prepare_phase()
+
+    def get_randomized_timeout(self, timeout=None):
+        """
+        Wait for an additional period, which is shorter the higher the id of this server, plus a random part,
+        in order to minimize the risk of selecting multiple leaders. Without a live leader the server with
+        the highest id times out first and wins the election, see paxos.sharding.place_groups.
+
+        :param timeout: in seconds, by default heartbeat_timeout
+        """
+        timeout = self.heartbeat_timeout if timeout is None else timeout
+        step = timeout / len(self.servers)
+        rank = len(self.servers) - 1 - self.id
+        return timeout + step * (rank + random.uniform(0, 0.5))
 
     def handle_heartbeat_timeout(self):
         """
         First send a test Prepare with low proposal number
-        to check if there is a stable leader
+        to check if there is a stable leader.
+        The low-ball prepare is sent to all nodes in parallel and doubles as a pre-vote request: a node grants
+        the pre-vote unless it heard from a live leader within leader_alive. Waiting stops as soon as quorum
+        granted the pre-vote or can no longer grant it, so one dead node doesn't delay the election.
         """
-        print('Hearbeat timeout')
+        if self.leader_id == self.id or self.stopped:
+            return
+        self.tracer.info(None, 'Heartbeat timeout')
+        self.metrics.increment('elections')
         self.leader_id = None
         low_prop_num_prepare_msg = Message(
             message_type=Message.MSG_PREPARE,
@@ -138,14 +583,44 @@ class Server(StoreMixin, Participant):
             value=0
         )
 
-        # Send prepare messages synchronously
-        responses = []
-        for id, node in self.nodes.items():
-            if id != self.leader_id:
-                response = Message.unserialize(node.send_immediate(low_prop_num_prepare_msg))
-                responses.append(response)
+        nodes = list(self.nodes.values())
+        needed = self.quorum_size - 1       # own pre-vote is counted implicitly
+
+        def done(responses):
+            granted = sum(1 for response in responses if Server.pre_vote_granted(response))
+            return granted >= needed or granted + len(nodes) - len(responses) < needed
+        responses = self.broadcast(low_prop_num_prepare_msg, nodes, done=done)
         self.handle_low_prop_num(responses)
 
+    @staticmethod
+    def pre_vote_granted(response):
+        return response.message_type == Message.MSG_PREPARE_NACK and not response.leader_alive
+
+    def leader_alive(self, candidate_id=None):
+        """
+        :param candidate_id: node asking, which doesn't count as a live leader
+        :return: True if this server is the leader or heard from its leader within leader_alive
+        """
+        leader_id = self.leader_id
+        if leader_id is None or leader_id == candidate_id:
+            return False
+        if leader_id == self.id:
+            return True
+        return time.monotonic() - self._heartbeat_received_at < self.leader_alive_timeout
+
+    def answer_probe(self, message):
+        """
+        Answer a low-ball prepare of a candidate. It is never promised, so probing doesn't change acceptor state.
+
+        :return: prepare nack telling the leader this server follows and if it is alive, i.e. the pre-vote
+        """
+        return Message(message_type=Message.MSG_PREPARE_NACK,
+                       sender_id=self.id,
+                       prop_num=self.message_partition(message).highest_prepare_msg.prop_num,
+                       leader_id=self.leader_id,
+                       last_heartbeat=self.last_heartbeat,
+                       leader_alive=self.leader_alive(message.sender_id))
+
     def count_nacks(self, responses):
         nacks = [res for res in responses if (res.message_type == Message.MSG_PREPARE_NACK)]
         top_leader, top_leader_occurrences, top_heartbeat, heartbeat_occurrences = (None,) * 4
@@ -170,34 +645,18 @@ class Server(StoreMixin, Participant):
             top_leader, top_leader_occurrences = sorted(
                 leader_occurrences.items(), key=lambda e: e[1], reverse=True)[0]
             top_heartbeat, heartbeat_occurrences = sorted(
-                leader_heartbeats[leader].items(), key=lambda e: e[1], reverse=True)[0]
+                leader_heartbeats[top_leader].items(), key=lambda e: e[1], reverse=True)[0]
 
         return top_leader, top_leader_occurrences, top_heartbeat, heartbeat_occurrences
 
     def handle_low_prop_num(self, responses):
         """
-        Count reported leader IDs and heartbeat numbers
-        to find out, if there is a stable leader
+        Become leader with pre-votes of quorum, otherwise follow the live leader reported by other nodes.
+        A node cut off from quorum never becomes leader, so it can't disrupt the leader once it is back.
         """
-        print("[Low-ball Prepare] Counting low-ball responses")
-        top_leader, leader_occurrences, top_heartbeat, heartbeat_occurrences = self.count_nacks(responses)
-        condition = top_leader is not None \
-            and top_leader > self.id \
-            and leader_occurrences >= self.quorum_size \
-            and heartbeat_occurrences >= self.quorum_size
-
-        if condition:
-            """
-            Other nodes are connected with a stable leader
-            so let's stop the election process and reset
-            the heartbeat timer
-            """
-            print("[Low-ball Prepare] A stable leader detected. Stopping election")
-            self.leader_id = top_leader
-            self.reset_heartbeat_timeout_timer(
-                Server.get_randomized_timeout(),
-                self.handle_heartbeat_timeout)
-        else:
+        self.tracer.debug(None, '[Low-ball Prepare] Counting low-ball responses')
+        granted = sum(1 for response in responses if Server.pre_vote_granted(response))
+        if granted + 1 >= self.quorum_size:
             """
             There is no stable leader
             Let's assume this node is the
@@ -207,63 +666,224 @@ class Server(StoreMixin, Participant):
             be set as leader after receiving its
             heartbeat
             """
+            self.tracer.info(None, '[Low-ball Prepare] Pre-vote granted by {} nodes. Becoming leader', granted + 1)
             self.leader_id = self.id
-            self.get_next_prop_num()
+            self.metrics.increment('elections_won')
+            for partition in self.partitions:
+                partition.get_next_prop_num()
             self.send_heartbeats()
+            self.executor.submit(self.prepare_as_leader)
+            return
+
+        alive = [response for response in responses
+                 if response.message_type == Message.MSG_PREPARE_NACK and response.leader_alive]
+        top_leader, leader_occurrences, _, _ = self.count_nacks(alive)
+        if top_leader is not None and top_leader != self.id:
+            """
+            Other nodes are connected with a stable leader
+            so let's stop the election process and follow it
+            """
+            self.tracer.info(None, '[Low-ball Prepare] Stable leader {} reported by {} nodes. Stopping election',
+                             top_leader, leader_occurrences)
+            self.leader_id = top_leader
+        else:
+            self.tracer.info(None, '[Low-ball Prepare] Pre-vote granted by {} of {} nodes needed. Retrying',
+                             granted + 1, self.quorum_size)
+        self.metrics.increment('pre_votes_lost')
+        self.reset_heartbeat_timeout_timer(
+            self.get_randomized_timeout(),
+            self.handle_heartbeat_timeout)
+
+    def handle_heartbeat(self, message, learn=True):
+        """
+        Follow the leader sending a heartbeat or an accept request carrying heartbeat data.
+        Heartbeats are followed from the followed leader, and from any node while no leader is known to be alive.
+        So a leader which lost its leadership, e.g. cut off by a partition, can't take over a live leader's
+        followers when it is back, and a leader ignores heartbeats of other nodes while it leads.
 
-    def handle_heartbeat(self, message):
-        if message.sender_id > self.id:
-            print('[Heartbeat from {}]'.format(message.sender_id))
-            if self.send_heartbeat_timer and self.send_heartbeat_timer.is_alive():
+        :param learn: apply slots committed by the leader
+        :return: True if lease was granted to the sender
+        """
+        if message.sender_id == self.leader_id or not self.leader_alive(message.sender_id):
+            self.tracer.debug(None, '[Heartbeat from {}]', message.sender_id)
+            self._heartbeat_received_at = time.monotonic()
+            if self.send_heartbeat_timer is not None:
                 self.send_heartbeat_timer.cancel()
             self.last_heartbeat = message.heartbeat
+            if self.leader_id != message.sender_id:
+                for partition in self.partitions:
+                    partition.prepare_phase_complete = False
             self.leader_id = message.sender_id
             self.reset_heartbeat_timeout_timer(
-                Server.get_randomized_timeout(),
+                self.get_randomized_timeout(),
                 self.handle_heartbeat_timeout)
+            commits = getattr(message, 'commits', None)
+            if learn and commits is not None:
+                if len(commits) != len(self.partitions):
+                    self.metrics.increment('partition_mismatches')
+                    self.tracer.warning(None, '[Heartbeat] Leader {} has {} partitions, this server has {}',
+                                        message.sender_id, len(commits), len(self.partitions))
+                for partition, (commit_index, prop_num) in zip(self.partitions, commits):
+                    self.learn_commit(partition, commit_index, prop_num, message.sender_id)
+            return self.grant_lease(message.sender_id)
+        return False
 
     def next_heartbeat(self):
         return time.time()
 
     def send_heartbeats(self):
+        """
+        Send heartbeats to followers in parallel without waiting for them: the next round is scheduled first
+        and responses renew the lease as they arrive, so an unreachable follower doesn't stretch the period.
+        Followers which acknowledged an accept request within the last period got heartbeat data with it
+        and are skipped, as are followers whose previous heartbeat is still unanswered.
+        """
+        if self.leader_id != self.id or self.stopped:
+            return
+        if time.monotonic() - self._quorum_heard_at > self.heartbeat_timeout:
+            self.step_down()
+            return
+        if self.send_heartbeat_timer is not None:
+            self.send_heartbeat_timer.cancel()      # called directly by a new leader, keep a single round timer
+        self.send_heartbeat_timer = self.scheduler.call_later(self.heartbeat_period, self.send_heartbeats)
+
+        self.sent_heartbeat = self.next_heartbeat()
         heartbeat = Message(
             message_type=Message.MSG_HEARTBEAT,
-            heartbeat=self.next_heartbeat(),
-            sender_id=self.id
+            heartbeat=self.sent_heartbeat,
+            sender_id=self.id,
+            commits=[[partition.log.commit_index, partition.own_prop_num.as_list()] for partition in self.partitions]
         )
-        for node in self.nodes.values():
-            node.send_immediate(heartbeat)
+        sent_at = time.monotonic()
+        self.renew_lease(sent_at, [])       # single server cluster is its own quorum
+        data = heartbeat.serialize(self.wire_format)
+        responses = []
+        for node_id, node in self.heartbeats_due(sent_at):
+            try:
+                future = self.executor.submit(node.send_raw, data, IMMEDIATE_TIMOUT)
+            except RuntimeError:            # executor shut down
+                return
+            future.add_done_callback(partial(self.heartbeat_answered, node_id, sent_at, responses))
+
+    def step_down(self):
+        """
+        Stop leading once quorum hasn't renewed the lease for heartbeat_timeout, e.g. when cut off by a partition.
+        Followers have elected another leader by then, or will elect one, possibly this server again.
+        """
+        self.tracer.warning(None, 'No quorum for {:g}s, stepping down as leader', self.heartbeat_timeout)
+        self.metrics.increment('step_downs')
+        self.leader_id = None
+        for partition in self.partitions:
+            partition.prepare_phase_complete = False
+        self.reset_heartbeat_timeout_timer(
+            self.get_randomized_timeout(),
+            self.handle_heartbeat_timeout)
 
-        self.send_heartbeat_timer = Timer(Server.HEARTBEAT_PERIOD, self.send_heartbeats)
-        self.send_heartbeat_timer.start()
+    def heartbeats_due(self, now):
+        """
+        :return: list of (node id, node) to send a heartbeat to, marked as in flight
+        """
+        with self._heartbeat_lock:
+            due = [(node_id, node) for node_id, node in self.nodes.items()
+                   if node_id not in self._heartbeats_in_flight and
+                   now - self._accepted_at.get(node_id, float('-inf')) >= self.heartbeat_period]
+            self._heartbeats_in_flight.update(node_id for node_id, _ in due)
+        return due
+
+    def heartbeat_answered(self, node_id, sent_at, responses, future):
+        """
+        :param responses: responses to the heartbeat round received so far, shared by its callbacks
+        """
+        response = Message.unserialize(future.result())
+        if response.message_type != Message.MSG_ERROR:
+            self.metrics.observe('rtt{peer=%d}' % node_id, time.monotonic() - sent_at)
+        with self._heartbeat_lock:
+            self._heartbeats_in_flight.discard(node_id)
+            responses.append(response)
+            answered = list(responses)
+        self.renew_lease(sent_at, answered)
+
+    def accepts_acknowledged(self, sent_at, responses):
+        """
+        Followers which accepted a request sent at sent_at treated it as a heartbeat: their lease grants
+        renew the lease and their next heartbeat is skipped.
+        """
+        with self._heartbeat_lock:
+            for response in responses:
+                if response.message_type == Message.MSG_ACCEPTED and response.lease:
+                    self._accepted_at[response.sender_id] = sent_at
+        if self.leader_id == self.id:
+            self.renew_lease(sent_at, responses)
 
     def reset_heartbeat_timeout_timer(self, timeout, job):
+        """
+        Run job in the background after timeout. A pending timeout of the same job is moved,
+        which neither starts a thread nor allocates a new deadline.
+        """
         with self._heartbeat_timeout_lock:
-            if self.heartbeat_timeout_timer and self.heartbeat_timeout_timer.is_alive():
-                self.heartbeat_timeout_timer.cancel()
-            self.heartbeat_timeout_timer = Timer(timeout, job)
-            self.heartbeat_timeout_timer.start()
+            timer = self.heartbeat_timeout_timer
+            if timer is not None:
+                if timer.args == (job,) and timer.reset(timeout):
+                    return
+                timer.cancel()
+            self.heartbeat_timeout_timer = self.scheduler.call_later(timeout, self.run_in_background, job)
+
+    def run_in_background(self, job):
+        """
+        Hand a blocking job from the scheduler thread to a worker thread.
+        """
+        if not self.stopped:
+            self.executor.submit(job)
 
     # server methods
 
     def run(self):
-        print("Starting server {}".format(self.id))
+        self.tracer.info(None, 'Starting server {}', self.id)
+        self.start_metrics_endpoint()
         self.tcp_daemon = Server.CustomTCPServer((self.host, self.port), Server.TCPHandler, self)
         try:
             self.tcp_daemon.serve_forever()
         except KeyboardInterrupt:
-            print("Terminating server {}".format(self.id))
+            self.tracer.info(None, 'Terminating server {}', self.id)
             self.shutdown()
 
+    def start_metrics_endpoint(self):
+        """
+        Serve metrics in text exposition format over HTTP, if enabled by metrics settings.
+        """
+        if self.metrics_settings is None or self.metrics_endpoint is not None:
+            return
+        address = (self.metrics_settings.get('host', self.host), self.port + int(self.metrics_settings['port_offset']))
+        self.metrics_endpoint = MetricsEndpoint(address, self.collect_metrics)
+        self.metrics_endpoint.start()
+        self.tracer.info(None, 'Serving metrics of server {} on {}:{}', self.id, *address)
+
     def shutdown(self):
         if self.tcp_daemon:
             self.tcp_daemon.shutdown()
-        if self.heartbeat_timeout_timer and self.heartbeat_timeout_timer.is_alive():
-            self.heartbeat_timeout_timer.cancel()
-        if self.send_heartbeat_timer and self.send_heartbeat_timer.is_alive():
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+        self.profiler.stop()
+        self.stopped = True
+        with self._heartbeat_timeout_lock:
+            if self.heartbeat_timeout_timer is not None:
+                self.heartbeat_timeout_timer.cancel()
+        if self.send_heartbeat_timer is not None:
             self.send_heartbeat_timer.cancel()
+        self.executor.shutdown(wait=False)
+        self.handler_executor.shutdown(wait=False)
+        for node in self.nodes.values():
+            node.close()
+        self.storage.close()
+        if self.wal is not None:
+            self.wal.close()
+
+    class CustomTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+        """
+        Every connection is served by its own thread, as peers keep their connections open between requests.
+        """
+        daemon_threads = True
 
-    class CustomTCPServer(socketserver.TCPServer):
         def __init__(self, server_address, RequestHandlerClass, paxos_server, bind_and_activate=True):
             self.paxos_server = paxos_server
             self.allow_reuse_address = True
@@ -271,6 +891,31 @@ class Server(StoreMixin, Participant):
                                             bind_and_activate=bind_and_activate)
 
     class TCPHandler(socketserver.BaseRequestHandler):
+        def setup(self):
+            self.send_lock = Lock()
+
         def handle(self):
-            self.data = self.request.recv(1024).strip()
-            PaxosHandler(Message.unserialize(self.data), self.server.paxos_server, self.request).process()
+            """
+            Serve requests one after another until the peer closes the connection.
+            Requests pipelined by the peer are answered in the order they were sent, except for
+            blocking requests with request id, which are handled by worker threads and answered when done.
+            """
+            paxos_server = self.server.paxos_server
+            reader = FrameReader(self.request, max_frame_size=paxos_server.max_frame_size)
+            try:
+                for self.data in reader:
+                    if paxos_server.profiler.active:
+                        message = paxos_server.profiler.profiled(Message.unserialize, self.data)
+                    else:
+                        message = Message.unserialize(self.data)
+                    handler = PaxosHandler(message, paxos_server, self)
+                    if message.request_id is not None and message.message_type in Server.BLOCKING_MESSAGES:
+                        paxos_server.handler_executor.submit(handler.process)
+                    else:
+                        handler.process()
+            except (OSError, FrameError, CodecError) as e:
+                paxos_server.tracer.warning(None, 'Connection from {} closed: {}', self.client_address, e)
+
+        def sendall(self, data):
+            with self.send_lock:
+                send_frame(self.request, data, self.server.paxos_server.max_frame_size)
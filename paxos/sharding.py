@@ -0,0 +1,134 @@
+import bisect
+import hashlib
+
+from paxos.client import Client
+from paxos.helpers import string_to_address
+from paxos.partition import key_tag
+
+
+REPLICAS = 64               # points of every group on the hash ring
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys to Paxos groups. Every group owns REPLICAS points of the ring and a key
+    belongs to the group of the first point following the hash of its tag (see paxos.partition.key_tag),
+    so adding a group moves only about 1 / groups of the keys.
+    """
+
+    def __init__(self, groups, replicas=REPLICAS):
+        """
+        :param groups: number of groups or list of group names; a group keeps its points when others are added
+        """
+        self.groups = list(range(groups)) if isinstance(groups, int) else list(groups)
+        points = sorted((ring_hash('{}#{}'.format(group, replica)), index)
+                        for index, group in enumerate(self.groups) for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._indexes = [index for _, index in points]
+
+    def group_of(self, key):
+        """
+        :return: index of the group of a key
+        """
+        position = bisect.bisect(self._hashes, ring_hash(key_tag(key))) % len(self._hashes)
+        return self._indexes[position]
+
+    def split(self, keys):
+        """
+        :return: dictionary of group index and list of positions of its keys in keys
+        """
+        groups = {}
+        for position, key in enumerate(keys):
+            groups.setdefault(self.group_of(key), []).append(position)
+        return groups
+
+
+def place_groups(hosts, groups, base_port, size=None):
+    """
+    Lay out groups over hosts: group i has one server on each of size consecutive hosts starting with host i.
+    Without a live leader the server with the highest id times out first and wins the election
+    (see Server.get_randomized_timeout), so it is listed last, which puts leaders of consecutive groups
+    on different hosts. Every server gets its own port, so hosts can be repeated.
+
+    :param size: servers per group, by default one on every host
+    :return: list of server address lists, one per group
+    """
+    size = size or len(hosts)
+    return [['{}:{}'.format(hosts[(group + offset) % len(hosts)], base_port + group * size + offset)
+             for offset in range(size - 1, -1, -1)]
+            for group in range(groups)]
+
+
+def host_servers(groups, host):
+    """
+    :return: list of (group servers, address) of servers of all groups running on host
+    """
+    return [(servers, address) for servers in groups for address in servers
+            if string_to_address(address)[0] == host]
+
+
+class ShardedClient(object):
+    """
+    Client of a deployment of many Paxos groups, each a separate cluster agreeing on the keys
+    hashed to it by HashRing. Every key is sent to the leader of its group, cached by the group's Client.
+    Multi-writes are atomic only within a group, keys sharing a {tag} always are in one group.
+    """
+
+    def __init__(self, groups, replicas=REPLICAS, **options):
+        """
+        :param groups: list of server address lists, one per group
+        :param options: Client options shared by all groups
+        """
+        self.ring = HashRing(len(groups), replicas=replicas)
+        self.clients = [Client(servers=servers, **options) for servers in groups]
+
+    def client_of(self, key):
+        return self.clients[self.ring.group_of(key)]
+
+    def run(self, key, value=None):
+        self.client_of(key).run(key, value)
+        self.close()
+
+    def get(self, key):
+        return self.client_of(key).get(key)
+
+    def set(self, key, value):
+        return self.client_of(key).set(key, value)
+
+    def mget(self, keys):
+        """
+        Read several keys with one request per group.
+
+        :return: list of values in order of keys or None if reading any group failed
+        """
+        keys = list(keys)
+        values = [None] * len(keys)
+        for group, positions in self.ring.split(keys).items():
+            group_values = self.clients[group].mget([keys[position] for position in positions])
+            if group_values is None:
+                return None
+            for position, value in zip(positions, group_values):
+                values[position] = value
+        return values
+
+    def mset(self, items):
+        """
+        Write several keys of one group atomically.
+
+        :param items: dictionary or list of (key, value) pairs
+        :return: True if the write was accepted, False also if the keys belong to several groups
+        """
+        items = list(items.items() if isinstance(items, dict) else items)
+        groups = self.ring.split([key for key, _ in items])
+        if len(groups) > 1:
+            print('WRITE ERROR: Keys of a multi-write must be in one group, use a common {tag}')
+            return False
+        return self.clients[next(iter(groups), 0)].mset(items)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
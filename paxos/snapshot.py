@@ -0,0 +1,85 @@
+import json
+import os
+from threading import Lock
+
+
+SNAPSHOT_EVERY = 10000      # number of applied log slots between snapshots
+
+
+class Snapshotter(object):
+    """
+    Writes snapshots of server state to a file and keeps their statistics.
+
+    Snapshot is a dictionary of:
+    slot - number of log slots applied to data in all partitions, minus one,
+    partitions - list of dictionaries of partition state:
+        slot - all log slots of the partition up to slot are applied to data,
+        promise - [sender id, proposal number] of the promised proposal,
+        commit_index and entries - accepted log entries after slot, as lists,
+    data - list of [key, value] pairs of the store.
+    Snapshots without partitions hold the state of the only partition at the top level.
+    """
+
+    def __init__(self, path, every=SNAPSHOT_EVERY):
+        self.path = path
+        self.every = max(1, every)
+        self.last_slot = -1
+        self.stats = {
+            'count': 0,
+            'slot': -1,
+            'duration': 0.0,        # in seconds, time taken by the last snapshot
+            'size': 0,              # in bytes, size of the last snapshot
+            'restore_duration': 0.0,    # in seconds, time taken to restore state on startup
+        }
+        self._in_progress = False
+        self._lock = Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def begin(self, applied_index):
+        """
+        :return: True if a snapshot is due and none is in progress, the caller then has to take it and call finish
+        """
+        with self._lock:
+            if self._in_progress or applied_index - self.last_slot < self.every:
+                return False
+            self._in_progress = True
+            return True
+
+    def finish(self, slot=None, duration=0.0, size=0):
+        """
+        :param slot: slot of the written snapshot, None if it failed
+        """
+        with self._lock:
+            self._in_progress = False
+            if slot is not None:
+                self.last_slot = slot
+                self.stats.update(count=self.stats['count'] + 1, slot=slot, duration=duration, size=size)
+
+    def write(self, state):
+        """
+        Write snapshot atomically: to a temporary file, which replaces the previous snapshot once it is on disk.
+
+        :return: size of the snapshot in bytes
+        """
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as stream:
+            json.dump(state, stream, separators=(',', ':'))
+            stream.flush()
+            os.fsync(stream.fileno())
+            size = stream.tell()
+        os.replace(temp_path, self.path)
+        return size
+
+    def load(self):
+        """
+        :return: the latest snapshot or None if there is none
+        """
+        try:
+            with open(self.path, encoding='utf-8') as stream:
+                state = json.load(stream)
+        except FileNotFoundError:
+            return None
+        self.last_slot = max(self.last_slot, state['slot'])
+        return state
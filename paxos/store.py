@@ -1,20 +1,193 @@
-import redis
+from threading import Lock
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+ENGINE_REDIS = 'redis'
+ENGINE_MEMORY = 'memory'
+DEFAULT_ENGINE = ENGINE_REDIS
+
+
+class StorageEngine(object):
+    """
+    Key-value storage used by a server. Values are returned as bytes.
+    """
+    __slots__ = ()
+    blocking = True             # calls wait on I/O, so an event loop must not make them
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def get_many(self, keys):
+        """
+        :return: list of values in order of keys, None for keys which aren't set
+        """
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        return self.set_many([[key, value]])
+
+    def set_many(self, items):
+        """
+        Atomically set all key-value pairs.
+
+        :param items: list of [key, value] pairs
+        """
+        raise NotImplementedError()
+
+    def dump(self):
+        """
+        :return: list of all stored [key, value] pairs. Writes done meanwhile may or may not be included.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class RedisEngine(StorageEngine):
+    """
+    Stores data in Redis. All calls share one connection pool.
+    Servers using the same Redis instance are separated by key prefix, by default containing server id.
+    """
+
+    def __init__(self, node_id, host='localhost', port=6379, db=0, prefix='node{id}:', max_connections=None):
+        if redis is None:
+            raise ImportError('redis package is required by {} storage engine'.format(ENGINE_REDIS))
+        self.prefix = prefix.format(id=node_id)
+        self.pool = redis.ConnectionPool(host=host, port=port, db=db, max_connections=max_connections)
+        self.client = redis.StrictRedis(connection_pool=self.pool)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        return self.client.mget([self.prefix + key for key in keys])
+
+    def set(self, key, value):
+        return self.client.set(self.prefix + key, value)
+
+    def set_many(self, items):
+        pipe = self.client.pipeline(transaction=True)
+        for key, value in items:
+            pipe.set(self.prefix + key, value)
+        return pipe.execute()
+
+    def dump(self, chunk_size=1000):
+        items = []
+        keys = []
+        for key in self.client.scan_iter(match=self.prefix + '*', count=chunk_size):
+            keys.append(key)
+            if len(keys) >= chunk_size:
+                items.extend(self._fetch(keys))
+                keys = []
+        items.extend(self._fetch(keys))
+        return items
+
+    def _fetch(self, keys):
+        if not keys:
+            return []
+        start = len(self.prefix)
+        return [[str(key, 'utf-8')[start:], value] for key, value in zip(keys, self.client.mget(keys))
+                if value is not None]
+
+    def close(self):
+        self.pool.disconnect()
+
+
+class MemoryEngine(StorageEngine):
+    """
+    Stores data in a dictionary of the server process, for tests and deployments
+    where latency matters more than durability of the store itself.
+    """
+    __slots__ = ('_data', '_lock')
+    blocking = False
+
+    def __init__(self, node_id=None):
+        self._data = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _as_bytes(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value):
+        value = self._as_bytes(value)
+        with self._lock:
+            self._data[key] = value
+        return True
+
+    def set_many(self, items):
+        items = [(key, self._as_bytes(value)) for key, value in items]
+        with self._lock:
+            self._data.update(items)
+        return True
+
+    def dump(self):
+        with self._lock:
+            return [[key, value] for key, value in self._data.items()]
+
+
+ENGINES = {
+    ENGINE_REDIS: RedisEngine,
+    ENGINE_MEMORY: MemoryEngine,
+}
+
+
+def create_engine(node_id, engine=DEFAULT_ENGINE, **options):
+    """
+    :param engine: name of the engine, see ENGINES
+    :param options: engine specific settings, e.g. host and port of Redis
+    """
+    try:
+        engine_class = ENGINES[engine]
+    except KeyError:
+        raise ValueError('Unknown storage engine: {}'.format(engine))
+    return engine_class(node_id=node_id, **options)
 
 
 class StoreMixin(object):
     """
     Provides base for persistent storing of key-value pairs.
+    Calls are delegated to the storage engine created by init_storage and timed in metrics of the server.
     """
 
-    def redis_connection(self):
-        return redis.StrictRedis(host=self.redis_host, port=self.redis_port, db=self.id)
+    def init_storage(self, storage):
+        """
+        :param storage: dictionary with engine name and its settings, as in storage section of config file
+        """
+        self.storage = create_engine(self.id, **storage)
 
     def set(self, key, value):
-        r = self.redis_connection()
-        result = r.set(key, value)
-        return result
+        with self.metrics.timer('store_set'):
+            return self.storage.set(key, value)
 
     def get(self, key):
-        r = self.redis_connection()
-        result = r.get(key)
-        return result
+        with self.metrics.timer('store_get'):
+            return self.storage.get(key)
+
+    def get_many(self, keys):
+        with self.metrics.timer('store_get_many'):
+            return self.storage.get_many(keys)
+
+    def set_many(self, items):
+        """
+        Atomically set all key-value pairs.
+
+        :param items: list of [key, value] pairs
+        """
+        with self.metrics.timer('store_set_many'):
+            return self.storage.set_many(items)
+
+    def dump(self):
+        return self.storage.dump()
@@ -0,0 +1,143 @@
+"""
+Structured tracing of a server, replacing prints on the request path.
+
+Records are kept in an in-memory ring buffer and formatted only when dumped or echoed, so a record below the level
+costs a method call and a comparison. Records of requests carry the trace id the client gave the request,
+which is passed on with prepare and accept messages, so a request can be followed across servers.
+Sampling keeps records of a fraction of trace ids, chosen by the id itself, so all servers keep the same requests.
+The buffer is read with MSG_TRACE (`python node.py trace`).
+"""
+import random
+import sys
+import time
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR, 'off': OFF}
+LEVEL_NAMES = {value: name.upper() for name, value in LEVELS.items()}
+
+CAPACITY = 10000            # records kept in the ring buffer
+SAMPLE_SCALE = 10000        # resolution of sample rates
+_MIX = 0x9E3779B97F4A7C15   # spreads consecutive trace ids over sample buckets
+
+
+def level_of(level):
+    """
+    :param level: level number or name, e.g. 'debug'
+    """
+    if isinstance(level, str):
+        try:
+            return LEVELS[level.lower()]
+        except KeyError:
+            raise ValueError('Unknown trace level: {}'.format(level))
+    return int(level)
+
+
+def new_trace_id():
+    return random.getrandbits(63)
+
+
+def format_record(record, name=''):
+    """
+    :param record: [time, level name, trace id, message] as returned by Tracer.dump
+    """
+    timestamp, level, trace_id, text = record
+    clock = time.strftime('%H:%M:%S', time.localtime(timestamp)) + '.{:03d}'.format(int(timestamp * 1000) % 1000)
+    parts = [clock, '{:<7}'.format(level)]
+    if name:
+        parts.append(name)
+    if trace_id is not None:
+        parts.append('[{:016x}]'.format(trace_id))
+    parts.append(text)
+    return ' '.join(parts)
+
+
+class Tracer(object):
+    """
+    Leveled, sampled trace records of one server.
+    """
+
+    def __init__(self, name='', level=INFO, sample=1.0, capacity=CAPACITY, echo=INFO, stream=None):
+        """
+        :param level: records below level are dropped
+        :param sample: fraction of trace ids whose records are kept, records without a trace id are always kept
+        :param echo: kept records at or above echo are also written to stream as they come
+        :param stream: by default the current sys.stdout
+        """
+        self.name = name
+        self.stream = stream
+        self.records = deque(maxlen=capacity)
+        self.level = self.echo = INFO
+        self._threshold = SAMPLE_SCALE
+        self.configure(level=level, sample=sample, echo=echo)
+
+    def configure(self, level=None, sample=None, echo=None):
+        if level is not None:
+            self.level = level_of(level)
+        if echo is not None:
+            self.echo = level_of(echo)
+        if sample is not None:
+            self._threshold = max(0.0, min(1.0, float(sample))) * SAMPLE_SCALE
+
+    def sampled(self, trace_id):
+        return trace_id is None or self._threshold >= SAMPLE_SCALE or \
+            (trace_id * _MIX >> 32) % SAMPLE_SCALE < self._threshold
+
+    def enabled(self, level, trace_id=None):
+        """
+        Guard for records whose arguments are expensive to compute.
+        """
+        return level >= self.level and self.sampled(trace_id)
+
+    def record(self, level, trace_id, text, args):
+        """
+        Keep a record. Text is formatted with args by str.format only when the record is dumped or echoed,
+        so args should not be changed afterwards.
+        """
+        if level < self.level or not self.sampled(trace_id):
+            return
+        record = (time.time(), level, trace_id, text, args)
+        self.records.append(record)
+        if level >= self.echo:
+            (self.stream or sys.stdout).write(format_record(self._render(record), self.name) + '\n')
+
+    def debug(self, trace_id, text, *args):
+        self.record(DEBUG, trace_id, text, args)
+
+    def info(self, trace_id, text, *args):
+        self.record(INFO, trace_id, text, args)
+
+    def warning(self, trace_id, text, *args):
+        self.record(WARNING, trace_id, text, args)
+
+    def error(self, trace_id, text, *args):
+        self.record(ERROR, trace_id, text, args)
+
+    @staticmethod
+    def _render(record):
+        timestamp, level, trace_id, text, args = record
+        try:
+            text = text.format(*args) if args else text
+        except Exception as e:
+            text = '{} {!r} ({!r})'.format(text, args, e)
+        return [timestamp, LEVEL_NAMES.get(level, str(level)), trace_id, text]
+
+    def dump(self, level=DEBUG, trace_id=None, limit=None):
+        """
+        :param trace_id: only records of this trace
+        :param limit: only the latest limit records
+        :return: list of [time, level name, trace id, message], oldest first
+        """
+        level = level_of(level)
+        records = [record for record in list(self.records)
+                   if record[1] >= level and (trace_id is None or record[2] == trace_id)]
+        if limit is not None:
+            records = records[-limit:] if limit else []
+        return [self._render(record) for record in records]
+
+    def clear(self):
+        self.records.clear()
@@ -0,0 +1,204 @@
+"""
+Transports carrying messages of participants to servers.
+
+Participants send messages through Node objects made by their transport. By default nodes talk TCP (TcpTransport),
+SimulatedNetwork instead delivers messages to Server objects of the same process, with simulated latency,
+loss and partitions, so a whole cluster runs in one process without sockets.
+"""
+import random
+import threading
+import time
+from collections import Counter
+
+from paxos.core import Message, Node
+from paxos.protocol import PaxosHandler
+
+
+class Transport(object):
+    """
+    Makes nodes through which a participant sends messages, and makes servers reachable.
+    """
+
+    def node(self, participant, address, node_id):
+        """
+        :param participant: sender, paxos.core.Participant
+        :return: Node sending to the server at address
+        """
+        raise NotImplementedError()
+
+    def register(self, server):
+        """
+        Make server reachable at its address. Called by the server once it is initialized.
+        """
+        raise NotImplementedError()
+
+
+class TcpTransport(Transport):
+    """
+    Messages are sent over pooled TCP connections, servers accept them in Server.run.
+    """
+
+    def node(self, participant, address, node_id):
+        return Node(address=address, node_id=node_id, max_frame_size=participant.max_frame_size,
+                    wire_format=participant.wire_format)
+
+    def register(self, server):
+        pass
+
+
+class RealClock(object):
+
+    @staticmethod
+    def now():
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(delay):
+        time.sleep(delay)
+
+
+class VirtualClock(object):
+    """
+    Clock which doesn't wait: sleep returns at once and moves the clock forward by the delay.
+    Simulated latency and timeouts are then accounted for without costing wall time, so a cluster runs rounds
+    as fast as servers process them. The clock is shared by all threads, concurrent delays add up.
+    Server timers (heartbeats, elections, leases) keep running on real time.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def now(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, delay):
+        with self._lock:
+            self._now += max(0.0, delay)
+
+
+class SimulatedNetwork(Transport):
+    """
+    In-process network of servers. A request is handled by the receiving server in the sending thread,
+    like a TCP request is handled by a thread of the server, and its response is returned to the sender.
+
+    Every message is delayed by latency plus a random jitter of up to jitter seconds, each way, and lost
+    with probability loss, in which case the sender times out. Messages between partitioned servers are lost.
+    Random choices come from a generator seeded by seed, so a run with the same seed meets the same faults
+    in the same order of messages.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, seed=None, clock=None):
+        """
+        :param latency: in seconds, one way delay of every message
+        :param jitter: in seconds, maximal random delay added to latency
+        :param loss: probability of losing a message, from 0 to 1
+        :param clock: RealClock (default) or VirtualClock
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.clock = clock if clock is not None else RealClock()
+        self.stats = Counter()      # sent, delivered, lost and refused messages
+        self._random = random.Random(seed)
+        self._servers = {}
+        self._groups = None         # address -> index of its side of a partition
+        self._lock = threading.Lock()
+
+    def node(self, participant, address, node_id):
+        return SimulatedNode(self, getattr(participant, 'address', None), address, node_id,
+                             wire_format=participant.wire_format)
+
+    def register(self, server):
+        with self._lock:
+            self._servers[server.address] = server
+
+    def partition(self, *groups):
+        """
+        Split the network: servers can only reach servers of the same group. Clients and servers
+        not listed form one more group.
+
+        :param groups: lists of server addresses
+        """
+        with self._lock:
+            self._groups = {address: index for index, group in enumerate(groups) for address in group}
+
+    def heal(self):
+        with self._lock:
+            self._groups = None
+
+    def _connected(self, source, destination):
+        if self._groups is None:
+            return True
+        return self._groups.get(source, -1) == self._groups.get(destination, -1)
+
+    def _transit(self, source, destination):
+        """
+        :return: delay of a message or None if the message is lost
+        """
+        with self._lock:
+            self.stats['sent'] += 1
+            if not self._connected(source, destination) or (self.loss and self._random.random() < self.loss):
+                self.stats['lost'] += 1
+                return None
+            return self.latency + (self._random.random() * self.jitter if self.jitter else 0.0)
+
+    def exchange(self, source, destination, data, timeout):
+        """
+        Deliver a request and return the response.
+
+        :raises TimeoutError: if the request or the response was lost or came later than timeout
+        :raises ConnectionRefusedError: if no running server is registered at destination
+        """
+        delay = self._transit(source, destination)
+        if delay is None or delay > timeout:
+            self.clock.sleep(timeout)
+            raise TimeoutError('Request to {} lost'.format(destination))
+        self.clock.sleep(delay)
+        with self._lock:
+            server = self._servers.get(destination)
+        if server is None or server.stopped:
+            with self._lock:
+                self.stats['refused'] += 1
+            raise ConnectionRefusedError(destination)
+        responder = SimulatedResponder()
+        PaxosHandler(Message.unserialize(data), server, responder).process()
+        response_delay = self._transit(destination, source)
+        if response_delay is None or delay + response_delay > timeout:
+            self.clock.sleep(timeout - delay)
+            raise TimeoutError('Response from {} lost'.format(destination))
+        self.clock.sleep(response_delay)
+        with self._lock:
+            self.stats['delivered'] += 1
+        return responder.data
+
+
+class SimulatedResponder(object):
+    """
+    Plays the role of a socket for PaxosHandler.respond, keeping the response.
+    """
+
+    def __init__(self):
+        self.data = None
+
+    def sendall(self, data):
+        self.data = data
+
+
+class SimulatedNode(Node):
+    """
+    Node sending messages through a SimulatedNetwork. Failures are reported like by a TCP node,
+    with a MSG_ERROR response.
+    """
+
+    def __init__(self, network, source, address, node_id, **kwargs):
+        super(SimulatedNode, self).__init__(address=address, node_id=node_id, **kwargs)
+        self.network = network
+        self.source = source
+
+    def send_raw(self, data, timeout):
+        try:
+            return self.network.exchange(self.source, self.address, data, timeout)
+        except OSError as e:
+            return Message(message_type=Message.MSG_ERROR, reason=e.__class__.__name__).serialize()
@@ -0,0 +1,203 @@
+import json
+import os
+import struct
+import time
+import zlib
+from threading import Condition, Lock
+
+
+FLUSH_INTERVAL = 0.0        # in seconds, how long the syncing writer waits for more records before fsync
+
+RECORD_HEADER = struct.Struct('!II')    # payload length, CRC32 of payload
+
+_json_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+
+class WriteAheadLog(object):
+    """
+    Append-only log of records, each a JSON-serializable list. Records are written to numbered segment files
+    next to path, e.g. node0.log.000001. A new segment is started by rotate, so that segments covered
+    by a snapshot can be removed.
+
+    Durability uses group commit: a writer waiting for its record becomes the syncing writer only
+    if no fsync is in progress, otherwise it waits for the running one and checks whether that covered
+    its record. Records appended meanwhile are synced together by the next syncing writer,
+    so concurrent writers share a single fsync. Appending doesn't wait for a running fsync.
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, fsync=True, tracer=None):
+        """
+        :param flush_interval: seconds the syncing writer waits for more records, trading latency for fewer fsyncs
+        :param fsync: if False records are only written to the OS, for tests and benchmarks
+        :param tracer: paxos.tracing.Tracer warned about truncated records
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.tracer = tracer
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        self._file = open(self.segment_path(self.segment), 'ab')
+        self._lock = Lock()
+        self._sync_condition = Condition()
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+
+    def segment_path(self, segment):
+        return '{}.{:06d}'.format(self.path, segment)
+
+    def segments(self):
+        """
+        :return: sorted numbers of existing segments
+        """
+        directory, prefix = os.path.split(self.path)
+        prefix += '.'
+        segments = []
+        for name in os.listdir(directory or '.'):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                segments.append(int(name[len(prefix):]))
+        return sorted(segments)
+
+    def append(self, record, sync=True):
+        """
+        :param sync: wait until the record is on disk
+        :return: sequence number of the record, to be passed to sync
+        """
+        payload = _json_encode(record).encode('utf-8')
+        data = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            self._file.write(data)
+            self._appended += 1
+            seq = self._appended
+        if sync:
+            self.sync(seq)
+        return seq
+
+    def sync(self, seq=None):
+        """
+        Wait until records up to seq, by default all appended records, are on disk.
+        """
+        if seq is None:
+            with self._lock:
+                seq = self._appended
+        if not self._begin_sync(seq):
+            return
+        synced = self._synced
+        try:
+            if self.flush_interval > 0:
+                time.sleep(self.flush_interval)
+            with self._lock:
+                self._file.flush()
+                synced = self._appended
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        finally:
+            self._end_sync(synced)
+
+    def _begin_sync(self, seq):
+        """
+        :return: True if the caller has to sync records up to seq, False if they are already synced
+        """
+        with self._sync_condition:
+            while self._synced < seq:
+                if not self._syncing:
+                    self._syncing = True
+                    return True
+                self._sync_condition.wait()
+        return False
+
+    def _end_sync(self, synced):
+        with self._sync_condition:
+            self._syncing = False
+            self._synced = max(self._synced, synced)
+            self._sync_condition.notify_all()
+
+    def rotate(self):
+        """
+        Sync the current segment and continue in a new one.
+
+        :return: number of the last segment which contains records appended before the call
+        """
+        with self._sync_condition:
+            while self._syncing:
+                self._sync_condition.wait()
+            self._syncing = True
+        synced = self._synced
+        try:
+            with self._lock:
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                self._file.close()
+                synced = self._appended
+                previous = self.segment
+                self.segment += 1
+                self._file = open(self.segment_path(self.segment), 'ab')
+        finally:
+            self._end_sync(synced)
+        return previous
+
+    def remove_segments(self, last):
+        """
+        Remove segments up to last, once their records are covered by a snapshot.
+        """
+        for segment in self.segments():
+            if segment <= last and segment != self.segment:
+                os.remove(self.segment_path(segment))
+
+    def replay(self):
+        """
+        Read records written so far. Incomplete or corrupted records at the end of a segment, left by
+        a crash in the middle of a write, are cut off.
+
+        :return: list of records
+        """
+        records = []
+        with self._lock:
+            self._file.flush()
+            for segment in self.segments():
+                path = self.segment_path(segment)
+                with open(path, 'rb') as stream:
+                    data = stream.read()
+                segment_records, end = read_records(data)
+                records.extend(segment_records)
+                if end < len(data):
+                    if self.tracer is not None:
+                        self.tracer.warning(None, '[WAL] Truncating {} bytes of incomplete records in {}',
+                                            len(data) - end, path)
+                    os.truncate(path, end)
+        return records
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def read_records(data):
+    """
+    :return: tuple (list of valid records, offset after the last valid record)
+    """
+    records = []
+    pos = 0
+    end = len(data)
+    while pos + RECORD_HEADER.size <= end:
+        length, crc = RECORD_HEADER.unpack_from(data, pos)
+        start = pos + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        try:
+            records.append(json.loads(payload.decode('utf-8')))
+        except ValueError:
+            break
+        pos = start + length
+    return records, pos
@@ -0,0 +1,106 @@
+import asyncio
+import socket
+import threading
+import time
+from unittest import TestCase
+from paxos.aioclient import AsyncClient, RequestError
+from paxos.asyncserver import AsyncServer
+from paxos.core import Message
+from paxos.helpers import run_coroutine
+from paxos.server import Server
+from paxos.store import ENGINE_MEMORY
+from tests.test_asyncserver import free_port
+
+
+class AsyncClientTest(TestCase):
+    """
+    Runs the client against a single server cluster served by each engine.
+    """
+
+    def start_server(self, server_class):
+        address = '127.0.0.1:{}'.format(free_port())
+        server = server_class(servers=[address], address=address, storage={'engine': ENGINE_MEMORY},
+                              batch_linger=0.2)
+        server.leader_id = server.id
+        threading.Thread(target=server.run, daemon=True).start()
+        for _ in range(100):
+            try:
+                socket.create_connection((server.host, server.port)).close()
+                break
+            except OSError:
+                time.sleep(0.01)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def run_client(self, server, operations):
+        async def run():
+            client = AsyncClient(servers=server.servers)
+            try:
+                return await operations(client)
+            finally:
+                client.close()
+        return run_coroutine(run())
+
+    def test_set_get(self):
+        for server_class in (Server, AsyncServer):
+            server = self.start_server(server_class)
+
+            async def operations(client):
+                await client.set('k', 'v')
+                await client.mset({'a': '1', 'b': '2'})
+                return await client.get('k'), await client.mget(['a', 'b', 'missing'])
+            self.assertEqual(self.run_client(server, operations), ('v', ['1', '2', '']))
+
+    def test_pipelined_requests_answered_out_of_order(self):
+        for server_class in (Server, AsyncServer):
+            server = self.start_server(server_class)
+            server.set('r', 'old')
+
+            async def operations(client):
+                finished = []
+
+                async def track(name, operation):
+                    await operation
+                    finished.append(name)
+                await asyncio.gather(track('write', client.set('w', 'v')), track('read', client.get('r')))
+                return finished, len(client.connections[0]._pending)
+            self.assertEqual(self.run_client(server, operations), (['read', 'write'], 0))
+
+    def test_request_timeout(self):
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen()
+        self.addCleanup(silent.close)
+
+        async def run():
+            client = AsyncClient(servers=['127.0.0.1:{}'.format(silent.getsockname()[1])])
+            client.ATTEMPTS = 1
+            try:
+                with self.assertRaises(RequestError):
+                    await client.connections[0].request(Message(message_type=Message.MSG_READ, key='k'), 0.1)
+                self.assertEqual(client.connections[0]._pending, {})
+            finally:
+                client.close()
+        run_coroutine(run())
+
+    def test_connection_lost_right_after_connect(self):
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen()
+        self.addCleanup(silent.close)
+
+        async def run():
+            client = AsyncClient(servers=['127.0.0.1:{}'.format(silent.getsockname()[1])])
+            connection = client.connections[0]
+            open_connection = connection._open
+
+            async def open_and_lose():
+                await open_connection()
+                connection._disconnect(RequestError('lost'))
+            connection._open = open_and_lose
+            try:
+                with self.assertRaises(RequestError):
+                    await connection.request(Message(message_type=Message.MSG_READ, key='k'), 1)
+            finally:
+                client.close()
+        run_coroutine(run())
@@ -0,0 +1,80 @@
+import socket
+import threading
+import time
+from unittest import TestCase, mock
+from paxos.asyncserver import AsyncServer
+from paxos.core import Message, Node
+from paxos.protocol import PaxosHandler
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class AsyncServerTest(TestCase):
+
+    def setUp(self):
+        self.address = '127.0.0.1:{}'.format(free_port())
+        self.server = AsyncServer(servers=[self.address, '127.0.0.1:{}'.format(free_port())], address=self.address)
+        self.server.get = lambda key: b'value-' + key.encode()
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        self.node = Node(address=self.address, node_id=0)
+        for _ in range(50):
+            if self.server.aio_server is not None:
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.node.close()
+        self.server.shutdown()
+        self.thread.join(timeout=2)
+
+    def test_heartbeat_acknowledged(self):
+        heartbeat = Message(message_type=Message.MSG_HEARTBEAT, sender_id=1, heartbeat=time.time())
+        response = Message.unserialize(self.node.send_immediate(heartbeat))
+        self.assertEqual(response.message_type, Message.MSG_HEARTBEAT_ACK)
+
+    def test_read(self):
+        for key in ('a', 'b'):
+            response = Message.unserialize(self.node.send_immediate(Message(message_type=Message.MSG_READ, key=key)))
+            self.assertEqual(response.value, 'value-' + key)
+
+    def test_read_served_during_write(self):
+        def slow_write(handler):
+            time.sleep(0.5)
+            handler.respond(Message(message_type=Message.MSG_ACCEPTED, key=handler.message.key))
+
+        with mock.patch.object(PaxosHandler, 'on_write', slow_write):
+            writer = threading.Thread(target=self.node.send_awaiting,
+                                      args=(Message(message_type=Message.MSG_WRITE, key='w', value='v'),))
+            writer.start()
+            time.sleep(0.1)
+            start = time.time()
+            response = Message.unserialize(self.node.send_immediate(Message(message_type=Message.MSG_READ, key='a')))
+            elapsed = time.time() - start
+            writer.join()
+        self.assertEqual(response.value, 'value-a')
+        self.assertLess(elapsed, 0.3)
+
+    def test_heartbeat_served_during_slow_store_read(self):
+        def slow_get(key):
+            time.sleep(0.5)
+            return b'slow'
+
+        self.server.get = slow_get
+        read = Message(message_type=Message.MSG_READ, key='a')
+        reader = threading.Thread(target=self.node.send_immediate, args=(read,))
+        reader.start()
+        time.sleep(0.1)
+        start = time.time()
+        heartbeat = Message(message_type=Message.MSG_HEARTBEAT, sender_id=1, heartbeat=time.time())
+        response = Message.unserialize(self.node.send_immediate(heartbeat))
+        elapsed = time.time() - start
+        reader.join()
+        self.assertEqual(response.message_type, Message.MSG_HEARTBEAT_ACK)
+        self.assertLess(elapsed, 0.3)
@@ -0,0 +1,38 @@
+from unittest import TestCase
+from paxos.batching import WriteBatcher
+
+
+class WriteBatcherTest(TestCase):
+
+    def test_first_write_leads_batch(self):
+        batcher = WriteBatcher(batch_size=3)
+        results = [batcher.submit(write) for write in ('a', 'b')]
+        self.assertIs(results[0][0], results[1][0])
+        self.assertEqual([(index, leads) for _, index, leads in results], [(0, True), (1, False)])
+
+    def test_full_batch_starts_new_one(self):
+        batcher = WriteBatcher(batch_size=2)
+        first, _, _ = batcher.submit('a')
+        batcher.submit('b')
+        second, index, leads = batcher.submit('c')
+        self.assertIsNot(first, second)
+        self.assertTrue(first.full.is_set())
+        self.assertEqual((index, leads), (0, True))
+
+    def test_closed_batch_takes_no_writes(self):
+        batcher = WriteBatcher(batch_size=10)
+        batch, _, _ = batcher.submit('a')
+        self.assertEqual(batcher.close(batch), ['a'])
+        other, _, leads = batcher.submit('b')
+        self.assertIsNot(batch, other)
+        self.assertTrue(leads)
+        self.assertEqual(batch.writes, ['a'])
+
+    def test_callbacks_get_responses(self):
+        batch, _, _ = WriteBatcher().submit('a')
+        received = []
+        batch.add_done_callback(received.append)
+        self.assertEqual(received, [])
+        batch.resolve(['ok'])
+        batch.add_done_callback(received.append)
+        self.assertEqual(received, [['ok'], ['ok']])
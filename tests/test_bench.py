@@ -0,0 +1,56 @@
+from collections import Counter
+from unittest import TestCase
+from paxos.bench import Benchmark, KeyChooser, PhaseStats, percentile, DISTRIBUTION_ZIPF
+from paxos.sharding import HashRing
+
+
+class PercentileTest(TestCase):
+
+    def test_nearest_rank(self):
+        latencies = list(range(1, 1001))
+        self.assertEqual(percentile(latencies, 50), 500)
+        self.assertEqual(percentile(latencies, 99), 990)
+        self.assertEqual(percentile(latencies, 99.9), 999)
+        self.assertEqual(percentile([7], 99.9), 7)
+        self.assertIsNone(percentile([], 50))
+
+
+class KeyChooserTest(TestCase):
+
+    def test_zipf_prefers_hot_keys(self):
+        chooser = KeyChooser(100, DISTRIBUTION_ZIPF, seed=1)
+        counts = Counter(chooser.choose() for _ in range(10000))
+        self.assertGreater(counts['key-0'], 10 * counts['key-99'])
+        self.assertLessEqual(set(counts), set(chooser.keys))
+
+    def test_unknown_distribution(self):
+        self.assertRaises(ValueError, KeyChooser, 10, 'normal')
+
+
+class PhaseStatsTest(TestCase):
+
+    def test_summary_per_operation(self):
+        stats = PhaseStats('run')
+        for latency in (0.001, 0.002, 0.003):
+            stats.record('read', latency)
+        stats.record('write', 0.010)
+        stats.record('write', 1.0, failed=True)
+        stats.duration = 2.0
+        summary = stats.summary()
+        self.assertEqual(sorted(summary), ['all', 'read', 'write'])
+        self.assertEqual(summary['read']['count'], 3)
+        self.assertAlmostEqual(summary['read']['p50'], 2.0)
+        self.assertEqual(summary['write']['errors'], 1)
+        self.assertEqual(summary['all']['throughput'], 2.0)
+        self.assertAlmostEqual(summary['all']['p99.9'], 10.0)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_keys_sent_to_their_group(self):
+        groups = [['127.0.0.1:9000'], ['127.0.0.1:9001'], ['127.0.0.1:9002']]
+        benchmark = Benchmark(None, keys=100, groups=groups)
+        benchmark.clients = ['client 0', 'client 1', 'client 2']
+        ring = HashRing(3)
+        for key in benchmark.chooser.keys:
+            self.assertEqual(benchmark.client_of(key), 'client {}'.format(ring.group_of(key)))
@@ -0,0 +1,84 @@
+import time
+from unittest import TestCase, mock
+from paxos.client import Client
+from paxos.core import Message
+from tests.test_protocol import FakeNode
+
+
+class QuorumChoiceTest(TestCase):
+
+    def setUp(self):
+        self.client = Client(servers=['127.0.0.1:{}'.format(port) for port in range(8000, 8005)])
+        self.read = Message(message_type=Message.MSG_READ, key='k')
+
+    def set_nodes(self, *nodes):
+        self.client.nodes = {node_id: node for node_id, node in enumerate(nodes)}
+
+    def test_returns_once_quorum_agrees(self):
+        value = Message(message_type=Message.MSG_ACCEPTED, value='v')
+        self.set_nodes(FakeNode(value), FakeNode(value, 2), FakeNode(value), FakeNode(value), FakeNode(value, 2))
+        start = time.time()
+        self.assertEqual(self.client.quorum_choice(self.read, 'value'), 'v')
+        self.assertLess(time.time() - start, 1)
+
+    def test_stops_when_quorum_impossible(self):
+        error = Message(message_type=Message.MSG_ERROR)
+        value = Message(message_type=Message.MSG_ACCEPTED, value='v')
+        self.set_nodes(FakeNode(error), FakeNode(error), FakeNode(error), FakeNode(value, 2), FakeNode(value, 2))
+        start = time.time()
+        self.assertIsNone(self.client.quorum_choice(self.read, 'value'))
+        self.assertLess(time.time() - start, 1)
+
+    def test_count_values_skips_errors(self):
+        responses = [Message(message_type=Message.MSG_ACCEPTED, leader_id=1),
+                     Message(message_type=Message.MSG_ERROR),
+                     Message(message_type=Message.MSG_ACCEPTED, leader_id=1),
+                     Message(message_type=Message.MSG_ACCEPTED, leader_id=2)]
+        self.assertEqual(Client.count_values(responses, 'leader_id'), {1: 2, 2: 1})
+
+    def test_multi_read_values_compared_by_quorum(self):
+        values = Message(message_type=Message.MSG_VALUES, values=['1', ''])
+        self.set_nodes(FakeNode(values), FakeNode(values), FakeNode(values),
+                       FakeNode(Message(message_type=Message.MSG_VALUES, values=['0', ''])), FakeNode(values))
+        self.assertEqual(self.client.read_many(['a', 'b']), ['1', ''])
+
+
+class ClientSessionTest(TestCase):
+
+    def setUp(self):
+        self.client = Client(servers=['127.0.0.1:{}'.format(port) for port in range(8000, 8003)])
+        self.accepted = Message(message_type=Message.MSG_ACCEPTED, leader_id=2, key='k', value='v')
+
+    def tearDown(self):
+        self.client.close()
+
+    def set_nodes(self, *nodes):
+        self.client.nodes = {node_id: node for node_id, node in enumerate(nodes)}
+
+    def test_cached_leader_used_for_many_operations(self):
+        nodes = [FakeNode(self.accepted) for _ in range(3)]
+        self.set_nodes(*nodes)
+        for _ in range(3):
+            self.assertTrue(self.client.set('k', 'v'))
+        self.assertEqual([len(node.received) for node in nodes], [1, 1, 4])
+        self.assertIs(self.client.leader, nodes[2])
+
+    def test_redirect_to_leader_hint(self):
+        redirect = Message(message_type=Message.MSG_WRITE_NACK, leader_id=2)
+        nodes = [FakeNode(redirect), FakeNode(redirect), FakeNode(self.accepted)]
+        self.set_nodes(*nodes)
+        self.client.leader = nodes[0]
+        with mock.patch('paxos.client.sleep') as sleep:
+            self.assertTrue(self.client.set('k', 'v'))
+        sleep.assert_not_called()
+        self.assertIs(self.client.leader, nodes[2])
+        self.assertEqual([message.message_type for message in nodes[0].received], [Message.MSG_WRITE])
+
+    def test_retries_with_backoff(self):
+        nack = Message(message_type=Message.MSG_WRITE_NACK, leader_id=0)
+        self.set_nodes(FakeNode(nack), FakeNode(nack), FakeNode(nack))
+        self.client.leader = self.client.nodes[0]
+        with mock.patch('paxos.client.sleep') as sleep:
+            self.assertFalse(self.client.set('k', 'v'))
+        self.assertEqual([call[0][0] for call in sleep.call_args_list], [Client.BACKOFF, 2 * Client.BACKOFF])
+        self.assertEqual(len(self.client.nodes[0].received), Client.ATTEMPTS)
@@ -0,0 +1,63 @@
+from unittest import TestCase
+from paxos import codec
+from paxos.core import Message, ProposalNumber, WIRE_BINARY, WIRE_JSON, AcceptRequestMessage
+
+
+class BinaryCodecTest(TestCase):
+
+    def round_trip(self, message):
+        return Message.unserialize(message.serialize(WIRE_BINARY))
+
+    def test_message_class_by_type(self):
+        msg = Message(message_type=Message.MSG_ACCEPT_REQUEST, slot=1, batch=[], commit_index=0)
+        self.assertIsInstance(msg, AcceptRequestMessage)
+        with self.assertRaises(AttributeError):
+            msg.undefined_field = 1
+
+    def test_header_fields(self):
+        msg = self.round_trip(Message(message_type=Message.MSG_PREPARE, sender_id=3, prop_num=[3, 7],
+                                      key='k', from_slot=12))
+        self.assertEqual((msg.message_type, msg.sender_id, msg.prop_num), (Message.MSG_PREPARE, 3, [3, 7]))
+        self.assertEqual(msg.proposal, ProposalNumber(3, 7))
+        self.assertEqual((msg.key, msg.from_slot, msg.value), ('k', 12, None))
+        self.assertEqual(msg.wire_format, WIRE_BINARY)
+
+    def test_empty_header_fields(self):
+        msg = self.round_trip(Message(message_type=Message.MSG_READ, key='k'))
+        self.assertIsNone(msg.sender_id)
+        self.assertIsNone(msg.prop_num)
+
+    def test_lowest_proposal_number(self):
+        prop_num = ProposalNumber.get_lowest_possible().as_list()
+        msg = self.round_trip(Message(message_type=Message.MSG_PREPARE, prop_num=prop_num))
+        self.assertEqual(msg.prop_num, prop_num)
+
+    def test_value_types(self):
+        msg = self.round_trip(Message(message_type=Message.MSG_ACCEPT_REQUEST, sender_id=1, prop_num=[1, 1],
+                                      slot=2 ** 70, batch=[['ключ', 'wartość'], ['k', '']], commit_index=-1))
+        self.assertEqual(msg.slot, 2 ** 70)
+        self.assertEqual(msg.batch, [['ключ', 'wartość'], ['k', '']])
+        self.assertEqual(msg.commit_index, -1)
+        heartbeat = self.round_trip(Message(message_type=Message.MSG_HEARTBEAT, heartbeat=1.5))
+        self.assertEqual(heartbeat.heartbeat, 1.5)
+
+    def test_extra_fields(self):
+        msg = self.round_trip(Message(message_type=Message.MSG_READ, key='k', issuer_id='1', flag=True))
+        self.assertEqual(msg.issuer_id, '1')
+        self.assertIs(msg.flag, True)
+
+    def test_large_value(self):
+        value = 'v' * (8 * 1024 * 1024)
+        self.assertEqual(self.round_trip(Message(message_type=Message.MSG_WRITE, key='k', value=value)).value, value)
+
+    def test_json_detected(self):
+        msg = Message.unserialize(Message(message_type=Message.MSG_READ, key='k').serialize(WIRE_JSON))
+        self.assertEqual(msg.key, 'k')
+        self.assertEqual(msg.wire_format, WIRE_JSON)
+
+    def test_malformed(self):
+        data = Message(message_type=Message.MSG_WRITE, key='k', value='v').serialize(WIRE_BINARY)
+        with self.assertRaises(codec.CodecError):
+            codec.decode(data[:-1])
+        with self.assertRaises(codec.CodecError):
+            codec.decode(data[:1] + b'\xff' + data[2:])
@@ -1,5 +1,8 @@
+import socketserver
+import threading
 from unittest import TestCase, mock
 from paxos.core import Message, Node, ProposalNumber
+from paxos.framing import FrameReader, send_frame
 
 
 class CoreTest(TestCase):
@@ -13,6 +16,78 @@ class CoreTest(TestCase):
         self.assertEqual(response, b'ok')
 
 
+class EchoServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Responds with received data, optionally closing the connection after each response.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, close_after_response=False):
+        self.close_after_response = close_after_response
+        self.connections = 0
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), EchoHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def address(self):
+        return '{}:{}'.format(*self.server_address)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        for data in FrameReader(self.request):
+            send_frame(self.request, data)
+            if self.server.close_after_response:
+                break
+
+
+class ConnectionPoolTest(TestCase):
+
+    def test_connection_reused(self):
+        server = EchoServer()
+        node = Node(address=server.address, node_id=1)
+        for i in range(3):
+            message = Message(message_type=Message.MSG_READ, key=str(i))
+            self.assertEqual(Message.unserialize(node.send_immediate(message)).key, str(i))
+        node.close()
+        server.stop()
+        self.assertEqual(server.connections, 1)
+
+    def test_reconnect_after_peer_closed(self):
+        server = EchoServer(close_after_response=True)
+        node = Node(address=server.address, node_id=1)
+        for i in range(3):
+            message = Message(message_type=Message.MSG_READ, key=str(i))
+            self.assertEqual(Message.unserialize(node.send_immediate(message)).key, str(i))
+        node.close()
+        server.stop()
+        self.assertEqual(server.connections, 3)
+
+    def test_large_message(self):
+        server = EchoServer()
+        node = Node(address=server.address, node_id=1)
+        value = 'x' * (4 * 1024 * 1024)
+        response = node.send_immediate(Message(message_type=Message.MSG_WRITE, key='k', value=value))
+        node.close()
+        server.stop()
+        self.assertEqual(Message.unserialize(response).value, value)
+
+    def test_connection_refused(self):
+        server = EchoServer()
+        address = server.address
+        server.stop()
+        node = Node(address=address, node_id=1)
+        response = Message.unserialize(node.send_immediate(Message(message_type=Message.MSG_READ)))
+        self.assertEqual(response.message_type, Message.MSG_ERROR)
+        self.assertEqual(len(node.pool._idle), 0)
+
+
 class MessageTest(TestCase):
 
     def test_serialize(self):
@@ -0,0 +1,47 @@
+import socket
+from unittest import TestCase
+from paxos.framing import FrameError, FrameReader, encode_frame, send_frame, HEADER_SIZE
+
+
+class FrameReaderTest(TestCase):
+
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def test_single_frame(self):
+        send_frame(self.sender, b'abc')
+        self.assertEqual(FrameReader(self.receiver).read_frame(), b'abc')
+
+    def test_pipelined_frames(self):
+        self.sender.sendall(encode_frame(b'first') + encode_frame(b'') + encode_frame(b'third'))
+        self.sender.close()
+        frames = list(FrameReader(self.receiver))
+        self.assertEqual(frames, [b'first', b'', b'third'])
+
+    def test_frame_split_between_reads(self):
+        frame = encode_frame(b'x' * 1000)
+        reader = FrameReader(self.receiver, chunk_size=7)
+        self.sender.sendall(frame[:3])
+        self.sender.sendall(frame[3:])
+        self.assertEqual(reader.read_frame(), b'x' * 1000)
+
+    def test_closed_between_frames(self):
+        self.sender.close()
+        self.assertIsNone(FrameReader(self.receiver).read_frame())
+
+    def test_closed_inside_frame(self):
+        self.sender.sendall(encode_frame(b'abcdef')[:HEADER_SIZE + 2])
+        self.sender.close()
+        with self.assertRaises(FrameError):
+            FrameReader(self.receiver).read_frame()
+
+    def test_frame_size_limit(self):
+        send_frame(self.sender, b'x' * 100)
+        with self.assertRaises(FrameError):
+            FrameReader(self.receiver, max_frame_size=10).read_frame()
+        with self.assertRaises(FrameError):
+            encode_frame(b'x' * 100, max_frame_size=10)
@@ -0,0 +1,67 @@
+from unittest import TestCase
+from paxos.log import ReplicatedLog
+
+
+class ReplicatedLogTest(TestCase):
+
+    def setUp(self):
+        self.log = ReplicatedLog()
+
+    def test_allocate_consecutive_slots(self):
+        self.assertEqual([self.log.allocate_slot() for _ in range(3)], [0, 1, 2])
+        self.log.accept(10, [1, 1], [])
+        self.assertEqual(self.log.allocate_slot(), 11)
+
+    def test_commit_index_advances_over_contiguous_slots(self):
+        for slot in range(3):
+            self.log.accept(slot, [1, 1], [['k', str(slot)]])
+        self.log.commit(1)
+        self.assertEqual(self.log.commit_index, -1)
+        self.log.commit(0)
+        self.assertEqual(self.log.commit_index, 1)
+
+    def test_apply_in_order(self):
+        for slot in range(2):
+            self.log.accept(slot, [1, 1], [['k', str(slot)]])
+            self.log.commit(slot)
+        applied = []
+        entry = self.log.next_to_apply()
+        while entry is not None:
+            applied.append(entry.slot)
+            self.log.mark_applied(entry.slot)
+            entry = self.log.next_to_apply()
+        self.assertEqual(applied, [0, 1])
+
+    def test_learn_commit_requires_same_proposal(self):
+        self.log.accept(0, [1, 1], [['k', 'a']])
+        self.log.accept(1, [0, 1], [['k', 'b']])
+        missing = self.log.learn_commit(1, [1, 1])
+        self.assertEqual(missing, 1)
+        self.assertEqual(self.log.commit_index, 0)
+
+    def test_accepted_from(self):
+        for slot in range(3):
+            self.log.accept(slot, [1, 1], [])
+        self.assertEqual(self.log.accepted_from(1), [[1, [1, 1], []], [2, [1, 1], []]])
+
+    def test_install_committed_entries(self):
+        self.log.install([[0, [1, 1], []], [1, [1, 1], [['k', 'v']]]])
+        self.assertEqual(self.log.commit_index, 1)
+        self.log.accept(1, [2, 2], [])
+        self.assertEqual(self.log.entries[1].batch, [['k', 'v']])
+
+    def test_compact_and_restore_snapshot(self):
+        for slot in range(3):
+            self.log.accept(slot, [1, 1], [['k', str(slot)]])
+            self.log.commit(slot)
+            self.log.mark_applied(slot)
+        self.log.compact(1)
+        self.assertEqual(self.log.committed_from(0, 10), [[2, [1, 1], [['k', '2']]]])
+        self.log.accept(0, [2, 1], [])
+        self.assertEqual(self.log.accepted_from(0), [[2, [1, 1], [['k', '2']]]])
+
+        log = ReplicatedLog()
+        log.accept(6, [1, 1], [])
+        log.restore_snapshot(5)
+        self.assertEqual((log.snapshot_index, log.commit_index, log.applied_index), (5, 5, 5))
+        self.assertEqual(log.allocate_slot(), 7)
@@ -0,0 +1,83 @@
+import io
+from unittest import TestCase
+from urllib.request import urlopen
+from paxos.core import Message, WIRE_BINARY
+from paxos.metrics import Histogram, Metrics, MetricsEndpoint, exposition
+from paxos.protocol import PaxosHandler
+from paxos.server import Server
+from paxos.tracing import Tracer
+from tests.test_protocol import FakeRequest
+
+
+class HistogramTest(TestCase):
+
+    def test_percentiles_within_bucket_error(self):
+        histogram = Histogram()
+        for millisecond in range(1, 1001):
+            histogram.observe(millisecond / 1000.0)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 1000)
+        self.assertEqual(summary['max'], 1.0)
+        for name, exact in (('p50', 0.5), ('p99', 0.99), ('p99.9', 0.999)):
+            self.assertGreaterEqual(summary[name], exact)
+            self.assertLess(summary[name], exact * 1.2)
+
+    def test_empty(self):
+        self.assertIsNone(Histogram().summary()['p50'])
+
+
+class ExpositionTest(TestCase):
+
+    def test_labels_and_quantiles(self):
+        metrics = Metrics()
+        metrics.increment('elections')
+        metrics.gauge('commit_index{partition=0}', lambda: 7)
+        metrics.observe('rtt{peer=1}', 0.001)
+        text = exposition(metrics.collect())
+        self.assertIn('paxos_elections_total 1\n', text)
+        self.assertIn('paxos_commit_index{partition="0"} 7\n', text)
+        self.assertIn('paxos_rtt_seconds{quantile="0.5",peer="1"} ', text)
+        self.assertIn('paxos_rtt_seconds_count{peer="1"} 1\n', text)
+
+    def test_failing_gauge_traced(self):
+        tracer = Tracer(stream=io.StringIO())
+        metrics = Metrics(tracer=tracer)
+        metrics.gauge('broken', lambda: 1 / 0)
+        self.assertEqual(metrics.collect()['gauges'], {})
+        self.assertIn('Gauge broken failed', tracer.dump(level='warning')[0][3])
+
+    def test_endpoint(self):
+        metrics = Metrics()
+        metrics.increment('elections')
+        endpoint = MetricsEndpoint(('127.0.0.1', 0), metrics.collect)
+        endpoint.start()
+        try:
+            with urlopen('http://127.0.0.1:{}/metrics'.format(endpoint.server_address[1]), timeout=5) as response:
+                self.assertIn(b'paxos_elections_total 1', response.read())
+        finally:
+            endpoint.stop()
+
+
+class StatsMessageTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(servers=['127.0.0.1:8000', '127.0.0.1:8001'], address='127.0.0.1:8000',
+                             storage={'engine': 'memory'})
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_stats_of_handled_messages(self):
+        request = FakeRequest()
+        PaxosHandler(Message(message_type=Message.MSG_READ, key='k'), self.server, request).process()
+        PaxosHandler(Message(message_type=Message.MSG_READ, key='k', linearizable=True), self.server,
+                     request).process()
+        stats_request = Message(message_type=Message.MSG_STATS)
+        PaxosHandler(Message.unserialize(stats_request.serialize(WIRE_BINARY)), self.server, request).process()
+        stats = request.responses[-1].stats
+        self.assertEqual(request.responses[-1].message_type, Message.MSG_STATS)
+        self.assertEqual(stats['histograms']['handle{type=read}']['count'], 2)
+        self.assertEqual(stats['histograms']['store_get']['count'], 1)
+        self.assertEqual(stats['counters']['read_nacks'], 1)
+        self.assertEqual(stats['gauges']['commit_index{partition=0}'], -1)
+        self.assertEqual(stats['snapshot'], {})
@@ -0,0 +1,83 @@
+import os
+import pstats
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from paxos.core import Message, WIRE_BINARY
+from paxos.profiling import MODE_SAMPLING, Profiler, ProfilerBusy
+from paxos.protocol import PaxosHandler
+from paxos.server import Server
+from tests.test_protocol import FakeRequest
+
+
+def wait_written(profiler, timeout=5.0):
+    deadline = time.time() + timeout
+    while profiler.running and time.time() < deadline:
+        time.sleep(0.01)
+    return profiler.last_path
+
+
+class ProfilerTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = Profiler(0, path=os.path.join(self.directory, 'node{id}.{ext}'))
+
+    def tearDown(self):
+        self.profiler.stop()
+        wait_written(self.profiler)
+        shutil.rmtree(self.directory)
+
+    def test_off_calls_directly(self):
+        self.assertFalse(self.profiler.active)
+        self.assertEqual(self.profiler.profiled(sum, [1, 2]), 3)
+
+    def test_cprofile_window(self):
+        path = self.profiler.start(duration=0.2)
+        self.assertTrue(self.profiler.active)
+        with self.assertRaises(ProfilerBusy):
+            self.profiler.start()
+        self.profiler.profiled(sorted, list(range(100)))
+        self.assertEqual(wait_written(self.profiler), path)
+        self.assertFalse(self.profiler.active)
+        functions = [function for _, _, function in pstats.Stats(path).stats]
+        self.assertIn("<built-in method builtins.sorted>", functions)
+
+    def test_sampling_window(self):
+        path = self.profiler.start(mode=MODE_SAMPLING, duration=0.1)
+        self.assertFalse(self.profiler.active)
+        self.assertTrue(path.endswith('node0.folded'))
+        self.assertEqual(wait_written(self.profiler), path)
+        with open(path) as stream:
+            lines = stream.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+
+class ProfileMessageTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = Server(servers=['127.0.0.1:8000', '127.0.0.1:8001'], address='127.0.0.1:8000',
+                             storage={'engine': 'memory'},
+                             profiling={'path': os.path.join(self.directory, 'node{id}.{ext}')})
+
+    def tearDown(self):
+        self.server.shutdown()
+        wait_written(self.server.profiler)
+        shutil.rmtree(self.directory)
+
+    def test_profile_covers_handled_messages(self):
+        request = FakeRequest()
+        profile = Message(message_type=Message.MSG_PROFILE, duration=0.3)
+        PaxosHandler(Message.unserialize(profile.serialize(WIRE_BINARY)), self.server, request).process()
+        path = request.responses[0].path
+        self.assertEqual(path, os.path.join(self.directory, 'node0.prof'))
+        PaxosHandler(Message(message_type=Message.MSG_READ, key='k'), self.server, request).process()
+        PaxosHandler(profile, self.server, request).process()
+        self.assertEqual(request.responses[-1].message_type, Message.MSG_ERROR)
+        self.assertEqual(wait_written(self.server.profiler), path)
+        functions = {function for _, _, function in pstats.Stats(path).stats}
+        self.assertIn('on_read', functions)
+        self.assertIn('get', functions)
@@ -1,7 +1,50 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
 from paxos.core import ProposalNumber
-from paxos.core import Message
+from paxos.core import Message, WIRE_BINARY, WIRE_JSON
+from paxos.partition import key_partition
 from paxos.protocol import PaxosHandler
+from paxos.server import Server
+
+
+class FakeNode(object):
+    """
+    Responds with given message after a delay.
+    Response can also be a dictionary of responses by type of received message.
+    """
+
+    def __init__(self, response, delay=0.0):
+        self.response = response
+        self.delay = delay
+        self.received = []
+
+    def send_raw(self, data, timeout):
+        message = Message.unserialize(data)
+        self.received.append(message)
+        time.sleep(self.delay)
+        response = self.response
+        if isinstance(response, dict):
+            response = response[message.message_type]
+        return response.serialize()
+
+    def send_immediate(self, message):
+        return self.send_raw(message.serialize(), 1)
+
+    def send_awaiting(self, message):
+        return self.send_raw(message.serialize(), 10)
+
+    def close(self):
+        pass
+
+
+class FakeRequest(object):
+    def __init__(self):
+        self.responses = []
+
+    def sendall(self, data):
+        self.responses.append(Message.unserialize(data))
 
 
 class ProtocolTest(TestCase):
@@ -11,6 +54,172 @@ class ProtocolTest(TestCase):
         self.assertEqual(function_name, 'on_accepted')
 
 
+class QuorumFanOutTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(servers=['127.0.0.1:{}'.format(port) for port in range(8000, 8005)],
+                             address='127.0.0.1:8000')
+        self.write = Message(message_type=Message.MSG_WRITE, key='k', value='v')
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def set_nodes(self, *nodes):
+        self.server.nodes = {node_id: node for node_id, node in enumerate(nodes, start=1)}
+
+    def test_prepare_completes_with_quorum_before_slow_nodes(self):
+        promise = Message(message_type=Message.MSG_PROMISE, accepted=[])
+        self.set_nodes(FakeNode(promise, 2), FakeNode(promise), FakeNode(promise, 2), FakeNode(promise))
+        start = time.time()
+        PaxosHandler(self.write, self.server, None).make_prepare_phase()
+        self.assertLess(time.time() - start, 1)
+        self.assertTrue(self.server.partitions[0].prepare_phase_complete)
+
+    def test_prepare_stops_when_quorum_impossible(self):
+        nack = Message(message_type=Message.MSG_PREPARE_NACK)
+        promise = Message(message_type=Message.MSG_PROMISE, accepted=[])
+        self.set_nodes(FakeNode(nack), FakeNode(nack), FakeNode(nack), FakeNode(promise, 2))
+        start = time.time()
+        PaxosHandler(self.write, self.server, None).make_prepare_phase()
+        self.assertLess(time.time() - start, 1)
+        self.assertFalse(self.server.partitions[0].prepare_phase_complete)
+
+    def test_accept_sent_to_all_nodes(self):
+        accepted = Message(message_type=Message.MSG_ACCEPTED)
+        nodes = [FakeNode(accepted) for _ in range(4)]
+        self.set_nodes(*nodes)
+        self.server.set_many = lambda items: None
+        responses = PaxosHandler(self.write, self.server, None).make_accept_phase([self.write])
+        time.sleep(0.1)
+        self.assertEqual([response.message_type for response in responses], [Message.MSG_ACCEPTED])
+        self.assertEqual([len(node.received) for node in nodes], [1, 1, 1, 1])
+
+    def test_concurrent_writes_share_accept_round(self):
+        accepted = Message(message_type=Message.MSG_ACCEPTED)
+        nodes = [FakeNode(accepted) for _ in range(4)]
+        self.set_nodes(*nodes)
+        applied = []
+        self.server.set_many = applied.append
+        self.server.partitions[0].prepare_phase_complete = True
+        self.server.partitions[0].batcher.linger = 0.2
+        writes = [Message(message_type=Message.MSG_WRITE, key=str(i), value=str(i)) for i in range(5)]
+        requests = [FakeRequest() for _ in writes]
+        threads = [threading.Thread(target=PaxosHandler(write, self.server, request).process)
+                   for write, request in zip(writes, requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(applied), 1)
+        self.assertEqual(sorted(applied[0]), [[str(i), str(i)] for i in range(5)])
+        self.assertEqual([len(node.received) for node in nodes], [1, 1, 1, 1])
+        self.assertEqual([request.responses[0].key for request in requests], [str(i) for i in range(5)])
+
+    def test_batch_not_limited_by_handler_threads(self):
+        accepted = Message(message_type=Message.MSG_ACCEPTED)
+        self.set_nodes(*[FakeNode(accepted) for _ in range(4)])
+        applied = []
+        self.server.set_many = applied.append
+        self.server.partitions[0].prepare_phase_complete = True
+        self.server.partitions[0].batcher.linger = 0.2
+        workers = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(workers.shutdown)
+        requests = [FakeRequest() for _ in range(5)]
+        for i, request in enumerate(requests):
+            workers.submit(PaxosHandler(Message(message_type=Message.MSG_WRITE, key=str(i), value=str(i)),
+                                        self.server, request).process)
+        deadline = time.time() + 2
+        while not all(request.responses for request in requests) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(applied), 1)
+        self.assertEqual([request.responses[0].key for request in requests], [str(i) for i in range(5)])
+
+    def test_multi_write_applied_in_one_batch_entry(self):
+        accepted = Message(message_type=Message.MSG_ACCEPTED)
+        nodes = [FakeNode(accepted) for _ in range(4)]
+        self.set_nodes(*nodes)
+        applied = []
+        self.server.set_many = applied.append
+        self.server.partitions[0].prepare_phase_complete = True
+        request = FakeRequest()
+        write = Message(message_type=Message.MSG_MULTI_WRITE, items=[['a', '1'], ['b', '2']])
+        PaxosHandler(Message.unserialize(write.serialize(WIRE_BINARY)), self.server, request).process()
+        self.assertEqual(applied, [[['a', '1'], ['b', '2']]])
+        deadline = time.time() + 1      # accept requests past quorum are still being sent
+        while sum(len(node.received) for node in nodes) < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([len(node.received) for node in nodes], [1, 1, 1, 1])
+        self.assertEqual(request.responses[0].message_type, Message.MSG_ACCEPTED)
+
+
+class PartitionTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(servers=['127.0.0.1:{}'.format(port) for port in range(8000, 8003)],
+                             address='127.0.0.1:8000', partitions=4)
+        self.server.nodes = {node_id: FakeNode(Message(message_type=Message.MSG_ACCEPTED)) for node_id in (1, 2)}
+        self.server.set_many = lambda items: None
+        for partition in self.server.partitions:
+            partition.prepare_phase_complete = True
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_key_tag_selects_partition(self):
+        self.assertEqual(key_partition('user:{a}:name', 4), key_partition('a', 4))
+        self.assertEqual(key_partition('anything', 1), 0)
+
+    def test_write_not_blocked_by_round_of_other_partition(self):
+        busy, free = self.server.partition_of('a'), self.server.partition_of('b')
+        self.assertIsNot(busy, free)
+        request = FakeRequest()
+        with busy.batcher.round_lock:
+            PaxosHandler(Message(message_type=Message.MSG_WRITE, key='b', value='1'), self.server, request).process()
+        self.assertEqual(request.responses[0].message_type, Message.MSG_ACCEPTED)
+        self.assertEqual(free.log.commit_index, 0)
+        self.assertEqual(busy.log.commit_index, -1)
+        self.assertEqual(self.server.nodes[1].received[0].partition, free.index)
+
+    def test_unknown_partition_refused(self):
+        request = FakeRequest()
+        prepare = Message(message_type=Message.MSG_PREPARE, sender_id=1, prop_num=[1, 1], partition=4)
+        PaxosHandler(prepare, self.server, request).process()
+        self.assertEqual(request.responses[0].message_type, Message.MSG_ERROR)
+        self.assertEqual(self.server.metrics.counters['partition_mismatches'], 1)
+
+    def test_heartbeat_of_other_partition_count_reported(self):
+        heartbeat = Message(message_type=Message.MSG_HEARTBEAT, sender_id=2, heartbeat=time.time(),
+                            commits=[[-1, [2, 1]]] * 2)
+        self.assertTrue(self.server.handle_heartbeat(heartbeat))
+        self.assertEqual(self.server.metrics.counters['partition_mismatches'], 1)
+
+    def test_multi_write_across_partitions_refused(self):
+        request = FakeRequest()
+        write = Message(message_type=Message.MSG_MULTI_WRITE, items=[['a', '1'], ['b', '2']])
+        PaxosHandler(write, self.server, request).process()
+        self.assertEqual(request.responses[0].message_type, Message.MSG_ERROR)
+        write = Message(message_type=Message.MSG_MULTI_WRITE, items=[['{a}1', '1'], ['{a}2', '2']])
+        PaxosHandler(write, self.server, request).process()
+        self.assertEqual(request.responses[1].message_type, Message.MSG_ACCEPTED)
+
+
+class WireFormatTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(servers=['127.0.0.1:8000', '127.0.0.1:8001'], address='127.0.0.1:8000')
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_response_in_request_format(self):
+        for wire_format, first_byte in ((WIRE_JSON, b'{'), (WIRE_BINARY, b'\xb7')):
+            heartbeat = Message(message_type=Message.MSG_HEARTBEAT, sender_id=0, heartbeat=time.time())
+            request = FakeRequest()
+            request.sendall = request.responses.append
+            PaxosHandler(Message.unserialize(heartbeat.serialize(wire_format)), self.server, request).process()
+            self.assertEqual(request.responses[0][:1], first_byte)
+
+
 class ProposalNumberTest(TestCase):
     def test_lt(self):
         self.assertTrue(ProposalNumber(1, 1) < ProposalNumber(1, 2))
@@ -45,3 +254,114 @@ class ProposalNumberTest(TestCase):
         dump = orig.as_list()
         copy = ProposalNumber.from_list(dump)
         self.assertEqual(orig, copy)
+
+
+class ReplicatedLogProtocolTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(servers=['127.0.0.1:{}'.format(port) for port in range(8000, 8005)],
+                             address='127.0.0.1:8004')
+        self.applied = []
+        self.server.set_many = self.applied.append
+        self.write = Message(message_type=Message.MSG_WRITE, key='k', value='v')
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def set_nodes(self, *nodes):
+        self.server.nodes = {node_id: node for node_id, node in enumerate(nodes)}
+
+    def test_prepare_recovers_highest_accepted_values(self):
+        accepted = Message(message_type=Message.MSG_ACCEPTED)
+        promises = [
+            Message(message_type=Message.MSG_PROMISE, accepted=[[0, [1, 1], [['a', 'old']]]]),
+            Message(message_type=Message.MSG_PROMISE,
+                    accepted=[[0, [2, 1], [['a', 'new']]], [2, [2, 1], [['b', 'b']]]]),
+            Message(message_type=Message.MSG_PROMISE, accepted=[]),
+            Message(message_type=Message.MSG_PROMISE, accepted=[]),
+        ]
+        # promises reporting values arrive first, so that they form the quorum
+        self.set_nodes(*[FakeNode({Message.MSG_PREPARE: promise, Message.MSG_ACCEPT_REQUEST: accepted},
+                                  delay=0.0 if promise.accepted else 0.2)
+                         for promise in promises])
+        handler = PaxosHandler(self.write, self.server, None)
+        handler.make_prepare_phase()
+        self.assertTrue(self.server.partitions[0].prepare_phase_complete)
+        self.assertEqual(self.applied, [[['a', 'new']], [['b', 'b']]])
+        self.assertEqual(self.server.partitions[0].log.commit_index, 2)
+        self.assertEqual(self.server.partitions[0].log.allocate_slot(), 3)
+
+    def test_stable_leader_skips_prepare(self):
+        accepted = Message(message_type=Message.MSG_ACCEPTED)
+        promise = Message(message_type=Message.MSG_PROMISE, accepted=[])
+        nodes = [FakeNode({Message.MSG_PREPARE: promise, Message.MSG_ACCEPT_REQUEST: accepted}) for _ in range(4)]
+        self.set_nodes(*nodes)
+        for value in ('1', '2', '3'):
+            write = Message(message_type=Message.MSG_WRITE, key='k', value=value)
+            PaxosHandler(write, self.server, FakeRequest()).process()
+        time.sleep(0.1)
+        received = [(message.message_type, getattr(message, 'slot', None)) for message in nodes[0].received]
+        self.assertEqual(received, [(Message.MSG_PREPARE, None), (Message.MSG_ACCEPT_REQUEST, 0),
+                                    (Message.MSG_ACCEPT_REQUEST, 1), (Message.MSG_ACCEPT_REQUEST, 2)])
+        self.assertEqual(self.applied, [[['k', '1']], [['k', '2']], [['k', '3']]])
+
+    def test_accept_nack_restarts_prepare(self):
+        nack = Message(message_type=Message.MSG_ACCEPT_NACK)
+        self.set_nodes(*[FakeNode(nack) for _ in range(4)])
+        self.server.partitions[0].prepare_phase_complete = True
+        responses = PaxosHandler(self.write, self.server, None).make_accept_phase([self.write])
+        self.assertEqual(responses[0].message_type, Message.MSG_WRITE_NACK)
+        self.assertFalse(self.server.partitions[0].prepare_phase_complete)
+        self.assertEqual(self.applied, [])
+
+    def test_timed_out_accept_finished_by_next_prepare(self):
+        timeout = Message(message_type=Message.MSG_ERROR, reason='TimeoutError')
+        self.set_nodes(*[FakeNode(timeout) for _ in range(4)])
+        self.server.partitions[0].prepare_phase_complete = True
+        responses = PaxosHandler(self.write, self.server, None).make_accept_phase([self.write])
+        self.assertEqual(responses[0].message_type, Message.MSG_WRITE_NACK)
+        self.assertFalse(self.server.partitions[0].prepare_phase_complete)
+
+        accepted = Message(message_type=Message.MSG_ACCEPTED)
+        promise = Message(message_type=Message.MSG_PROMISE, accepted=[])
+        self.set_nodes(*[FakeNode({Message.MSG_PREPARE: promise, Message.MSG_ACCEPT_REQUEST: accepted})
+                         for _ in range(4)])
+        write = Message(message_type=Message.MSG_WRITE, key='k', value='2')
+        PaxosHandler(write, self.server, FakeRequest()).process()
+        time.sleep(0.1)
+        self.assertEqual(self.applied, [[['k', 'v']], [['k', '2']]])
+        self.assertEqual(self.server.partitions[0].log.commit_index, 1)
+
+    def test_acceptor_applies_committed_slots_in_order(self):
+        def accept_request(slot, commit_index, prop_num=(3, 1)):
+            return Message(message_type=Message.MSG_ACCEPT_REQUEST, sender_id=3, prop_num=list(prop_num),
+                           slot=slot, batch=[['k', str(slot)]], commit_index=commit_index)
+
+        request = FakeRequest()
+        for message in (accept_request(1, -1), accept_request(0, -1), accept_request(2, 1)):
+            PaxosHandler(message, self.server, request).process()
+        PaxosHandler(accept_request(3, 2, prop_num=(1, 1)), self.server, request).process()
+        self.assertEqual([response.message_type for response in request.responses], [Message.MSG_ACCEPTED] * 3 +
+                         [Message.MSG_ACCEPT_NACK])
+        self.assertEqual(self.applied, [[['k', '0']], [['k', '1']]])
+        self.assertEqual(self.server.partitions[0].log.commit_index, 1)
+
+    def test_catchup_returns_committed_entries(self):
+        self.server.partitions[0].log.install([[0, [3, 1], [['a', '1']]], [1, [3, 1], [['b', '2']]]])
+        self.server.partitions[0].log.accept(2, [3, 1], [['c', '3']])
+        request = FakeRequest()
+        catchup = Message(message_type=Message.MSG_CATCHUP, sender_id=1, from_slot=1)
+        PaxosHandler(catchup, self.server, request).process()
+        self.assertEqual(request.responses[0].entries, [[1, [3, 1], [['b', '2']]]])
+
+
+class WriteRedirectTest(TestCase):
+
+    def test_follower_refuses_write_with_leader_hint(self):
+        server = Server(servers=['127.0.0.1:8000', '127.0.0.1:8001', '127.0.0.1:8002'], address='127.0.0.1:8000')
+        server.leader_id = 2
+        request = FakeRequest()
+        PaxosHandler(Message(message_type=Message.MSG_WRITE, key='k', value='v'), server, request).process()
+        server.shutdown()
+        self.assertEqual((request.responses[0].message_type, request.responses[0].leader_id),
+                         (Message.MSG_WRITE_NACK, 2))
@@ -0,0 +1,61 @@
+import threading
+import time
+from unittest import TestCase
+from paxos.core import Message
+from paxos.scheduler import Scheduler
+from paxos.server import Server
+
+
+class SchedulerTest(TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.fired = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def record(self, name):
+        self.fired.append(name)
+        if len(self.fired) == 2:
+            self.done.set()
+
+    def test_callbacks_run_in_deadline_order(self):
+        self.scheduler.call_later(0.1, self.record, 'late')
+        self.scheduler.call_later(0.05, self.record, 'early')
+        self.assertTrue(self.done.wait(1))
+        self.assertEqual(self.fired, ['early', 'late'])
+
+    def test_reset_moves_deadline(self):
+        moved_later = self.scheduler.call_later(0.05, self.record, 'later')
+        moved_earlier = self.scheduler.call_later(1, self.record, 'earlier')
+        self.assertTrue(moved_later.reset(0.15))
+        self.assertTrue(moved_earlier.reset(0.1))
+        self.assertTrue(self.done.wait(1))
+        self.assertEqual(self.fired, ['earlier', 'later'])
+        self.assertFalse(moved_later.reset(1))
+
+    def test_cancelled_deadline_not_run(self):
+        self.scheduler.call_later(0.05, self.record, 'cancelled').cancel()
+        self.scheduler.call_later(0.1, self.record, 'first')
+        self.scheduler.call_later(0.15, self.record, 'second')
+        self.assertTrue(self.done.wait(1))
+        self.assertEqual(self.fired, ['first', 'second'])
+
+
+class ServerTimersTest(TestCase):
+
+    def test_heartbeats_reset_one_deadline(self):
+        scheduler = Scheduler()
+        self.addCleanup(scheduler.stop)
+        server = Server(servers=['127.0.0.1:8000', '127.0.0.1:8001'], address='127.0.0.1:8000',
+                        storage={'engine': 'memory'}, scheduler=scheduler)
+        self.addCleanup(server.shutdown)
+        timer = server.heartbeat_timeout_timer
+        threads = threading.active_count()
+        for _ in range(100):
+            server.handle_heartbeat(Message(message_type=Message.MSG_HEARTBEAT, sender_id=1, heartbeat=time.time()))
+        self.assertIs(server.heartbeat_timeout_timer, timer)
+        self.assertEqual(len(scheduler), 1)
+        self.assertEqual(threading.active_count(), threads)
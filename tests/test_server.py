@@ -2,6 +2,8 @@ import time
 from unittest import TestCase
 from paxos.server import Server
 from paxos.core import Message, ProposalNumber
+from paxos.protocol import PaxosHandler
+from tests.test_protocol import FakeNode, FakeRequest
 
 
 class LeaderElectionTest(TestCase):
@@ -9,6 +11,7 @@ class LeaderElectionTest(TestCase):
         return ['{}:{}'.format(addr, port) for port in range(8000, 8000 + n)]
 
     def setUp(self):
+        self.addCleanup(setattr, Server, 'HEARTBEAT_PERIOD', Server.HEARTBEAT_PERIOD)
         Server.HEARTBEAT_PERIOD = 10000
         self.LOCALHOST = "127.0.0.1"
         self.nodes_no = 10
@@ -96,12 +99,24 @@ class LeaderElectionTest(TestCase):
         )
         server = Server(servers=self.SERVERS, address=self.ADDR)
         server.id = 10
+        server.leader_id = 2
+        server._heartbeat_received_at = time.monotonic()
         old_leader = server.leader_id
         server.handle_heartbeat(heartbeat)
         leader_id = server.leader_id
         server.shutdown()
         self.assertEqual(old_leader, leader_id)
 
+    def test_election_timeout_shorter_for_higher_id(self):
+        addresses = self.get_servers(self.LOCALHOST, 3)
+        servers = [Server(servers=addresses, address=address) for address in addresses]
+        timeouts = [[server.get_randomized_timeout() for _ in range(100)] for server in servers]
+        for server in servers:
+            server.shutdown()
+        for lower, higher in zip(timeouts, timeouts[1:]):
+            self.assertGreater(min(lower), max(higher))
+        self.assertLess(max(timeouts[0]), 2 * Server.HEARTBEAT_TIMEOUT)
+
     def test_heartbeat_last_heartbeat_set(self):
         server = Server(servers=self.SERVERS, address=self.ADDR)
         server.handle_heartbeat(self.heartbeat)
@@ -118,15 +133,15 @@ class LeaderElectionTest(TestCase):
 
     def test_get_next_prop_num(self):
         server = Server(servers=self.SERVERS, address=self.ADDR)
-        prop_num = server.get_next_prop_num()
+        prop_num = server.partitions[0].get_next_prop_num()
         expected = ProposalNumber(self.server_id, 1)
         server.shutdown()
         self.assertEqual(expected, prop_num)
 
     def test_get_next_prop_num_prepare_msg(self):
         server = Server(servers=self.SERVERS, address=self.ADDR)
-        server.highest_prepare_msg = self.prepare
-        own_prop_num = server.get_next_prop_num()
+        server.partitions[0].highest_prepare_msg = self.prepare
+        own_prop_num = server.partitions[0].get_next_prop_num()
         prop_num = ProposalNumber.from_list(self.prepare.prop_num)
         expected = ProposalNumber(self.server_id, prop_num.round_no + 1)
         server.shutdown()
@@ -134,9 +149,134 @@ class LeaderElectionTest(TestCase):
 
     def test_highest_prepare_msg(self):
         server = Server(servers=self.SERVERS, address=self.ADDR)
-        server.highest_prepare_msg = self.prepare
-        own_prop_num = server.own_prop_num
-        prop_num = ProposalNumber.from_list(server.highest_prepare_msg.prop_num)
+        server.partitions[0].highest_prepare_msg = self.prepare
+        own_prop_num = server.partitions[0].own_prop_num
+        prop_num = ProposalNumber.from_list(server.partitions[0].highest_prepare_msg.prop_num)
         expected = ProposalNumber(self.server_id, prop_num.round_no)
         server.shutdown()
         self.assertEqual(expected, own_prop_num)
+
+
+class LeaderLeaseTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(servers=['127.0.0.1:{}'.format(port) for port in range(8000, 8005)],
+                             address='127.0.0.1:8004', storage={'engine': 'memory'})
+        self.server.set('k', 'v')
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def read(self):
+        request = FakeRequest()
+        PaxosHandler(Message(message_type=Message.MSG_READ, key='k', linearizable=True), self.server, request).process()
+        return request.responses[0]
+
+    def test_lease_granted_to_one_leader_at_a_time(self):
+        self.assertTrue(self.server.grant_lease(1))
+        self.assertFalse(self.server.grant_lease(2))
+        self.assertTrue(self.server.grant_lease(1))
+        prepare = Message(message_type=Message.MSG_PREPARE, sender_id=2, prop_num=[2, 10], from_slot=0)
+        self.assertIsNone(self.server.promise(prepare))
+        prepare.sender_id = 1
+        self.assertEqual(self.server.promise(prepare), [])
+
+    def test_heartbeat_ack_grants_lease(self):
+        heartbeat = Message(message_type=Message.MSG_HEARTBEAT, sender_id=4, heartbeat=time.time())
+        server = Server(servers=self.server.servers, address='127.0.0.1:8000')
+        self.assertTrue(server.handle_heartbeat(heartbeat))
+        server.shutdown()
+
+    def test_read_served_only_with_lease(self):
+        self.server.leader_id = self.server.id
+        self.server.partitions[0].prepare_phase_complete = True
+        self.assertEqual(self.read().message_type, Message.MSG_READ_NACK)
+
+        ack = Message(message_type=Message.MSG_HEARTBEAT_ACK, lease=True)
+        refused = Message(message_type=Message.MSG_HEARTBEAT_ACK, lease=False)
+        self.server.renew_lease(time.monotonic(), [ack, refused, refused, refused])
+        self.assertEqual(self.read().message_type, Message.MSG_READ_NACK)
+        self.server.renew_lease(time.monotonic(), [ack, ack, refused, refused])
+        response = self.read()
+        self.assertEqual((response.message_type, response.value), (Message.MSG_ACCEPTED, 'v'))
+
+        self.server.renew_lease(time.monotonic() - self.server.lease_duration, [ack, ack, ack, ack])
+        self.assertEqual(self.read().message_type, Message.MSG_READ_NACK)
+
+    def test_timing_configured(self):
+        server = Server(servers=self.server.servers, address='127.0.0.1:8000', storage={'engine': 'memory'},
+                        timing={'heartbeat_period': 1, 'clock_drift': 0.2})
+        ack = Message(message_type=Message.MSG_HEARTBEAT_ACK, lease=True)
+        sent_at = time.monotonic()
+        server.renew_lease(sent_at, [ack, ack])
+        server.shutdown()
+        self.assertAlmostEqual(server.heartbeat_timeout, 3)
+        self.assertAlmostEqual(server.leader_alive_timeout, 2)
+        self.assertAlmostEqual(server.lease_duration, 3)
+        self.assertAlmostEqual(server._lease_expiry, sent_at + 2.4)
+        with self.assertRaises(ValueError):
+            Server(servers=self.server.servers, address='127.0.0.1:8000', timing={'clock_drift': 1})
+
+
+class HeartbeatTest(TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, Server, 'HEARTBEAT_PERIOD', Server.HEARTBEAT_PERIOD)
+        Server.HEARTBEAT_PERIOD = 10000     # rounds are sent by the tests only
+        self.server = Server(servers=['127.0.0.1:{}'.format(port) for port in range(8000, 8005)],
+                             address='127.0.0.1:8004', storage={'engine': 'memory'})
+        self.server.leader_id = self.server.id
+        self.server.partitions[0].prepare_phase_complete = True
+        self.ack = Message(message_type=Message.MSG_HEARTBEAT_ACK, lease=True)
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_round_not_delayed_by_slow_follower(self):
+        slow = FakeNode(self.ack, 2)
+        nodes = [FakeNode(self.ack), FakeNode(self.ack), FakeNode(self.ack), slow]
+        self.server.nodes = dict(enumerate(nodes))
+        start = time.time()
+        self.server.send_heartbeats()
+        self.assertLess(time.time() - start, 0.5)
+        deadline = time.time() + 1
+        while len(self.server._heartbeats_in_flight) > 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.server.has_lease())
+        self.server.send_heartbeats()
+        deadline = time.time() + 1
+        while sum(len(node.received) for node in nodes) < 7 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([len(node.received) for node in nodes], [2, 2, 2, 1])
+
+    def test_followers_acknowledging_accept_skipped(self):
+        nodes = [FakeNode(self.ack) for _ in range(4)]
+        self.server.nodes = dict(enumerate(nodes))
+        accepted = [Message(message_type=Message.MSG_ACCEPTED, sender_id=node_id, lease=True) for node_id in (0, 1)]
+        self.server.accepts_acknowledged(time.monotonic(), accepted)
+        self.assertTrue(self.server.has_lease())
+        self.server.send_heartbeats()
+        time.sleep(0.1)
+        self.assertEqual([len(node.received) for node in nodes], [0, 0, 1, 1])
+
+    def test_unreachable_follower_ignored_by_lease(self):
+        error = Message(message_type=Message.MSG_ERROR)
+        self.server.nodes = dict(enumerate([FakeNode(self.ack), FakeNode(self.ack), FakeNode(error), FakeNode(error)]))
+        self.server.accepts_acknowledged(time.monotonic(), [error])
+        self.assertFalse(self.server.has_lease())
+        self.server.send_heartbeats()
+        deadline = time.time() + 1
+        while self.server._heartbeats_in_flight and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.server.has_lease())
+
+    def test_accept_request_handled_as_heartbeat(self):
+        follower = Server(servers=self.server.servers, address='127.0.0.1:8000', storage={'engine': 'memory'})
+        self.addCleanup(follower.shutdown)
+        heartbeat = time.time()
+        accept = Message(message_type=Message.MSG_ACCEPT_REQUEST, sender_id=4, prop_num=[4, 1], slot=0,
+                         batch=[['k', 'v']], commit_index=-1, heartbeat=heartbeat)
+        request = FakeRequest()
+        PaxosHandler(accept, follower, request).process()
+        self.assertEqual((request.responses[0].message_type, request.responses[0].lease), (Message.MSG_ACCEPTED, True))
+        self.assertEqual((follower.leader_id, follower.last_heartbeat), (4, heartbeat))
@@ -0,0 +1,75 @@
+from collections import Counter
+from unittest import TestCase
+from paxos.core import Message
+from paxos.sharding import HashRing, ShardedClient, host_servers, place_groups
+from tests.test_protocol import FakeNode
+
+
+class HashRingTest(TestCase):
+
+    def setUp(self):
+        self.keys = ['key-{}'.format(i) for i in range(4000)]
+
+    def test_keys_spread_over_groups(self):
+        ring = HashRing(4)
+        counts = Counter(ring.group_of(key) for key in self.keys)
+        self.assertEqual(sorted(counts), [0, 1, 2, 3])
+        self.assertGreater(min(counts.values()), len(self.keys) / 8)
+
+    def test_added_group_moves_few_keys(self):
+        before, after = HashRing(4), HashRing(5)
+        moved = [key for key in self.keys if before.group_of(key) != after.group_of(key)]
+        self.assertLess(len(moved), len(self.keys) / 3)
+        self.assertTrue(all(after.group_of(key) == 4 for key in moved))
+
+    def test_keys_with_tag_in_one_group(self):
+        ring = HashRing(8)
+        self.assertEqual(len({ring.group_of('user:{42}:' + field) for field in ('name', 'mail', 'age')}), 1)
+
+
+class PlacementTest(TestCase):
+
+    def test_leaders_on_different_hosts(self):
+        groups = place_groups(['a', 'b', 'c'], 3, 9000)
+        self.assertEqual(groups[0], ['c:9002', 'b:9001', 'a:9000'])
+        self.assertEqual({servers[-1].split(':')[0] for servers in groups}, {'a', 'b', 'c'})
+        self.assertEqual(len({address for servers in groups for address in servers}), 9)
+
+    def test_host_servers(self):
+        groups = place_groups(['a', 'b'], 2, 9000, size=1)
+        self.assertEqual(host_servers(groups, 'b'), [(['b:9001'], 'b:9001')])
+
+
+class ShardedClientTest(TestCase):
+
+    def setUp(self):
+        self.client = ShardedClient([['127.0.0.1:{}'.format(port)] for port in (8000, 8001)])
+        for group, client in enumerate(self.client.clients):
+            client.nodes = {0: FakeNode({
+                Message.MSG_WRITE: Message(message_type=Message.MSG_ACCEPTED, leader_id=0),
+                Message.MSG_MULTI_READ: Message(message_type=Message.MSG_VALUES, leader_id=0,
+                                                values=[str(group)] * 3),
+            })}
+            client.leader = client.nodes[0]
+        self.keys = ['a', 'b', 'c', 'd', 'e', 'f']
+        self.groups = [self.client.ring.group_of(key) for key in self.keys]
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_write_sent_to_group_of_key(self):
+        key = self.keys[0]
+        self.assertTrue(self.client.set(key, 'v'))
+        received = [[message.key for message in client.nodes[0].received] for client in self.client.clients]
+        self.assertIn(key, received[self.groups[0]])
+        self.assertNotIn(key, received[1 - self.groups[0]])
+
+    def test_multi_read_merged_in_key_order(self):
+        self.assertEqual(set(self.groups), {0, 1})
+        keys = [self.keys[self.groups.index(0)], self.keys[self.groups.index(1)]]
+        self.assertEqual(self.client.mget(keys), ['0', '1'])
+
+    def test_multi_write_across_groups_refused(self):
+        keys = [self.keys[self.groups.index(0)], self.keys[self.groups.index(1)]]
+        self.assertFalse(self.client.mset([(key, 'v') for key in keys]))
+        self.assertEqual([len(client.nodes[0].received) for client in self.client.clients], [0, 0])
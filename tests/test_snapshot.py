@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from paxos.core import Message
+from paxos.protocol import PaxosHandler
+from paxos.server import Server
+from paxos.store import ENGINE_MEMORY
+from tests.test_protocol import FakeRequest
+
+
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.options = dict(servers=['127.0.0.1:8000', '127.0.0.1:8001', '127.0.0.1:8002'], address='127.0.0.1:8000',
+                            storage={'engine': ENGINE_MEMORY},
+                            wal={'path': os.path.join(self.directory, 'wal', 'node{id}.log'), 'fsync': False},
+                            snapshot={'path': os.path.join(self.directory, 'node{id}.snapshot'), 'every': 3})
+        self.server = Server(**self.options)
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.directory)
+
+    def commit_slots(self, slots):
+        for slot in slots:
+            self.server.accept(Message(message_type=Message.MSG_ACCEPT_REQUEST, sender_id=2, prop_num=[2, 1],
+                                       slot=slot, batch=[['k{}'.format(slot), str(slot)]], commit_index=slot - 1))
+            self.server.learn_commit(self.server.partitions[0], slot, [2, 1], 2)
+
+    def wait_for_snapshot(self, count):
+        deadline = time.time() + 5
+        while self.server.snapshot_stats['count'] < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_snapshot_compacts_log_and_wal(self):
+        self.commit_slots(range(3))
+        self.wait_for_snapshot(1)
+        stats = self.server.snapshot_stats
+        self.assertEqual(stats['slot'], 2)
+        self.assertGreater(stats['size'], 0)
+        self.assertEqual(self.server.partitions[0].log.snapshot_index, 2)
+        self.assertEqual(self.server.partitions[0].log.entries, {})
+        self.assertEqual(self.server.wal.segments(), [self.server.wal.segment])
+
+    def test_restart_loads_snapshot_and_log_tail(self):
+        self.commit_slots(range(3))
+        self.wait_for_snapshot(1)
+        self.commit_slots([3])
+        self.server.shutdown()
+
+        self.server = Server(**self.options)
+        self.assertEqual(self.server.partitions[0].log.commit_index, 3)
+        self.assertEqual(self.server.partitions[0].log.snapshot_index, 2)
+        self.assertEqual([self.server.get('k{}'.format(slot)) for slot in range(4)], [b'0', b'1', b'2', b'3'])
+        self.assertEqual(self.server.partitions[0].highest_prepare_msg.prop_num, [2, 1])
+        self.assertGreater(self.server.snapshot_stats['restore_duration'], 0)
+
+    def test_catchup_behind_snapshot_gets_snapshot(self):
+        self.commit_slots(range(3))
+        self.wait_for_snapshot(1)
+        self.commit_slots([3])
+        request = FakeRequest()
+        PaxosHandler(Message(message_type=Message.MSG_CATCHUP, sender_id=1, from_slot=0),
+                     self.server, request).process()
+        response = request.responses[0]
+        self.assertEqual(response.snapshot['slot'], 2)
+        self.assertEqual(sorted(response.snapshot['data']), [['k0', '0'], ['k1', '1'], ['k2', '2']])
+        self.assertEqual(response.entries, [[3, [2, 1], [['k3', '3']]]])
+
+    def test_catchup_before_first_snapshot_written(self):
+        self.server.restore_data(self.server.partitions[0], 1, [['k0', '0'], ['k1', '1']])
+        self.server.snapshotter.load = lambda: None
+        request = FakeRequest()
+        PaxosHandler(Message(message_type=Message.MSG_CATCHUP, sender_id=1, from_slot=0),
+                     self.server, request).process()
+        response = request.responses[0]
+        self.assertEqual(response.snapshot['slot'], 1)
+        self.assertEqual(sorted(response.snapshot['data']), [['k0', '0'], ['k1', '1']])
+
+
+class CatchupWithoutSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(servers=['127.0.0.1:8000', '127.0.0.1:8001'], address='127.0.0.1:8000',
+                             storage={'engine': ENGINE_MEMORY})
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_installed_snapshot_sent_from_store(self):
+        self.server.restore_data(self.server.partitions[0], 4, [['k', 'v']])
+        request = FakeRequest()
+        PaxosHandler(Message(message_type=Message.MSG_CATCHUP, sender_id=1, from_slot=0),
+                     self.server, request).process()
+        response = request.responses[0]
+        self.assertEqual(response.message_type, Message.MSG_ENTRIES)
+        self.assertEqual(response.snapshot, {'slot': 4, 'data': [['k', 'v']]})
+        self.assertEqual(response.entries, [])
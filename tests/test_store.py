@@ -0,0 +1,52 @@
+from unittest import TestCase, mock
+from paxos.server import Server
+from paxos.store import MemoryEngine, RedisEngine, create_engine, ENGINE_MEMORY
+
+
+class MemoryEngineTest(TestCase):
+
+    def test_set_get(self):
+        engine = MemoryEngine()
+        engine.set('k', 'v')
+        self.assertEqual(engine.get('k'), b'v')
+        self.assertIsNone(engine.get('missing'))
+
+    def test_set_many(self):
+        engine = MemoryEngine()
+        engine.set_many([['a', '1'], ['b', 2], ['a', b'3']])
+        self.assertEqual((engine.get('a'), engine.get('b')), (b'3', b'2'))
+
+
+class RedisEngineTest(TestCase):
+
+    def test_keys_prefixed_with_node_id(self):
+        engine = RedisEngine(node_id=3)
+        engine.client = mock.Mock()
+        engine.get('k')
+        engine.client.get.assert_called_once_with('node3:k')
+        engine.set_many([['a', '1'], ['b', '2']])
+        pipe = engine.client.pipeline.return_value
+        engine.client.pipeline.assert_called_once_with(transaction=True)
+        self.assertEqual(pipe.set.call_args_list, [mock.call('node3:a', '1'), mock.call('node3:b', '2')])
+        pipe.execute.assert_called_once_with()
+
+    def test_connection_pool_shared(self):
+        engine = RedisEngine(node_id=0, host='redis.local', port=6380)
+        self.assertIs(engine.client.connection_pool, engine.pool)
+        self.assertEqual(engine.pool.connection_kwargs['host'], 'redis.local')
+        self.assertEqual(engine.pool.connection_kwargs['db'], 0)
+
+
+class StoreMixinTest(TestCase):
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            create_engine(0, engine='unknown')
+
+    def test_server_storage_from_settings(self):
+        server = Server(servers=['127.0.0.1:8000', '127.0.0.1:8001'], address='127.0.0.1:8001',
+                        storage={'engine': ENGINE_MEMORY})
+        server.shutdown()
+        server.set_many([['k', 'v']])
+        self.assertIsInstance(server.storage, MemoryEngine)
+        self.assertEqual(server.get('k'), b'v')
@@ -0,0 +1,109 @@
+import io
+from unittest import TestCase
+from paxos.core import Message, WIRE_BINARY, WIRE_JSON
+from paxos.protocol import PaxosHandler
+from paxos.server import Server
+from paxos.tracing import DEBUG, INFO, Tracer, format_record
+from tests.test_protocol import FakeNode, FakeRequest
+
+
+class Formatted(object):
+    """
+    Counts how many times it was formatted.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __format__(self, spec):
+        self.count += 1
+        return 'formatted'
+
+
+class TracerTest(TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+
+    def test_records_below_level_are_not_formatted(self):
+        tracer = Tracer(level=INFO, stream=self.stream)
+        argument = Formatted()
+        tracer.debug(1, 'value {}', argument)
+        self.assertEqual(argument.count, 0)
+        self.assertEqual(tracer.dump(), [])
+
+    def test_records_formatted_when_dumped(self):
+        tracer = Tracer(level=DEBUG, echo=INFO, stream=self.stream)
+        argument = Formatted()
+        tracer.debug(7, 'value {}', argument)
+        self.assertEqual(argument.count, 0)
+        self.assertEqual(self.stream.getvalue(), '')
+        [record] = tracer.dump()
+        self.assertEqual(record[1:], ['DEBUG', 7, 'value formatted'])
+        self.assertTrue(format_record(record, 'server 0').endswith('server 0 [0000000000000007] value formatted'))
+
+    def test_echo(self):
+        tracer = Tracer(stream=self.stream)
+        tracer.info(None, 'Starting server {}', 2)
+        self.assertIn('INFO    Starting server 2\n', self.stream.getvalue())
+
+    def test_ring_buffer_keeps_latest(self):
+        tracer = Tracer(level=DEBUG, capacity=3, stream=self.stream)
+        for trace_id in range(5):
+            tracer.debug(trace_id, 'request')
+        self.assertEqual([record[2] for record in tracer.dump()], [2, 3, 4])
+        self.assertEqual([record[2] for record in tracer.dump(trace_id=3)], [3])
+        self.assertEqual([record[2] for record in tracer.dump(limit=1)], [4])
+
+    def test_sampling_by_trace_id(self):
+        tracers = [Tracer(level=DEBUG, sample=0.1, stream=self.stream) for _ in range(2)]
+        for tracer in tracers:
+            for trace_id in range(1000, 3000):
+                tracer.debug(trace_id, 'request')
+            tracer.info(None, 'event')
+        kept = [[record[2] for record in tracer.dump()] for tracer in tracers]
+        self.assertEqual(kept[0], kept[1])
+        self.assertTrue(150 < len(kept[0]) < 250)
+        self.assertIsNone(kept[0][-1])
+
+
+class TraceIdTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(servers=['127.0.0.1:{}'.format(port) for port in range(8000, 8003)],
+                             address='127.0.0.1:8000', storage={'engine': 'memory'},
+                             tracing={'level': 'debug', 'echo': 'off'})
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_trace_id_in_both_wire_formats(self):
+        message = Message(message_type=Message.MSG_READ, key='k', trace_id=2 ** 62, request_id=3)
+        for wire_format in (WIRE_BINARY, WIRE_JSON):
+            decoded = Message.unserialize(message.serialize(wire_format))
+            self.assertEqual((decoded.trace_id, decoded.request_id), (2 ** 62, 3))
+        self.assertIsNone(Message.unserialize(Message(message_type=Message.MSG_READ).serialize(WIRE_BINARY)).trace_id)
+
+    def test_trace_id_passed_to_acceptors(self):
+        nodes = [FakeNode({Message.MSG_PREPARE: Message(message_type=Message.MSG_PROMISE, accepted=[]),
+                           Message.MSG_ACCEPT_REQUEST: Message(message_type=Message.MSG_ACCEPTED)})
+                 for _ in range(2)]
+        self.server.nodes = dict(enumerate(nodes, start=1))
+        request = FakeRequest()
+        write = Message(message_type=Message.MSG_WRITE, key='k', value='v', trace_id=42)
+        PaxosHandler(write, self.server, request).process()
+        self.assertEqual([message.message_type for message in nodes[0].received],
+                         [Message.MSG_PREPARE, Message.MSG_ACCEPT_REQUEST])
+        self.assertEqual({message.trace_id for node in nodes for message in node.received}, {42})
+        self.assertEqual(request.responses[0].trace_id, 42)
+        records = self.server.tracer.dump(trace_id=42)
+        self.assertIn('WRITE REQUEST: key=k, value=v', [record[3] for record in records])
+
+    def test_trace_message(self):
+        self.server.tracer.configure(level='info')
+        request = FakeRequest()
+        trace = Message(message_type=Message.MSG_TRACE, level='info', settings={'level': 'debug'})
+        PaxosHandler(Message.unserialize(trace.serialize(WIRE_BINARY)), self.server, request).process()
+        self.assertEqual(self.server.tracer.level, DEBUG)
+        self.assertEqual(request.responses[0].message_type, Message.MSG_TRACE)
+        self.assertIsInstance(request.responses[0].records, list)
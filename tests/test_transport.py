@@ -0,0 +1,122 @@
+import time
+from unittest import TestCase
+from paxos.client import Client
+from paxos.core import Message
+from paxos.protocol import PaxosHandler
+from paxos.server import Server
+from paxos.transport import SimulatedNetwork, VirtualClock
+from tests.test_protocol import FakeRequest
+
+
+class SimulatedClusterTest(TestCase):
+
+    def setUp(self):
+        self.servers = []
+        self.client = None
+
+    def start(self, network, size=3):
+        self.network = network
+        self.addresses = ['sim:{}'.format(port) for port in range(8000, 8000 + size)]
+        self.servers = [Server(servers=self.addresses, address=address, storage={'engine': 'memory'},
+                               transport=network)
+                        for address in self.addresses]
+        self.client = Client(servers=self.addresses, transport=network)
+        self.servers[-1].handle_heartbeat_timeout()
+        self.leader = self.servers[-1]
+
+    def tearDown(self):
+        if self.client is not None:
+            self.client.close()
+        for server in self.servers:
+            server.shutdown()
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_write_replicated_in_one_process(self):
+        self.start(SimulatedNetwork())
+        self.assertEqual(self.leader.leader_id, self.leader.id)
+        self.assertTrue(self.client.set('k', 'v'))
+        self.assertTrue(self.client.set('other', 'v'))    # tells followers that the first write is committed
+        self.assertTrue(self.wait_for(lambda: all(server.get('k') == b'v' for server in self.servers)))
+        self.assertEqual(self.client.get('k'), 'v')
+
+    def test_virtual_clock_accounts_latency(self):
+        clock = VirtualClock()
+        self.start(SimulatedNetwork(latency=0.2, clock=clock))
+        start = time.time()
+        self.assertTrue(self.client.set('k', 'v'))
+        self.assertLess(time.time() - start, 1)
+        self.assertGreaterEqual(clock.now(), 1.2)
+
+    def test_leader_partitioned_from_quorum_cannot_commit(self):
+        self.start(SimulatedNetwork(clock=VirtualClock()))
+        self.assertTrue(self.client.set('k', '1'))
+        self.network.partition([self.leader.address])
+        request = FakeRequest()
+        PaxosHandler(Message(message_type=Message.MSG_WRITE, key='k', value='2'), self.leader, request).process()
+        self.assertEqual(request.responses[0].message_type, Message.MSG_WRITE_NACK)
+        self.assertGreater(self.network.stats['lost'], 0)
+        self.assertEqual(self.leader.get('k'), b'1')
+        self.network.heal()
+        self.assertTrue(self.client.set('k', '3'))
+
+    def test_loss_is_reproducible(self):
+        runs = []
+        for _ in range(2):
+            network = SimulatedNetwork(loss=0.5, seed=7, clock=VirtualClock())
+            runs.append([network._transit('a', 'b') is None for _ in range(20)])
+        self.assertEqual(runs[0], runs[1])
+        self.assertIn(True, runs[0])
+        self.assertIn(False, runs[0])
+
+
+class FailoverTest(SimulatedClusterTest):
+
+    def start_followed(self):
+        self.start(SimulatedNetwork())
+        self.assertTrue(self.wait_for(lambda: all(server.leader_id == self.leader.id for server in self.servers)))
+        self.assertTrue(self.client.set('k', '1'))
+
+    def test_new_leader_within_a_second(self):
+        self.start_followed()
+        self.leader.shutdown()
+        start = time.time()
+        while not self.client.set('k', '2') and time.time() - start < 5:
+            pass
+        self.assertLess(time.time() - start, 1)
+        self.assertIn(self.client.leader.node_id, (0, 1))
+
+    def test_highest_id_elected_on_start(self):
+        network = SimulatedNetwork()
+        addresses = ['sim:{}'.format(port) for port in range(8000, 8003)]
+        self.servers = [Server(servers=addresses, address=address, storage={'engine': 'memory'}, transport=network)
+                        for address in addresses]
+        self.assertTrue(self.wait_for(lambda: all(server.leader_id == 2 for server in self.servers)))
+
+    def test_isolated_follower_does_not_take_over(self):
+        self.start_followed()
+        isolated = self.servers[0]
+        self.network.partition([isolated.address])
+        self.assertTrue(self.wait_for(lambda: isolated.metrics.counters.get('pre_votes_lost', 0) > 0))
+        self.assertEqual(isolated.metrics.counters.get('elections_won', 0), 0)
+        self.network.heal()
+        self.assertTrue(self.wait_for(lambda: isolated.leader_id == self.leader.id))
+        self.assertEqual(self.leader.leader_id, self.leader.id)
+        self.assertTrue(self.client.set('k', '2'))
+
+    def test_partitioned_leader_steps_down(self):
+        self.start_followed()
+        old = self.leader
+        self.network.partition([old.address])
+        self.assertTrue(self.wait_for(lambda: old.metrics.counters.get('step_downs', 0) > 0))
+        self.assertNotEqual(old.leader_id, old.id)
+        self.assertTrue(self.wait_for(lambda: any(server.leader_id == server.id for server in self.servers[:2])))
+        new = next(server for server in self.servers[:2] if server.leader_id == server.id)
+        self.network.heal()
+        self.assertTrue(self.wait_for(lambda: old.leader_id == new.id))
+        self.assertEqual([server.leader_id for server in self.servers], [new.id] * 3)
+        self.assertTrue(self.client.set('k', '2'))
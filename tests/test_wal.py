@@ -0,0 +1,93 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, mock
+from paxos.core import Message
+from paxos.server import Server
+from paxos.store import ENGINE_MEMORY
+from paxos.tracing import Tracer
+from paxos.wal import WriteAheadLog
+
+
+class WriteAheadLogTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'node.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay_records(self):
+        wal = WriteAheadLog(self.path)
+        wal.append(['p', 1, [1, 2]])
+        wal.append(['a', 1, [1, 2], 0, [['k', 'v']]], sync=False)
+        wal.close()
+        self.assertEqual(WriteAheadLog(self.path).replay(), [['p', 1, [1, 2]], ['a', 1, [1, 2], 0, [['k', 'v']]]])
+
+    def test_incomplete_record_truncated(self):
+        wal = WriteAheadLog(self.path)
+        wal.append(['p', 1, [1, 2]])
+        wal.close()
+        segment_path = wal.segment_path(wal.segment)
+        size = os.path.getsize(segment_path)
+        with open(segment_path, 'ab') as stream:
+            stream.write(b'\x00\x00\x00\x10\x00')
+        tracer = Tracer(stream=io.StringIO())
+        wal = WriteAheadLog(self.path, tracer=tracer)
+        self.assertEqual(wal.replay(), [['p', 1, [1, 2]]])
+        self.assertEqual(os.path.getsize(segment_path), size)
+        self.assertIn('Truncating 5 bytes', tracer.dump(level='warning')[0][3])
+        wal.append(['p', 2, [2, 2]])
+        self.assertEqual(wal.replay(), [['p', 1, [1, 2]], ['p', 2, [2, 2]]])
+
+    def test_concurrent_writers_share_fsync(self):
+        wal = WriteAheadLog(self.path, flush_interval=0.1)
+        with mock.patch('paxos.wal.os.fsync') as fsync:
+            threads = [threading.Thread(target=wal.append, args=(['p', i, [i, 1]],)) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertLess(fsync.call_count, 10)
+        self.assertEqual(len(wal.replay()), 10)
+
+    def test_rotate_and_remove_segments(self):
+        wal = WriteAheadLog(self.path)
+        wal.append(['p', 1, [1, 1]])
+        last = wal.rotate()
+        wal.append(['p', 2, [2, 1]])
+        self.assertEqual(wal.segments(), [last, last + 1])
+        wal.remove_segments(last)
+        self.assertEqual(wal.replay(), [['p', 2, [2, 1]]])
+
+
+class ServerRecoveryTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.options = dict(servers=['127.0.0.1:8000', '127.0.0.1:8001', '127.0.0.1:8002'], address='127.0.0.1:8000',
+                            storage={'engine': ENGINE_MEMORY},
+                            wal={'path': os.path.join(self.directory, 'node{id}.log'), 'fsync': False})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_restart_restores_acceptor_state(self):
+        server = Server(**self.options)
+        server.promise(Message(message_type=Message.MSG_PREPARE, sender_id=2, prop_num=[2, 5], from_slot=0))
+        for slot in range(2):
+            server.accept(Message(message_type=Message.MSG_ACCEPT_REQUEST, sender_id=2, prop_num=[2, 5],
+                                  slot=slot, batch=[['k', str(slot)]], commit_index=-1))
+        server.learn_commit(server.partitions[0], 0, [2, 5], 2)
+        server.shutdown()
+
+        server = Server(**self.options)
+        self.assertEqual(server.partitions[0].highest_prepare_msg.prop_num, [2, 5])
+        self.assertEqual(server.partitions[0].get_next_prop_num().as_list(), [0, 6])
+        self.assertEqual(server.partitions[0].log.commit_index, 0)
+        self.assertEqual(server.partitions[0].log.accepted_from(1), [[1, [2, 5], [['k', '1']]]])
+        self.assertEqual(server.get('k'), b'0')
+        server.shutdown()